@@ -0,0 +1,307 @@
+"""
+Content-addressed caching and request coalescing for AI flashcard generation
+and document uploads.
+"""
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar, Union
+
+from fastapi import UploadFile
+
+from app.config import settings
+from app.AI.metrics import metrics
+from app.AI.uploads import upload_digest
+
+T = TypeVar("T")
+
+# Remote files are kept for 48 hours when the API does not report an expiry
+UPLOAD_DEFAULT_LIFETIME_SECONDS = 48 * 60 * 60
+
+
+async def generation_cache_key(
+    input_types: str,
+    number: int,
+    input_content: Optional[str] = None,
+    files: Optional[Union[UploadFile, List[UploadFile]]] = None
+) -> str:
+    """
+    Build a cache key from the inputs of a generation request.
+
+    Args:
+        input_types: Type of input (topic, text, image, document)
+        number: Number of flashcards requested
+        input_content: Text content for topic or text input types
+        files: File(s) for image or document input types
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    input_type = getattr(input_types, "value", input_types)
+
+    # Collapse whitespace so trivially different pastes share an entry;
+    # topics are also case-insensitive
+    content = " ".join((input_content or "").split())
+    if input_type == "topic":
+        content = content.casefold()
+
+    digest = hashlib.sha256()
+    digest.update(f"{input_type}\0{number}\0{content}\0".encode("utf-8"))
+
+    if files:
+        if not isinstance(files, list):
+            files = [files]
+        for file in files:
+            digest.update(bytes.fromhex(await upload_digest(file)))
+            # Image cards name their source file, so a cached result must
+            # not hand one user's file names to another
+            if input_type == "image":
+                digest.update(f"{file.filename}\0".encode("utf-8"))
+
+    return digest.hexdigest()
+
+
+class GenerationCache:
+    """LRU + TTL cache of generation results with an optional SQLite tier"""
+
+    def __init__(self, max_entries: int, ttl_seconds: float, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._db = None
+        self._db_lock = threading.Lock()
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS generation_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return the cached result for key, or None on a miss"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                metrics.incr("generation_cache_hits")
+                return value
+            # Expired, drop it and fall through to the persistent tier
+            del self._entries[key]
+            metrics.incr("generation_cache_expirations")
+
+        if self._db is not None:
+            row = await asyncio.to_thread(self._db_get, key, now)
+            if row is not None:
+                value, expires_at = row
+                self._remember(key, value, expires_at)
+                metrics.incr("generation_cache_hits")
+                metrics.incr("generation_cache_persistent_hits")
+                return value
+
+        metrics.incr("generation_cache_misses")
+        return None
+
+    async def set(self, key: str, value: str) -> None:
+        """Store a result under key"""
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, expires_at)
+        if self._db is not None:
+            await asyncio.to_thread(self._db_set, key, value, expires_at)
+
+    def stats(self) -> dict:
+        """Return the current size and configuration of the cache"""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "persistent": self._db is not None,
+        }
+
+    def _remember(self, key: str, value: str, expires_at: float) -> None:
+        """Insert into the in-memory tier, evicting the least recently used entries"""
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            metrics.incr("generation_cache_evictions")
+        metrics.set_gauge("generation_cache_entries", len(self._entries))
+
+    def _db_get(self, key: str, now: float) -> Optional[tuple]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM generation_cache WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+        return row
+
+    def _db_set(self, key: str, value: str, expires_at: float) -> None:
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO generation_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at)
+            )
+            # Prune expired rows so the table does not grow without bound
+            self._db.execute("DELETE FROM generation_cache WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one shared call"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]], caller_inputs: bool = False) -> T:
+        """
+        Run fn for key, or join the call already in flight for key.
+
+        The shared call is shielded so one caller going away does not
+        cancel it for the others. When the last caller is cancelled, the
+        call is cancelled too, unless DISCONNECT_KEEP_RESULTS lets it finish
+        into its cache.
+
+        A call that reads inputs of the caller that started it, such as the
+        uploads of its request, cannot outlive that caller: FastAPI closes
+        a request's uploads when it ends. With caller_inputs the call is
+        cancelled when its starter leaves, and every remaining caller runs
+        it again with its own fn.
+
+        Args:
+            key: Identity of the call, e.g. a generation cache key
+            fn: Coroutine function performing the call
+            caller_inputs: Whether fn reads inputs owned by its caller
+
+        Returns:
+            The result of the shared call
+        """
+        while True:
+            call = self._calls.get(key)
+            started = call is None
+            if not started:
+                metrics.incr(f"{self.name}_coalesced")
+            else:
+                call = asyncio.ensure_future(fn())
+                self._calls[key] = call
+                metrics.set_gauge(f"{self.name}_inflight", len(self._calls))
+
+                call.add_done_callback(lambda _, call=call: self._forget(key, call))
+
+            self._waiters[call] = self._waiters.get(call, 0) + 1
+            try:
+                return await asyncio.shield(call)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling() == 0:
+                    # Only the shared call was cancelled, its starter left with the inputs
+                    metrics.incr(f"{self.name}_restarted")
+                    continue
+                if not call.done() and (self._waiters.get(call) == 1 or (started and caller_inputs)):
+                    if settings.DISCONNECT_KEEP_RESULTS and not caller_inputs:
+                        metrics.incr(f"{self.name}_abandoned_kept")
+                    else:
+                        # Forget the call first so later identical callers start a fresh one
+                        self._forget(key, call)
+                        call.cancel()
+                        metrics.incr(f"{self.name}_cancelled")
+                raise
+            finally:
+                if call in self._waiters:
+                    self._waiters[call] -= 1
+
+    def _forget(self, key: str, call: asyncio.Future) -> None:
+        # A cancelled call may already have been replaced by a new one for key
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        self._waiters.pop(call, None)
+        metrics.set_gauge(f"{self.name}_inflight", len(self._calls))
+
+def upload_cache_key(digest: str, mime_type: Optional[str]) -> str:
+    """Build an upload cache key from a document's SHA-256 digest and mime type"""
+    return f"{digest}:{mime_type}"
+
+
+class UploadCache:
+    """Maps document content hashes to remote file handles until they expire"""
+
+    def __init__(self, max_entries: int, expiry_margin_seconds: float):
+        self.max_entries = max_entries
+        self.expiry_margin_seconds = expiry_margin_seconds
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the remote file for key if it is still valid"""
+        entry = self._entries.get(key)
+        if entry is not None and entry["expires_at"] > time.time():
+            self._entries.move_to_end(key)
+            metrics.incr("upload_cache_hits")
+            return entry["file"]
+        if entry is not None:
+            # Expired remotely, forget it so the document is uploaded again
+            del self._entries[key]
+            metrics.incr("upload_cache_expirations")
+        metrics.incr("upload_cache_misses")
+        return None
+
+    def put(self, key: str, file: Any) -> None:
+        """Remember an uploaded file until shortly before its remote expiry"""
+        expiration = getattr(file, "expiration_time", None)
+        if expiration is not None:
+            expires_at = expiration.timestamp() - self.expiry_margin_seconds
+        else:
+            expires_at = time.time() + UPLOAD_DEFAULT_LIFETIME_SECONDS - self.expiry_margin_seconds
+
+        self._entries[key] = {"file": file, "expires_at": expires_at, "owners": set()}
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        metrics.set_gauge("upload_cache_entries", len(self._entries))
+
+    def add_owner(self, key: str, owner: Optional[str]) -> None:
+        """Record that owner uploaded or reused the document cached under key"""
+        entry = self._entries.get(key)
+        if entry is not None and owner is not None:
+            entry["owners"].add(owner)
+
+    def entries(self, owner: Optional[str] = None) -> List[dict]:
+        """Describe the cached uploads and when they expire, only those of owner if given"""
+        now = time.time()
+        return [
+            {
+                "key": key,
+                "name": getattr(entry["file"], "name", None),
+                "uri": getattr(entry["file"], "uri", None),
+                "mime_type": getattr(entry["file"], "mime_type", None),
+                "expires_at": entry["expires_at"],
+                "expired": entry["expires_at"] <= now,
+            }
+            for key, entry in self._entries.items()
+            if owner is None or owner in entry["owners"]
+        ]
+
+
+# Shared cache used by the generator
+generation_cache = GenerationCache(
+    max_entries=settings.GENERATION_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.GENERATION_CACHE_TTL_SECONDS,
+    db_path=settings.GENERATION_CACHE_DB_PATH or None,
+)
+
+# In-flight generations shared between identical concurrent requests
+generation_inflight = SingleFlight("generation")
+
+# Remote handles of uploaded documents, keyed by content hash
+upload_cache = UploadCache(
+    max_entries=settings.UPLOAD_CACHE_MAX_ENTRIES,
+    expiry_margin_seconds=settings.UPLOAD_CACHE_EXPIRY_MARGIN_SECONDS,
+)
+
+# In-flight document uploads shared between identical concurrent uploads
+upload_inflight = SingleFlight("upload")
@@ -0,0 +1,104 @@
+"""
+Cancellation of AI requests whose client has disconnected.
+
+FastAPI keeps running a request handler after the client goes away, so a
+long generation would finish its uploads and model calls, and save a deck,
+for nobody. cancel_on_disconnect runs the generation next to a watcher that
+polls the connection every DISCONNECT_POLL_SECONDS, and cancels it once the
+client is gone. The cancellation reaches the uploads, retries and model
+calls below it, and releases their scheduler slots.
+
+Generations shared by identical requests keep running while any caller is
+still waiting. Once the last caller has gone they are cancelled, or, with
+DISCONNECT_KEEP_RESULTS, finished into the generation cache so a retry of
+the same request is served without another model call.
+"""
+import asyncio
+from typing import AsyncIterator, Awaitable, TypeVar
+
+from starlette.requests import Request
+
+from app.config import settings
+from app.AI.metrics import metrics
+
+T = TypeVar("T")
+
+# Status code reported for requests closed by the client, as nginx logs them
+CLIENT_CLOSED_REQUEST = 499
+
+
+class ClientDisconnected(Exception):
+    """Raised when the client of a request disconnected before it finished"""
+
+
+async def _wait_for_disconnect(request: Request) -> None:
+    while not await request.is_disconnected():
+        await asyncio.sleep(settings.DISCONNECT_POLL_SECONDS)
+
+
+async def cancel_on_disconnect(request: Request, work: Awaitable[T], endpoint: str) -> T:
+    """
+    Await work, cancelling it if the client disconnects first.
+
+    Args:
+        request: Request whose connection is watched
+        work: Coroutine or awaitable doing the request's work
+        endpoint: Endpoint name used as the metrics label
+
+    Returns:
+        The result of work
+
+    Raises:
+        ClientDisconnected: If the client disconnected before work finished
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            # Let the cancellation unwind through the uploads and model calls
+            await asyncio.gather(task, return_exceptions=True)
+
+    if task.cancelled():
+        if watcher.done() and not watcher.cancelled():
+            metrics.incr("ai_requests_cancelled", endpoint=endpoint)
+            raise ClientDisconnected("The client closed the request")
+        # Cancelled from below, e.g. a shared generation abandoned by its other callers
+        raise RuntimeError("The generation was cancelled, please try again")
+    return task.result()
+
+
+async def ensure_connected(request: Request, endpoint: str) -> None:
+    """
+    Check the client is still connected before work that would be wasted.
+
+    Raises:
+        ClientDisconnected: If the client has disconnected
+    """
+    if await request.is_disconnected():
+        metrics.incr("ai_requests_cancelled", endpoint=endpoint)
+        raise ClientDisconnected("The client closed the request")
+
+
+async def iterate_until_disconnected(request: Request, items: AsyncIterator[T], endpoint: str) -> AsyncIterator[T]:
+    """
+    Yield from an async iterator, cancelling it if the client disconnects.
+
+    The connection is also watched while the next item is awaited, e.g.
+    before a streamed model response produces its first chunk.
+
+    Raises:
+        ClientDisconnected: If the client disconnected before the last item
+    """
+    try:
+        while True:
+            try:
+                item = await cancel_on_disconnect(request, items.__anext__(), endpoint)
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        await items.aclose()
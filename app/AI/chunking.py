@@ -0,0 +1,96 @@
+"""
+Splitting of long text inputs for map-reduce flashcard generation.
+"""
+import re
+from typing import List
+
+# Sentence ends followed by whitespace, keeping the punctuation with the sentence
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+_PARAGRAPH_BOUNDARY = re.compile(r"\n\s*\n")
+
+
+def split_text(text: str, max_chars: int) -> List[str]:
+    """
+    Split text into chunks of at most max_chars characters.
+
+    Paragraph boundaries are preferred, then sentence boundaries. A single
+    sentence longer than max_chars is split between words as a last resort.
+
+    Args:
+        text: Text to split
+        max_chars: Maximum length of each chunk
+
+    Returns:
+        list: Chunks in document order
+    """
+    pieces = []
+    for paragraph in _PARAGRAPH_BOUNDARY.split(text.strip()):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+            continue
+        for sentence in _SENTENCE_BOUNDARY.split(paragraph):
+            if len(sentence) <= max_chars:
+                pieces.append(sentence)
+            else:
+                pieces.extend(_split_words(sentence, max_chars))
+
+    # Greedily pack consecutive pieces back together up to the limit
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + 2 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+
+    return chunks
+
+
+def allocate_counts(number: int, weights: List[int]) -> List[int]:
+    """
+    Share number between chunks in proportion to their weights.
+
+    Uses the largest remainder method so the shares always add up to number.
+    Chunks can receive 0 when number is smaller than the number of chunks.
+
+    Args:
+        number: Total number of flashcards to distribute
+        weights: Relative size of each chunk
+
+    Returns:
+        list: Number of flashcards for each chunk
+    """
+    total = sum(weights)
+    if total <= 0:
+        return [0] * len(weights)
+
+    exact = [number * weight / total for weight in weights]
+    counts = [int(share) for share in exact]
+    remainder = number - sum(counts)
+
+    by_fraction = sorted(range(len(weights)), key=lambda i: exact[i] - counts[i], reverse=True)
+    for i in by_fraction[:remainder]:
+        counts[i] += 1
+
+    return counts
+
+
+def _split_words(sentence: str, max_chars: int) -> List[str]:
+    """Split an overlong sentence between words"""
+    parts = []
+    current = ""
+    for word in sentence.split():
+        if current and len(current) + 1 + len(word) > max_chars:
+            parts.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        parts.append(current)
+    return parts
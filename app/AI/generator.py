@@ -1,31 +1,83 @@
-from google import genai
 from google.genai import types
-from pydantic import BaseModel
-from app.AI.utils import load_images, upload_documents
+from pydantic import BaseModel, TypeAdapter
+from app.AI.utils import load_images, load_named_images, upload_documents
 from fastapi import File, UploadFile
-from app.AI.prompts import system_message, prompt_flashforge
+from app.AI.prompts import (
+    system_message, prompt_flashforge, prompt_outline, prompt_subtopic, prompt_exclusions,
+    prompt_image_batch, image_label, prompt_transform
+)
+from app.AI.cache import generation_cache, generation_cache_key, generation_inflight
+from app.AI.parsing import IncrementalCardParser, parse_cards, salvage_cards
+from app.AI.chunking import split_text, allocate_counts
+from app.flashcards.dedup import NearDuplicateIndex, card_signature, filter_near_duplicates
+from app.AI.scheduler import Priority, SchedulerOverloaded, scheduler
+from app.AI.cancellation import ClientDisconnected
+from app.AI.tokens import (
+    OUTPUT_BUDGET_FRACTION, estimate_output_tokens, estimate_prompt_tokens, estimate_tokens, max_cards_per_call
+)
+from app.AI.providers import ModelResponse, get_provider
+from app.AI.tracing import record_cache_hit, record_span, record_usage, span
+from app.AI.metrics import metrics
+from app.AI.resilience import attempt_started, resilient_call
+from app.AI.routing import Route, choose_route, record_route
+from app.AI.preflight import preflight_text
 import os
 from dotenv import load_dotenv
-from typing import List, Optional, Union
+from typing import AsyncIterator, List, Optional, Union
+import asyncio
+import dataclasses
 import json
+import math
+import time
 
 load_dotenv()
 
-# Use the key from settings
 from app.config import settings
-client = genai.Client(api_key=settings.LLM_API_KEY)
+
+# Extra share of cards requested when fanning out, absorbs duplicates between sub-requests
+FANOUT_OVERSAMPLE = 0.1
+OUTLINE_MAX_OUTPUT_TOKENS = 1024
 
 class Flashcard(BaseModel):
     """Flashcard model for API request and response."""
     question: str
     answer: str
+    source: Optional[str] = None  # Name of the image a card was generated from
+
+class _CardSchema(BaseModel):
+    """Response schema of one generated card."""
+    question: str
+    answer: str
+
+class _SourcedCardSchema(_CardSchema):
+    """Response schema of a card from a multi-image call, naming its image."""
+    source: str
+
+class _TransformedCardSchema(_CardSchema):
+    """Response schema of a rewritten card, keyed by the id of the original."""
+    id: int
+
+_TransformedCardList = TypeAdapter(List[_TransformedCardSchema])
+
+# Output tokens of a transformed card relative to the original card
+TRANSFORM_OUTPUT_GROWTH = {"translate": 1.5, "simplify": 1.0, "expand_answers": 3.0}
+# Output tokens per card for its id and JSON keys
+TRANSFORM_CARD_OVERHEAD_TOKENS = 15
+
+# Converts generated card lists to and from their cached JSON form
+FlashcardList = TypeAdapter(List[Flashcard])
+
+# Errors that end a whole request, never absorbed as one failed chunk or call
+_REQUEST_ERRORS = (SchedulerOverloaded, ClientDisconnected, asyncio.CancelledError)
 
 async def generate_flashcards(
     input_types: str, 
     number: int, 
     input_content: Optional[str] = None, 
-    files: Optional[Union[UploadFile, List[UploadFile]]] = None
-):
+    files: Optional[Union[UploadFile, List[UploadFile]]] = None,
+    user_id: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE
+) -> List[Flashcard]:
     """Generate flashcards based on the input provided.
     
     Args:
@@ -33,68 +85,845 @@ async def generate_flashcards(
         number: Number of flashcards to generate
         input_content: Text content for topic or text input types
         files: File(s) for image or document input types
+        user_id: User the generation is for, used for fair scheduling
+        priority: Scheduling priority of the model calls
+        
+    Returns:
+        list: Validated Flashcard objects, fewer than number if some model
+        calls failed
+    """
+    # Compact text inputs and enforce their size limit before any model call
+    if input_types == "text":
+        with span("preflight"):
+            input_content = preflight_text(input_content)
+    
+    # Identical requests are served from the cache without calling the model
+    with span("cache"):
+        cache_key = await generation_cache_key(input_types, number, input_content, files)
+        cached = await generation_cache.get(cache_key)
+    if cached is not None:
+        record_cache_hit()
+        return FlashcardList.validate_json(cached)[:number]
+    
+    # Concurrent identical requests share one upstream call; each caller
+    # still gets the result back to save into its own deck. Calls are only
+    # shared within a priority class, so an interactive request never waits
+    # behind a bulk job's queued call. Results short of number, after failed
+    # calls or duplicates, are returned but not cached
+    async def generate_and_cache() -> List[Flashcard]:
+        result = await _generate(input_types, number, input_content, files, user_id, priority)
+        if len(result) == number:
+            await generation_cache.set(cache_key, FlashcardList.dump_json(result, exclude_none=True).decode())
+        return result
+    
+    # A generation reads its starter's uploads, so it stops when that request does
+    return await generation_inflight.do(f"{priority.name}:{cache_key}", generate_and_cache, caller_inputs=bool(files))
+
+async def generate_flashcards_stream(
+    input_types: str, 
+    number: int, 
+    input_content: Optional[str] = None, 
+    files: Optional[Union[UploadFile, List[UploadFile]]] = None,
+    user_id: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE
+) -> AsyncIterator[dict]:
+    """Generate flashcards, yielding each card as soon as it has been parsed.
+    
+    Args:
+        input_types: Type of input (topic, text, image, document)
+        number: Number of flashcards to generate
+        input_content: Text content for topic or text input types
+        files: File(s) for image or document input types
+        user_id: User the generation is for, used for fair scheduling
+        priority: Scheduling priority of the model call
+        
+    Yields:
+        dict: Flashcard with "question" and "answer" keys
+    """
+    if input_types == "text":
+        with span("preflight"):
+            input_content = preflight_text(input_content)
+    
+    with span("cache"):
+        cache_key = await generation_cache_key(input_types, number, input_content, files)
+        cached = await generation_cache.get(cache_key)
+    if cached is not None:
+        record_cache_hit()
+        for card in json.loads(cached)[:number]:
+            yield card
+        return
+    
+    prompt = await _build_prompt(input_types, number, input_content, files, user_id)
+    parser = IncrementalCardParser()
+    seen = NearDuplicateIndex()
+    cards = []
+    first_chunk_at = None
+    
+    input_tokens = estimate_prompt_tokens(prompt)
+    route = choose_route(input_types, input_tokens, number)
+    status = "error"
+    queued = time.perf_counter()
+    try:
+        tokens = input_tokens + estimate_output_tokens(number)
+        async with scheduler.slot(user_id, priority, tokens):
+            started = time.perf_counter()
+            record_span("queue", started - queued)
+            
+            async def open_stream():
+                stream = get_provider().generate_stream(
+                    model=route.model,
+                    contents=prompt,
+                    config=_generation_config(max_output_tokens=route.max_output_tokens)
+                )
+                try:
+                    first = await asyncio.wait_for(stream.__anext__(), timeout=settings.LLM_TIMEOUT_SECONDS)
+                except BaseException:
+                    await stream.aclose()
+                    raise
+                return stream, first
+            
+            # Nothing has been sent until the first chunk arrives, so only
+            # opening the stream is retried
+            try:
+                stream, chunk = await resilient_call("stream", open_stream, hedge=False)
+            except StopAsyncIteration:
+                stream, chunk = None, None
+            
+            try:
+                while chunk is not None:
+                    # Time to first output, what a streaming client waits for
+                    if first_chunk_at is None:
+                        first_chunk_at = time.perf_counter()
+                        record_span("first_chunk", first_chunk_at - started)
+                    
+                    parse_started = time.perf_counter()
+                    parsed = parser.feed(chunk)
+                    record_span("parse", time.perf_counter() - parse_started)
+                    
+                    for card in parsed:
+                        # Skip near-duplicates of cards already sent
+                        signature = card_signature(card["question"], card["answer"])
+                        if seen.find(signature):
+                            continue
+                        seen.add(len(cards), signature)
+                        cards.append(card)
+                        yield card
+                        if len(cards) >= number:
+                            break
+                    
+                    # Cards past number are never sent, stop reading the model
+                    if len(cards) >= number:
+                        break
+                    
+                    # Apply the timeout to each chunk so a long stream is not cut off
+                    # as long as the model keeps producing output
+                    try:
+                        chunk = await asyncio.wait_for(
+                            stream.__anext__(), 
+                            timeout=settings.LLM_TIMEOUT_SECONDS
+                        )
+                    except StopAsyncIteration:
+                        chunk = None
+            finally:
+                # Close the upstream stream too when the consumer stops early
+                if stream is not None:
+                    await stream.aclose()
+            
+            record_span("model", time.perf_counter() - started)
+            status = "ok"
+    
+    except asyncio.TimeoutError:
+        print(f"Error streaming flashcards: no model output for {settings.LLM_TIMEOUT_SECONDS}s")
+        raise TimeoutError(f"AI generation timed out after {settings.LLM_TIMEOUT_SECONDS} seconds")
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    
+    finally:
+        record_route("stream", route, time.perf_counter() - queued, status)
+    
+    if not cards:
+        raise ValueError("Failed to parse AI response: no flashcards in streamed output")
+    
+    # A stream is one call and never fans out, so it can fall short of number.
+    # Only full results are cached, /generate shares the cache key
+    if len(cards) < number:
+        print(f"Warning: streamed {len(cards)} of {number} requested flashcards")
+    else:
+        await generation_cache.set(cache_key, json.dumps(cards[:number]))
+
+async def generate_more_flashcards(
+    input_types: str, 
+    number: int, 
+    input_content: Optional[str], 
+    parts: list, 
+    existing_questions: List[str], 
+    existing: Optional[NearDuplicateIndex] = None,
+    user_id: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE
+) -> List[Flashcard]:
+    """Generate additional flashcards for a deck from its stored source.
+    
+    The most recent GENERATE_MORE_MAX_EXCLUSIONS questions of the deck are
+    listed in the prompt so the model avoids them, and cards similar to any
+    card in the existing index are dropped. Rounds are repeated until number
+    new cards are found or the rounds run out. Stored texts longer than
+    TEXT_CHUNK_MAX_CHARS are split and generated chunk by chunk like a new
+    generation, every chunk with the same exclusions.
+    
+    Args:
+        input_types: Type of the stored input (topic, text, document)
+        number: Number of new flashcards to generate
+        input_content: Stored topic or text
+        parts: Stored document parts, reused without uploading again
+        existing_questions: Questions already in the deck, oldest first
+        existing: Near-duplicate index of the deck's cards
+        user_id: User the generation is for, used for fair scheduling
+        priority: Scheduling priority of the model calls
         
     Returns:
-        string: JSON string containing the generated flashcards
+        list: Validated Flashcard objects not yet in the deck
     """
+    if input_types == "text":
+        with span("preflight"):
+            input_content = preflight_text(input_content)
+    
+    excluded = existing_questions[-settings.GENERATE_MORE_MAX_EXCLUSIONS:] if settings.GENERATE_MORE_MAX_EXCLUSIONS > 0 else []
+    
+    if input_types == "text" and input_content and len(input_content) > settings.TEXT_CHUNK_MAX_CHARS:
+        chunks = split_text(input_content, settings.TEXT_CHUNK_MAX_CHARS)
+        counts = allocate_counts(number, [len(chunk) for chunk in chunks])
+        jobs = [(chunk, count) for chunk, count in zip(chunks, counts) if count > 0]
+        print(f"Generating {number} more flashcards from {len(jobs)} text chunks")
+        
+        # Bound how many chunks of one request are in flight at once
+        chunk_semaphore = asyncio.Semaphore(settings.TEXT_CHUNK_CONCURRENCY)
+        
+        async def generate_chunk(chunk: str, count: int) -> List[dict]:
+            async with chunk_semaphore:
+                return await _generate_more_rounds("text", count, chunk, [], excluded, existing, user_id, priority)
+        
+        results = await asyncio.gather(
+            *(generate_chunk(chunk, count) for chunk, count in jobs),
+            return_exceptions=True
+        )
+        
+        # A failed chunk only costs its share of cards, unless every chunk failed
+        results = _successful_results(results, "text chunks")
+        
+        # Chunks do not see each other's cards, drop repeats across them
+        with span("dedup"):
+            cards, _ = filter_near_duplicates([card for result in results for card in result], existing)
+    else:
+        cards = await _generate_more_rounds(
+            input_types, number, input_content, parts, excluded, existing, user_id, priority
+        )
+    
+    if len(cards) < number:
+        print(f"Warning: generated {len(cards)} of {number} requested new flashcards")
+    return FlashcardList.validate_python(cards[:number])
+
+async def _generate_more_rounds(
+    input_types: str, 
+    number: int, 
+    input_content: Optional[str], 
+    parts: list, 
+    excluded: List[str], 
+    existing: Optional[NearDuplicateIndex], 
+    user_id: Optional[str], 
+    priority: Priority
+) -> List[dict]:
+    """Generate new cards from one source in rounds, excluding the deck's and earlier rounds' questions."""
+    per_call = max_cards_per_call(settings.LLM_MAX_OUTPUT_TOKENS)
+    rounds = math.ceil(number / per_call) + settings.FANOUT_TOPUP_ROUNDS
+    
+    cards = []
+    for _ in range(rounds):
+        missing = number - len(cards)
+        if missing <= 0:
+            break
+        count = min(per_call, math.ceil(missing * (1 + FANOUT_OVERSAMPLE)))
+        with span("prompt"):
+            text = prompt_flashforge(input_types, count, input_content)
+            text += prompt_exclusions(excluded + [card["question"] for card in cards])
+        
+        # The stored documents come first so repeated calls share a prompt
+        # prefix the provider can serve from its context cache
+        try:
+            new_cards = await _call_model(input_types, parts + [text], count, user_id, priority)
+        except _REQUEST_ERRORS:
+            raise
+        except Exception as e:
+            if not cards:
+                raise
+            print(f"Warning: generating more flashcards stopped early: {e}")
+            break
+        
+        with span("dedup"):
+            cards, dropped = filter_near_duplicates(cards + new_cards, existing)
+        if dropped:
+            print(f"Dropped {len(dropped)} generated flashcards already in the deck")
+    
+    return cards[:number]
+
+async def transform_cards(
+    transform: str, 
+    cards: List[dict], 
+    language: Optional[str] = None,
+    user_id: Optional[str] = None,
+    priority: Priority = Priority.BULK
+) -> List[dict]:
+    """Rewrite existing flashcards with the model.
+    
+    Cards are sent in batches sized so the rewritten cards fit the output
+    budget of one call, and the batches run in parallel. Complete cards are
+    salvaged from a truncated response, and the cards it leaves out are sent
+    once more in two halves. If a batch still fails, the others are cancelled.
+    
+    Args:
+        transform: Name of the transform (translate, simplify, expand_answers)
+        cards: Flashcard dicts with "id", "question" and "answer" keys
+        language: Target language of a translation
+        user_id: User the transform is for, used for fair scheduling
+        priority: Scheduling priority of the model calls
+        
+    Returns:
+        list: Rewritten flashcard dicts with the ids of the originals
+        
+    Raises:
+        ValueError: If some cards are still missing after the second attempt
+    """
+    budget = int(settings.LLM_MAX_OUTPUT_TOKENS * OUTPUT_BUDGET_FRACTION)
+    growth = TRANSFORM_OUTPUT_GROWTH[transform]
+    
+    def card_tokens(card: dict) -> int:
+        return int(estimate_tokens(card["question"] + card["answer"]) * growth) + TRANSFORM_CARD_OVERHEAD_TOKENS
+    
+    # Pack consecutive cards into batches within the output budget
+    batches = []
+    current, planned = [], 0
+    for card in cards:
+        tokens = card_tokens(card)
+        if current and planned + tokens > budget:
+            batches.append(current)
+            current, planned = [], 0
+        current.append(card)
+        planned += tokens
+    if current:
+        batches.append(current)
+    
+    async def call(batch: List[dict]) -> List[dict]:
+        planned = sum(card_tokens(card) for card in batch)
+        return await _call_transform(transform, batch, language, planned, user_id, priority)
+    
+    async def transform_batch(batch: List[dict]) -> List[dict]:
+        results = {card["id"]: card for card in await call(batch)}
+        
+        # A response cut off at the output limit would be cut again, so the
+        # missing cards are retried in halves with their own budgets
+        remaining = [card for card in batch if card["id"] not in results]
+        if remaining:
+            half = math.ceil(len(remaining) / 2)
+            parts = [part for part in (remaining[:half], remaining[half:]) if part]
+            for cards in await asyncio.gather(*(call(part) for part in parts)):
+                results.update((card["id"], card) for card in cards)
+        
+        missing = [card["id"] for card in batch if card["id"] not in results]
+        if missing:
+            raise ValueError(f"The model did not return {len(missing)} of {len(batch)} flashcards")
+        return [results[card["id"]] for card in batch]
+    
+    tasks = [asyncio.ensure_future(transform_batch(batch)) for batch in batches]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # The chunk fails as a whole, stop spending model calls on its other batches
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return [card for result in results for card in result]
+
+async def _call_transform(
+    transform: str, 
+    cards: List[dict], 
+    language: Optional[str], 
+    planned: int, 
+    user_id: Optional[str], 
+    priority: Priority
+) -> List[dict]:
+    """Run one transform call and return the rewritten cards of this batch it contains."""
+    prompt = [prompt_transform(transform, cards, language)]
+    input_tokens = estimate_prompt_tokens(prompt)
+    route = choose_route("text", input_tokens, len(cards))
+    max_output_tokens = min(
+        settings.LLM_MAX_OUTPUT_TOKENS,
+        max(settings.ROUTING_MIN_OUTPUT_TOKENS, math.ceil(planned / OUTPUT_BUDGET_FRACTION))
+    )
+    route = dataclasses.replace(route, max_output_tokens=max_output_tokens)
+    
+    response = await _model_call(
+        "transform", prompt, route, _generation_config(list[_TransformedCardSchema], max_output_tokens),
+        input_tokens + planned, user_id, priority
+    )
+    
+    with span("parse"):
+        try:
+            parsed = [card.model_dump() for card in _TransformedCardList.validate_json(response.text)]
+        except ValueError:
+            # Keep the complete cards of a truncated response, the rest are retried by the caller
+            parsed = [card for card in salvage_cards(response.text or "") if "id" in card]
+            print(
+                f"Salvaged {len(parsed)} of {len(cards)} transformed flashcards from an unparseable response "
+                f"(finish reason {response.finish_reason})"
+            )
+    
+    ids = {card["id"] for card in cards}
+    return [
+        {"id": card["id"], "question": card["question"], "answer": card["answer"]}
+        for card in parsed
+        if card["id"] in ids
+    ]
+
+async def _build_prompt(
+    input_types: str, 
+    number: int, 
+    input_content: Optional[str] = None, 
+    files: Optional[Union[UploadFile, List[UploadFile]]] = None,
+    user_id: Optional[str] = None
+) -> list:
+    """Assemble the prompt text and any image or document parts."""
     # Generate prompt for FlashForge
-    prompt = [prompt_flashforge(input_types, number, input_content)]
-    
-    # Load images or documents if provided
-    if files:
-        if input_types == "image":
-            images = await load_images(files)
-            # Add images to prompt
-            prompt.extend(images)
-        elif input_types == "document":
-            documents = await upload_documents(files)
-            # Add documents to prompt
-            prompt.extend(documents)
-    
-    # Generate flashcards using Google Generative AI
+    with span("prompt"):
+        prompt = [prompt_flashforge(input_types, number, input_content)]
+    
+    # Add images or documents if provided
+    prompt.extend(await _load_parts(input_types, files, user_id))
+    return prompt
+
+async def _load_parts(
+    input_types: str, 
+    files: Optional[Union[UploadFile, List[UploadFile]]] = None,
+    user_id: Optional[str] = None
+) -> list:
+    """Load the image or document parts of the prompt."""
+    if not files:
+        return []
+    
+    if input_types == "image":
+        with span("images"):
+            return await load_images(files)
+    elif input_types == "document":
+        with span("documents"):
+            return await upload_documents(files, user_id=user_id)
+    return []
+
+def _generation_config(response_schema=list[_CardSchema], max_output_tokens: Optional[int] = None) -> types.GenerateContentConfig:
+    """Model configuration shared by regular and streamed generations."""
+    return types.GenerateContentConfig(
+        system_instruction=system_message,
+        max_output_tokens=max_output_tokens or settings.LLM_MAX_OUTPUT_TOKENS,
+        temperature=0.9,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+    )
+
+async def _generate(
+    input_types: str, 
+    number: int, 
+    input_content: Optional[str] = None, 
+    files: Optional[Union[UploadFile, List[UploadFile]]] = None,
+    user_id: Optional[str] = None,
+    priority: Priority = Priority.INTERACTIVE
+) -> List[Flashcard]:
+    """Call the model for a generation request that missed the cache."""
+    # Long passages are split and generated chunk by chunk
+    if input_types == "text" and input_content and len(input_content) > settings.TEXT_CHUNK_MAX_CHARS:
+        cards = await _generate_chunked_text(number, input_content, user_id, priority)
+    elif input_types == "image" and files:
+        cards = await _generate_image_cards(number, files, user_id, priority)
+    else:
+        parts = await _load_parts(input_types, files, user_id)
+        cards = await _generate_cards(input_types, number, input_content, parts, user_id, priority)
+    
+    # Drop near-duplicate cards the model repeated within the batch
+    with span("dedup"):
+        cards, dropped = filter_near_duplicates(cards)
+    if dropped:
+        print(f"Dropped {len(dropped)} near-duplicate generated flashcards")
+    
+    # Typed cards for the caller, validated in one pydantic-core pass
+    return FlashcardList.validate_python(cards[:number])
+
+async def _generate_chunked_text(
+    number: int, 
+    text: str, 
+    user_id: Optional[str] = None, 
+    priority: Priority = Priority.INTERACTIVE
+) -> List[dict]:
+    """Map-reduce generation for long text inputs.
+    
+    The text is split on paragraph and sentence boundaries, each chunk gets a
+    share of `number` proportional to its length, and the chunks are generated
+    in parallel. Results are merged in document order.
+    """
+    chunks = split_text(text, settings.TEXT_CHUNK_MAX_CHARS)
+    counts = allocate_counts(number, [len(chunk) for chunk in chunks])
+    jobs = [(chunk, count) for chunk, count in zip(chunks, counts) if count > 0]
+    print(f"Generating {number} flashcards from {len(jobs)} text chunks")
+    
+    # Bound how many chunks of one request are in flight at once
+    chunk_semaphore = asyncio.Semaphore(settings.TEXT_CHUNK_CONCURRENCY)
+    
+    async def generate_chunk(chunk: str, count: int) -> List[dict]:
+        async with chunk_semaphore:
+            return await _generate_cards("text", count, chunk, [], user_id, priority)
+    
+    results = await asyncio.gather(
+        *(generate_chunk(chunk, count) for chunk, count in jobs),
+        return_exceptions=True
+    )
+    
+    # A failed chunk only costs its share of cards, unless every chunk failed
+    return [card for result in _successful_results(results, "text chunks") for card in result]
+
+async def _generate_image_cards(
+    number: int, 
+    files: Union[UploadFile, List[UploadFile]], 
+    user_id: Optional[str] = None, 
+    priority: Priority = Priority.INTERACTIVE
+) -> List[dict]:
+    """Generate cards from images in batches grouped by estimated tokens.
+    
+    Every image gets an equal share of `number`. When there are fewer cards
+    than images, consecutive images share a card instead, so every image is
+    still shown to the model. Images are grouped into batches of up to
+    IMAGE_BATCH_MAX_TOKENS estimated tokens and
+    the batches are generated in parallel, so a slow or failing image only
+    affects its own batch. Each card is tagged with the image it came from
+    and the results are merged in upload order.
+    """
+    with span("images"):
+        images = await load_named_images(files)
+    
+    if len(images) <= 1 or settings.IMAGE_BATCH_MAX_TOKENS <= 0:
+        cards = await _generate_cards("image", number, None, [part for _, part in images], user_id, priority)
+        if len(images) == 1:
+            cards = [{**card, "source": images[0][0]} for card in cards]
+        return cards
+    
+    per_call = max_cards_per_call(settings.LLM_MAX_OUTPUT_TOKENS)
+    if number >= len(images):
+        groups = [([image], count) for image, count in zip(images, allocate_counts(number, [1] * len(images)))]
+    else:
+        # Fewer cards than images, runs of consecutive images share one card each
+        groups = []
+        start = 0
+        for size in allocate_counts(len(images), [1] * max(1, number)):
+            groups.append((images[start:start + size], 1))
+            start += size
+    batches = _group_images(groups, per_call)
+    print(f"Generating {number} flashcards from {len(images)} images in {len(batches)} batches")
+    
+    # Bound how many batches of one request are in flight at once
+    batch_semaphore = asyncio.Semaphore(settings.IMAGE_BATCH_CONCURRENCY)
+    
+    async def generate_batch(batch: List[tuple]) -> List[dict]:
+        async with batch_semaphore:
+            if len(batch) == 1 and len(batch[0][0]) == 1:
+                # A single image can still be fanned out and topped up
+                [(name, part)], count = batch[0]
+                cards = await _generate_cards("image", count, None, [part], user_id, priority)
+                return [{**card, "source": name} for card in cards]
+            
+            total = sum(count for _, count in batch)
+            prompt = [prompt_image_batch(total, [([name for name, _ in group], count) for group, count in batch])]
+            for group, _ in batch:
+                for name, part in group:
+                    prompt.extend([image_label(name), part])
+            cards = await _call_model(
+                "image", prompt, total, user_id, priority, response_schema=list[_SourcedCardSchema]
+            )
+            
+            # Cards naming no image of this batch are attributed to the batch as a whole
+            names = [name for group, _ in batch for name, _ in group]
+            return [
+                card if card.get("source") in names else {**card, "source": ", ".join(names)}
+                for card in cards
+            ]
+    
+    results = await asyncio.gather(
+        *(generate_batch(batch) for batch in batches),
+        return_exceptions=True
+    )
+    
+    # A failed batch only costs the cards of its images, unless every batch failed
+    results = _successful_results(results, "image batches")
+    
+    # Batches hold consecutive images, so ordering by image keeps upload order.
+    # Cards attributed to a whole batch sort with the batch's first image
+    order = {name: index for index, (name, _) in enumerate(images)}
+    for batch in batches:
+        names = [name for group, _ in batch for name, _ in group]
+        order.setdefault(", ".join(names), order[names[0]])
+    cards = [card for result in results for card in result]
+    return sorted(cards, key=lambda card: order.get(card["source"], len(order)))
+
+def _successful_results(results: list, what: str) -> list:
+    """
+    Results of parallel calls gathered with return_exceptions, without the failures.
+    
+    A failed call only costs its share of the cards. Overload, disconnects
+    and cancellation end the whole request, as does every call failing.
+    """
+    for result in results:
+        if isinstance(result, _REQUEST_ERRORS):
+            raise result
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if len(failures) == len(results):
+        raise failures[0]
+    if failures:
+        print(f"Warning: {len(failures)} of {len(results)} {what} failed: {failures[0]}")
+    return [result for result in results if not isinstance(result, BaseException)]
+
+def _group_images(groups: List[tuple], per_call: int) -> List[List[tuple]]:
+    """Pack consecutive image groups into batches within the token and card budgets.
+    
+    Args:
+        groups: ([(name, part), ...], count) tuples, images sharing count cards
+        per_call: Most cards one call can return
+    
+    Returns:
+        list: Batches of groups, a group is never split across batches
+    """
+    batches = []
+    current, tokens, cards = [], 0, 0
+    for group, count in groups:
+        group_tokens = estimate_prompt_tokens([part for _, part in group])
+        if current and (tokens + group_tokens > settings.IMAGE_BATCH_MAX_TOKENS or cards + count > per_call):
+            batches.append(current)
+            current, tokens, cards = [], 0, 0
+        current.append((group, count))
+        tokens += group_tokens
+        cards += count
+    if current:
+        batches.append(current)
+    return batches
+
+async def _generate_cards(
+    input_types: str, 
+    number: int, 
+    input_content: Optional[str], 
+    parts: list, 
+    user_id: Optional[str] = None, 
+    priority: Priority = Priority.INTERACTIVE
+) -> List[dict]:
+    """Generate number cards, fanning out when one response cannot hold them all."""
+    per_call = max_cards_per_call(settings.LLM_MAX_OUTPUT_TOKENS)
+    if number <= per_call:
+        with span("prompt"):
+            prompt = [prompt_flashforge(input_types, number, input_content)] + parts
+        cards = await _call_model(input_types, prompt, number, user_id, priority)
+        # Only ask for the cards a salvaged or short response is missing
+        return await _top_up(input_types, number, input_content, parts, cards, per_call, user_id, priority)
+    
+    return await _generate_fanned_out(input_types, number, input_content, parts, per_call, user_id, priority)
+
+async def _generate_fanned_out(
+    input_types: str, 
+    number: int, 
+    input_content: Optional[str], 
+    parts: list, 
+    per_call: int, 
+    user_id: Optional[str] = None, 
+    priority: Priority = Priority.INTERACTIVE
+) -> List[dict]:
+    """Split a large request into parallel sub-requests over distinct subtopics.
+    
+    An outline call names one subtopic per sub-request, each sub-request
+    asks for its share of the cards on its own subtopic, and the results are
+    merged and deduplicated. Cards lost to failed sub-requests or duplicates
+    are replaced by top-up calls that see the questions generated so far.
+    """
+    target = math.ceil(number * (1 + FANOUT_OVERSAMPLE))
+    batches = math.ceil(target / per_call)
+    counts = allocate_counts(target, [1] * batches)
+    subtopics = await _outline(input_types, input_content, parts, batches, user_id, priority)
+    print(f"Generating {number} flashcards in {batches} parallel sub-requests")
+    
+    # Bound how many sub-requests of one request are in flight at once
+    batch_semaphore = asyncio.Semaphore(settings.FANOUT_CONCURRENCY)
+    
+    async def generate_batch(index: int, count: int) -> List[dict]:
+        if subtopics:
+            others = subtopics[:index] + subtopics[index + 1:]
+            text = prompt_subtopic(input_types, count, input_content, subtopics[index], others)
+        else:
+            text = prompt_flashforge(input_types, count, input_content)
+        async with batch_semaphore:
+            return await _call_model(input_types, [text] + parts, count, user_id, priority)
+    
+    results = await asyncio.gather(
+        *(generate_batch(index, count) for index, count in enumerate(counts)),
+        return_exceptions=True
+    )
+    
+    results = _successful_results(results, "sub-requests")
+    cards, _ = filter_near_duplicates(card for result in results for card in result)
+    return await _top_up(input_types, number, input_content, parts, cards, per_call, user_id, priority)
+
+async def _top_up(
+    input_types: str, 
+    number: int, 
+    input_content: Optional[str], 
+    parts: list, 
+    cards: List[dict], 
+    per_call: int, 
+    user_id: Optional[str] = None, 
+    priority: Priority = Priority.INTERACTIVE
+) -> List[dict]:
+    """Request the cards missing after failures, truncation or duplicates.
+    
+    Each round asks only for the remainder and lists the questions generated
+    so far so the model does not repeat them.
+    """
+    for _ in range(settings.FANOUT_TOPUP_ROUNDS):
+        cards, _ = filter_near_duplicates(cards)
+        missing = number - len(cards)
+        if missing <= 0:
+            break
+        count = min(per_call, math.ceil(missing * (1 + FANOUT_OVERSAMPLE)))
+        text = prompt_flashforge(input_types, count, input_content) + prompt_exclusions([card["question"] for card in cards])
+        try:
+            cards = cards + await _call_model(input_types, [text] + parts, count, user_id, priority)
+        except _REQUEST_ERRORS:
+            raise
+        except Exception as e:
+            print(f"Warning: top-up of {missing} flashcards failed: {e}")
+            break
+    else:
+        cards, _ = filter_near_duplicates(cards)
+    
+    if len(cards) < number:
+        print(f"Warning: generated {len(cards)} of {number} requested flashcards")
+    return cards[:number]
+
+async def _outline(
+    input_types: str, 
+    input_content: Optional[str], 
+    parts: list, 
+    count: int, 
+    user_id: Optional[str] = None, 
+    priority: Priority = Priority.INTERACTIVE
+) -> List[str]:
+    """Ask the model for count distinct subtopics, or none if that fails."""
+    prompt = [prompt_outline(input_types, count, input_content)] + parts
     try:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-lite",
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                system_instruction=system_message,
-                max_output_tokens=8192,
-                temperature=0.9,
-                response_mime_type="application/json",
-                response_schema=list[Flashcard],
+        input_tokens = estimate_prompt_tokens(prompt)
+        route = choose_route(input_types, input_tokens, count)
+        config = _generation_config(list[str], OUTLINE_MAX_OUTPUT_TOKENS)
+        with span("outline"):
+            response = await _model_call(
+                "outline", prompt, route, config, input_tokens + OUTLINE_MAX_OUTPUT_TOKENS, user_id, priority
             )
+        subtopics = [item.strip() for item in json.loads(response.text) if isinstance(item, str) and item.strip()]
+    except _REQUEST_ERRORS:
+        raise
+    except Exception as e:
+        print(f"Warning: could not outline subtopics, fanning out without them: {e}")
+        return []
+    
+    # Sub-requests without a subtopic of their own would overlap the others
+    if len(subtopics) < count:
+        print(f"Warning: outline returned {len(subtopics)} of {count} subtopics, fanning out without them")
+        return []
+    return subtopics[:count]
+
+async def _model_call(
+    name: str, 
+    prompt: list, 
+    route: Route, 
+    config: types.GenerateContentConfig, 
+    tokens: int, 
+    user_id: Optional[str] = None, 
+    priority: Priority = Priority.INTERACTIVE
+) -> ModelResponse:
+    """Run one routed model call with retries and hedging, each attempt in its own scheduler slot."""
+    async def attempt() -> ModelResponse:
+        queued = time.perf_counter()
+        async with scheduler.slot(user_id, priority, tokens):
+            record_span("queue", time.perf_counter() - queued)
+            attempt_started()
+            with span("model"):
+                # Generate through the configured async provider so the event
+                # loop keeps serving other requests during the round trip
+                return await asyncio.wait_for(
+                    get_provider().generate(
+                        model=route.model,
+                        contents=prompt,
+                        config=config
+                    ),
+                    timeout=settings.LLM_TIMEOUT_SECONDS
+                )
+    
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = await resilient_call(name, attempt, queued=True)
+        status = "ok"
+    except asyncio.CancelledError:
+        # Cancelled by the caller, e.g. when the client disconnected
+        status = "cancelled"
+        raise
+    finally:
+        record_route(name, route, time.perf_counter() - started, status)
+    record_usage(response.prompt_tokens, response.output_tokens, response.cached_tokens)
+    return response
+
+async def _call_model(
+    input_types: str, 
+    prompt: list, 
+    number: int, 
+    user_id: Optional[str] = None, 
+    priority: Priority = Priority.INTERACTIVE,
+    response_schema=list[_CardSchema]
+) -> List[dict]:
+    """Run one model call and return the validated list of flashcard dicts."""
+    try:
+        input_tokens = estimate_prompt_tokens(prompt)
+        route = choose_route(input_types, input_tokens, number)
+        response = await _model_call(
+            "generate", prompt, route, _generation_config(response_schema, route.max_output_tokens),
+            input_tokens + estimate_output_tokens(number), user_id, priority
         )
         
         # Process the response to ensure it's in the expected format
+        parse_started = time.perf_counter()
+        raw_text = response.text
         try:
-            # The response.text might contain a JSON array or other format
-            # We need to ensure it's formatted as expected by our API
-            raw_text = response.text
-            
-            # Try to parse the JSON response
-            parsed_data = json.loads(raw_text)
-            
-            # If parsed_data is not a list, wrap it in a list
-            if not isinstance(parsed_data, list):
-                if isinstance(parsed_data, dict) and "flashcards" in parsed_data:
-                    # If it's a dict with a "flashcards" key, use that
-                    parsed_data = parsed_data["flashcards"]
-                else:
-                    # Otherwise wrap it in a list
-                    parsed_data = [parsed_data]
-            
-            # Ensure each item has question and answer fields
-            for item in parsed_data:
-                if not isinstance(item, dict) or "question" not in item or "answer" not in item:
-                    raise ValueError("Response items must have 'question' and 'answer' fields")
-            
-            # Convert back to JSON string in the expected format
-            return json.dumps(parsed_data)
+            # Parse and validate the JSON array in a single pass
+            parsed_data = parse_cards(raw_text)
+            record_span("parse", time.perf_counter() - parse_started)
+            return parsed_data
             
         except Exception as e:
-            print(f"Error processing AI response: {e}")
-            print(f"Raw response: {raw_text}")
-            raise ValueError(f"Failed to parse AI response: {e}")
+            # Keep every complete card of a truncated or malformed response
+            salvaged = salvage_cards(raw_text or "")
+            record_span("parse", time.perf_counter() - parse_started)
+            if not salvaged:
+                print(f"Error processing AI response: {e}")
+                print(f"Raw response: {raw_text}")
+                raise ValueError(f"Failed to parse AI response: {e}")
+            
+            print(f"Salvaged {len(salvaged)} of {number} flashcards from an unparseable response "
+                  f"(finish reason {response.finish_reason}): {e}")
+            metrics.incr("generation_salvaged_responses")
+            metrics.incr("generation_salvaged_cards", len(salvaged))
+            return salvaged
+    
+    except asyncio.TimeoutError:
+        print(f"Error generating flashcards: model call exceeded {settings.LLM_TIMEOUT_SECONDS}s")
+        raise TimeoutError(f"AI generation timed out after {settings.LLM_TIMEOUT_SECONDS} seconds")
     
     except Exception as e:
         # Log the error and re-raise
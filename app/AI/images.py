@@ -0,0 +1,68 @@
+"""
+Image preprocessing for AI flashcard generation.
+
+These functions run inside worker processes, so this module only depends on
+PIL and can be imported cheaply by the process pool.
+"""
+import io
+import time
+from typing import BinaryIO, Tuple, Union
+
+from PIL import Image, ImageOps
+
+
+def image_dimensions(contents: Union[bytes, BinaryIO]) -> Tuple[int, int]:
+    """Read the width and height from an image header without decoding it"""
+    source = io.BytesIO(contents) if isinstance(contents, bytes) else contents
+    with Image.open(source) as img:
+        return img.size
+
+
+def preprocess_image(contents: bytes, max_edge: int, image_format: str, quality: int) -> Tuple[bytes, dict]:
+    """
+    Auto-orient, downscale and re-encode an image for the prompt.
+
+    EXIF and other metadata are dropped because they are not copied to the
+    re-encoded image.
+
+    Args:
+        contents: Raw bytes of the uploaded image
+        max_edge: Maximum width or height of the result in pixels
+        image_format: PIL format of the result, e.g. "WEBP" or "JPEG"
+        quality: Encoder quality of the result
+
+    Returns:
+        tuple: (encoded bytes, stats dict with sizes and timing)
+    """
+    start = time.perf_counter()
+
+    with Image.open(io.BytesIO(contents)) as img:
+        original_size = img.size
+
+        # Let the JPEG decoder skip detail we would throw away anyway
+        img.draft("RGB", (max_edge, max_edge))
+        img = ImageOps.exif_transpose(img)
+
+        # Flatten transparency onto white, JPEG cannot store it
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        output = io.BytesIO()
+        img.save(output, format=image_format, quality=quality)
+        final_size = img.size
+
+    encoded = output.getvalue()
+    return encoded, {
+        "original_size": original_size,
+        "size": final_size,
+        "bytes_before": len(contents),
+        "bytes_after": len(encoded),
+        "seconds": time.perf_counter() - start,
+    }
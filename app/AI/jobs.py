@@ -0,0 +1,575 @@
+"""
+Background job queue for AI flashcard generation.
+
+Jobs are persisted in a local SQLite database together with any uploaded
+files spooled to disk, so queued and interrupted jobs survive a restart.
+A pool of asyncio workers claims queued jobs and runs generate_flashcards.
+The database is opened when the queue starts, and completed and failed jobs
+are deleted once they are older than JOB_RETENTION_SECONDS.
+
+Several server processes may share the database. A claimed job records the
+claiming queue as its owner, and the owner renews a heartbeat on its running
+jobs every JOB_HEARTBEAT_SECONDS. Only running jobs whose heartbeat is older
+than JOB_LEASE_SECONDS, i.e. whose process died, are returned to the queue,
+so a starting process never takes over jobs a sibling is still running.
+
+Transform jobs rewrite the cards of an existing deck. The deck is split into
+chunks of consecutive card ids, processed by several workers in parallel,
+and every finished chunk is written back and recorded in the job's progress.
+The rewritten cards of a chunk are stored in the progress before they are
+written, so a chunk interrupted between the model call and the write is
+written again on resume rather than rewritten a second time. A failed
+transform job can be resumed and continues with the chunks that are not
+done yet.
+"""
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from app.config import settings
+from app.db.database import AsyncSessionLocal
+from app.decks.service import DeckService
+from app.flashcards.service import FlashcardService
+from app.AI.generator import FlashcardList, generate_flashcards, transform_cards
+from app.AI.metrics import metrics
+from app.AI.scheduler import Priority
+from app.AI.sources import DeckSourceService
+from app.AI.tracing import generation_trace, span
+from app.AI.uploads import copy_upload
+
+# Job lifecycle states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Job kinds
+GENERATE = "generate"
+TRANSFORM = "transform"
+
+_COLUMNS = (
+    "id", "user_id", "status", "kind", "input_type", "number", "content", "save_to_deck",
+    "deck_name", "files", "params", "progress", "result", "deck_id", "error",
+    "created_at", "started_at", "finished_at", "owner", "heartbeat_at"
+)
+
+# Columns added after the first release, created on existing databases
+_ADDED_COLUMNS = {
+    "kind": f"TEXT NOT NULL DEFAULT '{GENERATE}'",
+    "params": "TEXT",
+    "progress": "TEXT",
+    "owner": "TEXT",
+    "heartbeat_at": "REAL",
+}
+
+
+class JobStore:
+    """SQLite persistence for generation jobs"""
+
+    def __init__(self, db_path: str):
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, user_id TEXT NOT NULL, status TEXT NOT NULL, "
+            "input_type TEXT NOT NULL, number INTEGER NOT NULL, content TEXT, "
+            "save_to_deck INTEGER NOT NULL DEFAULT 0, deck_name TEXT, files TEXT, "
+            "result TEXT, deck_id INTEGER, error TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        existing = {row["name"] for row in self._db.execute("PRAGMA table_info(jobs)")}
+        for column, definition in _ADDED_COLUMNS.items():
+            if column not in existing:
+                self._db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_jobs_status ON jobs (status, created_at)")
+        self._db.commit()
+
+    def _execute(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+            self._db.commit()
+        return rows
+
+    async def insert(self, job: dict) -> None:
+        placeholders = ", ".join("?" for _ in job)
+        await asyncio.to_thread(
+            self._execute,
+            f"INSERT INTO jobs ({', '.join(job)}) VALUES ({placeholders})",
+            tuple(job.values())
+        )
+
+    async def claim(self, owner: str) -> Optional[dict]:
+        """Atomically move the oldest queued job to running for owner and return it"""
+        now = time.time()
+        rows = await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, started_at = ?, owner = ?, heartbeat_at = ? WHERE id = ("
+            "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) "
+            f"RETURNING {', '.join(_COLUMNS)}",
+            (RUNNING, now, owner, now, QUEUED)
+        )
+        return dict(rows[0]) if rows else None
+
+    async def heartbeat(self, owner: str) -> None:
+        """Renew the lease of every job owner is running"""
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = ?",
+            (time.time(), owner, RUNNING)
+        )
+
+    async def finish(self, job_id: str, status: str, result: Optional[str] = None,
+                     deck_id: Optional[int] = None, error: Optional[str] = None) -> None:
+        await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, result = ?, deck_id = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, result, deck_id, error, time.time(), job_id)
+        )
+
+    async def update_progress(self, job_id: str, progress: dict) -> None:
+        await asyncio.to_thread(
+            self._execute, "UPDATE jobs SET progress = ? WHERE id = ?", (json.dumps(progress), job_id)
+        )
+
+    async def requeue(self, job_id: str, user_id: str) -> bool:
+        """Return a failed job to the queue, keeping its progress"""
+        rows = await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, error = NULL, started_at = NULL, finished_at = NULL, owner = NULL, created_at = ? "
+            "WHERE id = ? AND user_id = ? AND status = ? RETURNING id",
+            (QUEUED, time.time(), job_id, user_id, FAILED)
+        )
+        return bool(rows)
+
+    async def get(self, job_id: str, user_id: str) -> Optional[dict]:
+        rows = await asyncio.to_thread(
+            self._execute,
+            f"SELECT {', '.join(_COLUMNS)} FROM jobs WHERE id = ? AND user_id = ?",
+            (job_id, user_id)
+        )
+        return dict(rows[0]) if rows else None
+
+    async def count(self, status: str) -> int:
+        rows = await asyncio.to_thread(
+            self._execute, "SELECT COUNT(*) FROM jobs WHERE status = ?", (status,)
+        )
+        return rows[0][0]
+
+    async def requeue_expired(self, lease_seconds: float) -> int:
+        """Return running jobs whose owner stopped renewing their lease to the queue"""
+        rows = await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, started_at = NULL, owner = NULL, heartbeat_at = NULL "
+            "WHERE status = ? AND COALESCE(heartbeat_at, started_at, 0) < ? RETURNING id",
+            (QUEUED, RUNNING, time.time() - lease_seconds)
+        )
+        return len(rows)
+
+    async def requeue_owned(self, owner: str) -> int:
+        """Return the running jobs of a stopping owner to the queue"""
+        rows = await asyncio.to_thread(
+            self._execute,
+            "UPDATE jobs SET status = ?, started_at = NULL, owner = NULL, heartbeat_at = NULL "
+            "WHERE status = ? AND owner = ? RETURNING id",
+            (QUEUED, RUNNING, owner)
+        )
+        return len(rows)
+
+    async def delete_finished(self, before: float) -> int:
+        """Delete completed and failed jobs that finished before a timestamp"""
+        rows = await asyncio.to_thread(
+            self._execute,
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ? RETURNING id",
+            (COMPLETED, FAILED, before)
+        )
+        return len(rows)
+
+
+class JobQueue:
+    """Queue of generation jobs processed by a pool of background workers"""
+
+    def __init__(self, db_path: str, spool_dir: str, workers: int):
+        self.db_path = db_path
+        self.spool_dir = spool_dir
+        self.worker_count = workers
+        # Identifies this process's claims in a database shared with others
+        self.owner = uuid.uuid4().hex
+        self._store: Optional[JobStore] = None
+        self._workers: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._busy = 0
+
+    @property
+    def store(self) -> JobStore:
+        """The job database, opened on first use rather than at import"""
+        if self._store is None:
+            self._store = JobStore(self.db_path)
+        return self._store
+
+    async def start(self) -> None:
+        """Open the job database, recover abandoned jobs and start the worker pool"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._wakeup = asyncio.Event()
+        await self._requeue_abandoned()
+        await self._delete_expired()
+        metrics.set_gauge("job_workers_total", self.worker_count)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        self._workers.append(asyncio.create_task(self._heartbeat()))
+        if settings.JOB_RETENTION_SECONDS > 0:
+            self._workers.append(asyncio.create_task(self._cleanup()))
+        await self._update_depth()
+
+    async def stop(self) -> None:
+        """Cancel the workers and return their running jobs to the queue"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        requeued = await self.store.requeue_owned(self.owner)
+        if requeued:
+            print(f"Requeued {requeued} running generation jobs on shutdown")
+
+    async def submit(
+        self,
+        user_id: str,
+        input_type: str,
+        number: int,
+        content: Optional[str] = None,
+        save_to_deck: bool = False,
+        deck_name: Optional[str] = None,
+        files: Optional[List[UploadFile]] = None
+    ) -> str:
+        """
+        Persist a generation job and wake a worker.
+
+        Args:
+            user_id: Owner of the job
+            input_type: Type of input (topic, text, image, document)
+            number: Number of flashcards to generate
+            content: Text content for topic or text input types
+            save_to_deck: Whether to save the result to a new deck
+            deck_name: Name of the deck to create
+            files: Uploaded files, copied to the spool directory
+
+        Returns:
+            str: Id of the new job
+        """
+        job_id = uuid.uuid4().hex
+        stored_files = await self._spool_files(job_id, files or [])
+
+        await self.store.insert({
+            "id": job_id,
+            "user_id": user_id,
+            "status": QUEUED,
+            "input_type": getattr(input_type, "value", input_type),
+            "number": number,
+            "content": content,
+            "save_to_deck": int(bool(save_to_deck and deck_name)),
+            "deck_name": deck_name,
+            "files": json.dumps(stored_files),
+            "created_at": time.time(),
+        })
+        await self._submitted()
+        return job_id
+
+    async def submit_transform(
+        self,
+        user_id: str,
+        deck_id: int,
+        transform: str,
+        language: Optional[str] = None
+    ) -> str:
+        """
+        Persist a job rewriting every card of a deck and wake a worker.
+
+        Args:
+            user_id: Owner of the job and the deck
+            deck_id: Deck whose cards are rewritten in place
+            transform: Name of the transform (translate, simplify, expand_answers)
+            language: Target language of a translation
+
+        Returns:
+            str: Id of the new job
+        """
+        job_id = uuid.uuid4().hex
+        await self.store.insert({
+            "id": job_id,
+            "user_id": user_id,
+            "status": QUEUED,
+            "kind": TRANSFORM,
+            "input_type": "deck",
+            "number": 0,
+            "deck_id": deck_id,
+            "params": json.dumps({"transform": transform, "language": language}),
+            "created_at": time.time(),
+        })
+        await self._submitted()
+        return job_id
+
+    async def resume(self, job_id: str, user_id: str) -> bool:
+        """Requeue a failed job, a transform continues with its unfinished chunks"""
+        if not await self.store.requeue(job_id, user_id):
+            return False
+        await self._submitted()
+        return True
+
+    async def _submitted(self) -> None:
+        metrics.incr("jobs_submitted")
+        await self._update_depth()
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _spool_files(self, job_id: str, files: List[UploadFile]) -> List[dict]:
+        """Copy uploads to disk so the job can run after the request ends"""
+        if not files:
+            return []
+        job_dir = os.path.join(self.spool_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+
+        stored = []
+        for index, file in enumerate(files):
+            path = os.path.join(job_dir, str(index))
+            await copy_upload(file, path)
+            stored.append({
+                "path": path,
+                "filename": file.filename,
+                "content_type": file.content_type,
+            })
+        return stored
+
+    async def _requeue_abandoned(self) -> None:
+        recovered = await self.store.requeue_expired(settings.JOB_LEASE_SECONDS)
+        if recovered:
+            print(f"Requeued {recovered} generation jobs abandoned by a stopped process")
+            metrics.incr("jobs_recovered", recovered)
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    async def _heartbeat(self) -> None:
+        """Renew the leases of this queue's running jobs and recover expired ones"""
+        while True:
+            await asyncio.sleep(settings.JOB_HEARTBEAT_SECONDS)
+            try:
+                await self.store.heartbeat(self.owner)
+                await self._requeue_abandoned()
+            except Exception as e:
+                print(f"Could not renew generation job leases: {e}")
+
+    async def _delete_expired(self) -> None:
+        if settings.JOB_RETENTION_SECONDS <= 0:
+            return
+        deleted = await self.store.delete_finished(time.time() - settings.JOB_RETENTION_SECONDS)
+        if deleted:
+            print(f"Deleted {deleted} finished generation jobs past their retention")
+            metrics.incr("jobs_deleted", deleted)
+
+    async def _cleanup(self) -> None:
+        """Delete expired jobs periodically, at least once per retention period"""
+        interval = min(settings.JOB_RETENTION_SECONDS, settings.JOB_CLEANUP_INTERVAL_SECONDS)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._delete_expired()
+            except Exception as e:
+                print(f"Could not delete expired generation jobs: {e}")
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self.store.claim(self.owner)
+            if job is None:
+                # Sleep until a submit wakes us, polling in case another process queued work
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=settings.JOB_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._busy += 1
+            metrics.set_gauge("job_workers_busy", self._busy)
+            await self._update_depth()
+            try:
+                await self._run(job)
+            finally:
+                self._busy -= 1
+                metrics.set_gauge("job_workers_busy", self._busy)
+
+    async def _run(self, job: dict) -> None:
+        if job["kind"] == TRANSFORM:
+            await self._run_transform(job)
+            return
+
+        stored_files = json.loads(job["files"] or "[]")
+        uploads = [
+            UploadFile(
+                file=open(item["path"], "rb"),
+                size=os.path.getsize(item["path"]),
+                filename=item["filename"],
+                headers=Headers({"content-type": item["content_type"] or "application/octet-stream"})
+            )
+            for item in stored_files
+        ]
+
+        try:
+            with generation_trace(job["input_type"]):
+                cards = await generate_flashcards(
+                    input_types=job["input_type"],
+                    number=job["number"],
+                    input_content=job["content"],
+                    files=uploads or None,
+                    user_id=job["user_id"],
+                    priority=Priority.BULK
+                )
+
+                deck_id = None
+                if job["save_to_deck"]:
+                    with span("save"):
+                        async with AsyncSessionLocal() as db:
+                            deck = await DeckService.create_deck_with_flashcards(
+                                db, job["deck_name"], job["user_id"], [{"question": card.question, "answer": card.answer} for card in cards]
+                            )
+                            deck_id = deck.id
+                            await DeckSourceService.save_source(
+                                db, deck_id, job["user_id"], job["input_type"], job["content"], uploads or None
+                            )
+
+            result = FlashcardList.dump_json(cards, exclude_none=True).decode()
+            await self.store.finish(job["id"], COMPLETED, result=result, deck_id=deck_id)
+            metrics.incr("jobs_completed")
+
+        except asyncio.CancelledError:
+            # Shutting down, leave the job running so it is requeued on restart
+            raise
+        except Exception as e:
+            print(f"Error running generation job {job['id']}: {e}")
+            await self.store.finish(job["id"], FAILED, error=str(e))
+            metrics.incr("jobs_failed")
+
+        finally:
+            for upload in uploads:
+                upload.file.close()
+
+        if stored_files:
+            shutil.rmtree(os.path.join(self.spool_dir, job["id"]), ignore_errors=True)
+
+    async def _run_transform(self, job: dict) -> None:
+        params = json.loads(job["params"])
+        progress = json.loads(job["progress"] or "null")
+
+        try:
+            if progress is None:
+                progress = {"chunks": await self._plan_chunks(job["deck_id"]), "done": []}
+                await self.store.update_progress(job["id"], progress)
+            # Rewritten cards of chunks not yet confirmed as written, by chunk index
+            written = progress.setdefault("transformed", {})
+
+            pending = [
+                index for index in range(len(progress["chunks"]))
+                if index not in progress["done"]
+            ]
+            failures = []
+
+            async def worker() -> None:
+                while pending:
+                    index = pending.pop(0)
+                    try:
+                        cards = written.get(str(index))
+                        if cards is None:
+                            cards = await self._transform_chunk(job, params, progress["chunks"][index])
+                            # Record the rewrite before the deck is changed
+                            written[str(index)] = cards
+                            await self.store.update_progress(job["id"], progress)
+                        await self._save_chunk(job, params, cards)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        print(f"Error transforming chunk {index} of job {job['id']}: {e}")
+                        failures.append(e)
+                        continue
+                    written.pop(str(index), None)
+                    progress["done"].append(index)
+                    await self.store.update_progress(job["id"], progress)
+
+            with generation_trace("transform"):
+                await asyncio.gather(*(worker() for _ in range(max(1, settings.TRANSFORM_WORKERS))))
+
+            if failures:
+                failed = len(progress["chunks"]) - len(progress["done"])
+                raise RuntimeError(f"{failed} of {len(progress['chunks'])} chunks failed, resume the job to retry them: {failures[0]}")
+
+            await self.store.finish(job["id"], COMPLETED, deck_id=job["deck_id"])
+            metrics.incr("jobs_completed")
+
+        except asyncio.CancelledError:
+            # Shutting down, finished chunks are kept in the progress
+            raise
+        except Exception as e:
+            print(f"Error running transform job {job['id']}: {e}")
+            await self.store.finish(job["id"], FAILED, deck_id=job["deck_id"], error=str(e))
+            metrics.incr("jobs_failed")
+
+    @staticmethod
+    async def _plan_chunks(deck_id: int) -> List[List[int]]:
+        """Split a deck into [first id, last id] ranges of TRANSFORM_CHUNK_CARDS cards"""
+        chunks = []
+        after_id = None
+        async with AsyncSessionLocal() as db:
+            while True:
+                page = await FlashcardService.get_flashcards_page(
+                    db, deck_id, after_id=after_id, limit=settings.TRANSFORM_CHUNK_CARDS
+                )
+                if not page:
+                    return chunks
+                chunks.append([page[0].id, page[-1].id])
+                after_id = page[-1].id
+
+    @staticmethod
+    async def _transform_chunk(job: dict, params: dict, chunk: List[int]) -> List[dict]:
+        """Load and rewrite the cards of one chunk"""
+        first_id, last_id = chunk
+        async with AsyncSessionLocal() as db:
+            page = await FlashcardService.get_flashcards_page(
+                db, job["deck_id"], after_id=first_id - 1, limit=settings.TRANSFORM_CHUNK_CARDS
+            )
+        cards = [
+            {"id": card.id, "question": card.question, "answer": card.answer}
+            for card in page if card.id <= last_id
+        ]
+        if not cards:
+            return []
+
+        return await transform_cards(
+            params["transform"], cards, params.get("language"),
+            user_id=job["user_id"], priority=Priority.BULK
+        )
+
+    @staticmethod
+    async def _save_chunk(job: dict, params: dict, cards: List[dict]) -> None:
+        """Write the rewritten cards of one chunk, writing them twice is harmless"""
+        if not cards:
+            return
+        async with AsyncSessionLocal() as db:
+            with span("save"):
+                updated = await FlashcardService.update_flashcards_bulk(db, job["deck_id"], cards)
+        metrics.incr("transform_cards_updated", updated, transform=params["transform"])
+
+    async def _update_depth(self) -> None:
+        metrics.set_gauge("job_queue_depth", await self.store.count(QUEUED))
+
+
+# Shared job queue, started with the application
+job_queue = JobQueue(
+    db_path=settings.JOB_DB_PATH,
+    spool_dir=settings.JOB_SPOOL_DIR,
+    workers=settings.JOB_WORKERS,
+)
@@ -0,0 +1,140 @@
+"""
+In-process metrics for the FlashForge AI services.
+"""
+import bisect
+import threading
+from typing import Dict, Sequence, Tuple
+
+# Metric identity: name plus sorted (label, value) pairs
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+# Default histogram bucket upper bounds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+def _key(name: str, labels: dict) -> MetricKey:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _format_key(key: MetricKey, suffix: str = "", extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    name, labels = key
+    labels = labels + extra
+    if not labels:
+        return name + suffix
+    return name + suffix + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+
+class Metrics:
+    """Registry of named counters, gauges and summaries shared by the AI modules"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[MetricKey, float] = {}
+        self._gauges: Dict[MetricKey, float] = {}
+        self._summaries: Dict[MetricKey, dict] = {}
+        self._histograms: Dict[MetricKey, dict] = {}
+
+    def incr(self, name: str, value: float = 1, **labels) -> None:
+        """Increase a counter by value"""
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        """Set a gauge to its current value"""
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Record one observation, e.g. a latency, in a summary"""
+        key = _key(name, labels)
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                summary = self._summaries[key] = {"count": 0, "sum": 0.0, "min": value, "max": value}
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["min"] = min(summary["min"], value)
+            summary["max"] = max(summary["max"], value)
+
+    def histogram(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels) -> None:
+        """Record one observation in a histogram with fixed bucket bounds"""
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    "bounds": tuple(buckets), "counts": [0] * (len(buckets) + 1), "count": 0, "sum": 0.0
+                }
+            # The last slot counts observations above every bound (+Inf)
+            histogram["counts"][bisect.bisect_left(histogram["bounds"], value)] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def snapshot(self) -> dict:
+        """Return a copy of all metrics"""
+        with self._lock:
+            return {
+                "counters": {_format_key(key): value for key, value in self._counters.items()},
+                "gauges": {_format_key(key): value for key, value in self._gauges.items()},
+                "summaries": {
+                    _format_key(key): dict(summary, avg=summary["sum"] / summary["count"])
+                    for key, summary in self._summaries.items()
+                },
+                "histograms": {
+                    _format_key(key): {
+                        "count": histogram["count"],
+                        "sum": histogram["sum"],
+                        "buckets": dict(zip(
+                            [str(bound) for bound in histogram["bounds"]] + ["+Inf"],
+                            _cumulative(histogram["counts"])
+                        )),
+                    }
+                    for key, histogram in self._histograms.items()
+                },
+            }
+
+    def prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, series in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({key[0] for key in series}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    lines.extend(
+                        f"{_format_key(key)} {value}" for key, value in series.items() if key[0] == name
+                    )
+
+            for name in sorted({key[0] for key in self._summaries}):
+                lines.append(f"# TYPE {name} summary")
+                for key, summary in self._summaries.items():
+                    if key[0] == name:
+                        lines.append(f"{_format_key(key, '_count')} {summary['count']}")
+                        lines.append(f"{_format_key(key, '_sum')} {summary['sum']}")
+
+            for name in sorted({key[0] for key in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in self._histograms.items():
+                    if key[0] != name:
+                        continue
+                    bounds = [str(bound) for bound in histogram["bounds"]] + ["+Inf"]
+                    for bound, count in zip(bounds, _cumulative(histogram["counts"])):
+                        lines.append(f"{_format_key(key, '_bucket', (('le', bound),))} {count}")
+                    lines.append(f"{_format_key(key, '_count')} {histogram['count']}")
+                    lines.append(f"{_format_key(key, '_sum')} {histogram['sum']}")
+        return "\n".join(lines) + "\n"
+
+
+def _cumulative(counts: Sequence[int]) -> list:
+    """Turn per-bucket counts into Prometheus-style cumulative counts"""
+    total = 0
+    result = []
+    for count in counts:
+        total += count
+        result.append(total)
+    return result
+
+
+# Shared registry used across the AI package
+metrics = Metrics()
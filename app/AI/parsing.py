@@ -0,0 +1,161 @@
+"""
+Incremental parsing of streamed flashcard JSON from the model.
+"""
+import json
+import re
+from typing import List
+
+from pydantic import TypeAdapter
+from typing_extensions import NotRequired, TypedDict
+
+# Opening of a {"flashcards": [...]} wrapper around the card array
+_WRAPPER = re.compile(r'\s*\{\s*"flashcards"\s*:\s*')
+
+
+class CardDict(TypedDict):
+    question: str
+    answer: str
+    # Image a card was generated from, only in multi-image responses
+    source: NotRequired[str]
+    # Card a rewritten card replaces, only in deck transform responses
+    id: NotRequired[int]
+
+
+# Parses and validates a JSON card array in one pass in pydantic-core's Rust parser
+_card_list = TypeAdapter(List[CardDict])
+
+
+def parse_cards(text: str) -> List[dict]:
+    """
+    Parse a complete model response into validated flashcard dicts.
+
+    Args:
+        text: Raw model output, normally a JSON array of cards
+
+    Returns:
+        list: Flashcard dicts with "question" and "answer" keys, and "source" if the model set one
+
+    Raises:
+        ValueError: If the output is not valid JSON or an item is not a valid card
+    """
+    try:
+        return _card_list.validate_json(text)
+    except ValueError:
+        pass
+
+    # Slow path for a {"flashcards": [...]} wrapper or a single card object
+    parsed = json.loads(text)
+    if isinstance(parsed, dict) and "flashcards" in parsed:
+        parsed = parsed["flashcards"]
+    elif not isinstance(parsed, list):
+        parsed = [parsed]
+    return _card_list.validate_python(parsed)
+
+
+class IncrementalCardParser:
+    """
+    Extracts complete flashcard objects from a JSON array as it is streamed.
+
+    Text is fed in arbitrary chunks. Every time a top-level object inside the
+    array closes it is decoded and returned, so cards can be used before the
+    rest of the array has arrived.
+    """
+
+    def __init__(self):
+        self._current: List[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> List[dict]:
+        """
+        Consume the next chunk of model output.
+
+        Args:
+            chunk: Raw text continuing the previously fed output
+
+        Returns:
+            list: Flashcard dicts completed by this chunk, in order
+        """
+        cards = []
+
+        for char in chunk:
+            if self._depth == 0:
+                # Between objects: skip the array brackets, commas and whitespace
+                if char == "{":
+                    self._current = [char]
+                    self._depth = 1
+                continue
+
+            self._current.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    cards.extend(self._decode("".join(self._current)))
+                    self._current = []
+
+        return cards
+
+    @property
+    def pending(self) -> str:
+        """Text of the object currently being received, if any"""
+        return "".join(self._current) if self._depth else ""
+
+    @staticmethod
+    def _decode(text: str) -> List[dict]:
+        """Decode one complete object, keeping it only if it is a valid card"""
+        try:
+            item = json.loads(text)
+        except ValueError:
+            return []
+
+        # Tolerate a {"flashcards": [...]} wrapper around the array
+        if isinstance(item, dict) and isinstance(item.get("flashcards"), list):
+            items = item["flashcards"]
+        else:
+            items = [item]
+
+        cards = []
+        for card in items:
+            if not (isinstance(card, dict)
+                    and isinstance(card.get("question"), str)
+                    and isinstance(card.get("answer"), str)):
+                continue
+            parsed = {"question": card["question"], "answer": card["answer"]}
+            if isinstance(card.get("source"), str):
+                parsed["source"] = card["source"]
+            if isinstance(card.get("id"), int) and not isinstance(card["id"], bool):
+                parsed["id"] = card["id"]
+            cards.append(parsed)
+        return cards
+
+
+def salvage_cards(text: str) -> List[dict]:
+    """
+    Recover every complete flashcard from truncated or malformed output.
+
+    Args:
+        text: Raw model output that failed to parse as a whole
+
+    Returns:
+        list: Valid flashcard dicts in the order they appear
+    """
+    # Unwrap the wrapper object so its cards are parsed as top-level objects
+    match = _WRAPPER.match(text)
+    if match:
+        text = text[match.end():]
+    return IncrementalCardParser().feed(text)
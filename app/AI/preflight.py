@@ -0,0 +1,200 @@
+"""
+Pre-flight compaction and size checks of text inputs.
+
+Text pasted from web pages carries repeated whitespace, navigation and
+cookie banners, share buttons and paragraphs repeated in headers and
+footers. compact_text removes them before the text is hashed for the
+generation cache or sent to the model. Code, CSV and other line-structured
+text keeps every line and its indentation; only trailing spaces and runs
+of blank lines are normalized. preflight_text then estimates the
+tokens of what is left and rejects or trims inputs over
+TEXT_MAX_INPUT_TOKENS, so an oversized request fails before any network
+call is made.
+"""
+import re
+from typing import Optional
+
+from app.config import settings
+from app.AI.metrics import metrics
+from app.AI.tokens import CHARS_PER_TOKEN, estimate_tokens
+from app.AI.uploads import InputTooLargeError
+
+_HORIZONTAL_SPACE = re.compile(r"[ \t\f\v\u00a0\u2000-\u200b\u3000]+")
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0e-\x1f\x7f]")
+_PARAGRAPH_BOUNDARY = re.compile(r"\n\s*\n")
+_BLANK_LINES = re.compile(r"\n{3,}")
+_INDENTATION = re.compile(r"^[ \t]*")
+
+# Lines that mark code, tables and fenced blocks rather than prose
+_STRUCTURED_LINE = re.compile(r"^(?:[ \t]+\S|```|~~~|\|)|\t")
+# Share of structured lines above which a text is treated as structured
+STRUCTURED_LINE_SHARE = 0.2
+
+# Whole lines of web page chrome, matched case-insensitively. Copyright
+# lines only match footer forms, "Copyright 2024" or "© Acme", never prose
+# about copyright
+_BOILERPLATE_LINE = re.compile(
+    r"^(?:"
+    r"skip to (?:main )?content|jump to navigation|main menu|toggle navigation"
+    r"|back to top|table of contents"
+    r"|sign in|log ?in|sign up|subscribe(?: now)?|log ?out|my account"
+    r"|share(?: this(?: article| page)?)?(?: on \w+)?|copy link"
+    r"|advertisement|sponsored(?: content)?|related (?:articles|posts)|read more|continue reading"
+    r"|accept(?: all)?(?: cookies)?|reject all|manage (?:cookies|preferences)|cookie (?:settings|policy)"
+    r"|privacy policy|terms (?:of (?:use|service)|and conditions)|contact us|about us"
+    r"|(?:©|copyright)\s*(?:\d{4}|©).{0,80}|©.{0,80}|.{0,80}all rights reserved\.?"
+    r"|this (?:site|website) uses cookies.{0,200}|we use cookies.{0,200}"
+    r"|\[?edit\]?|\d+ comments?|loading\.*"
+    r")$",
+    re.IGNORECASE,
+)
+
+# Single words that are chrome only inside a run of navigation lines, e.g. a
+# menu extracted one link per line, and content anywhere else
+_NAVIGATION_WORD = re.compile(r"^(?:menu|navigation|search|home|about|blog|news|contact|help|register|tweet)$", re.IGNORECASE)
+
+# Menu bars like "Home | About | Blog" or "News · Sport · Weather"
+_NAVIGATION_LINE = re.compile(r"^(?:[^|·•»]{1,30} [|·•»] ){2,}[^|·•»]{1,30}$")
+
+
+def compact_text(text: str, prose: Optional[bool] = None) -> str:
+    """
+    Normalize whitespace, and for prose drop boilerplate and repeated paragraphs.
+
+    Args:
+        text: Raw text input
+        prose: Whether the text is prose, e.g. extracted from HTML; detected
+            from its lines when None
+
+    Returns:
+        str: Compacted text, paragraphs separated by one blank line
+    """
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    text = _CONTROL_CHARS.sub("", text)
+    if prose is None:
+        prose = is_prose(text)
+
+    if not prose:
+        # Code, CSV and markdown keep every line as it is
+        text = "\n".join(line.rstrip() for line in text.split("\n"))
+        return _BLANK_LINES.sub("\n\n", text).strip("\n")
+
+    paragraphs = []
+    seen = set()
+    for paragraph in _PARAGRAPH_BOUNDARY.split(text):
+        lines = []
+        for line in paragraph.split("\n"):
+            # Collapse spaces inside the line, never its indentation
+            indent = _INDENTATION.match(line).group()
+            line = indent + _HORIZONTAL_SPACE.sub(" ", line[len(indent):]).strip()
+            if line.strip():
+                lines.append(line)
+        lines = _drop_boilerplate(lines)
+        if not lines:
+            continue
+
+        # Headers, footers and quoted passages repeated on a page only count once
+        paragraph = "\n".join(lines)
+        key = " ".join(paragraph.casefold().split())
+        if key in seen:
+            continue
+        seen.add(key)
+        paragraphs.append(paragraph)
+
+    return "\n\n".join(paragraphs)
+
+
+def is_prose(text: str) -> bool:
+    """
+    Whether text reads as prose rather than code, CSV or tables.
+
+    Text is structured when enough of its lines are indented, contain tabs,
+    open fenced blocks or table rows, or when most lines hold the same number
+    of commas or semicolons, as CSV rows do.
+    """
+    lines = [line for line in text.split("\n") if line.strip()]
+    if not lines:
+        return True
+
+    structured = sum(1 for line in lines if _STRUCTURED_LINE.search(line))
+    if structured >= STRUCTURED_LINE_SHARE * len(lines):
+        return False
+
+    if len(lines) >= 3:
+        for delimiter in (",", ";"):
+            counts = [line.count(delimiter) for line in lines]
+            common = max(set(counts), key=counts.count)
+            if common >= 2 and counts.count(common) >= 0.5 * len(lines):
+                return False
+    return True
+
+
+def preflight_text(text: Optional[str]) -> Optional[str]:
+    """
+    Compact a text input and enforce TEXT_MAX_INPUT_TOKENS.
+
+    Args:
+        text: Text input of a generation request
+
+    Returns:
+        str: The compacted text, trimmed to the limit if TEXT_OVERFLOW is "trim"
+
+    Raises:
+        InputTooLargeError: If the compacted text is over the limit and
+            TEXT_OVERFLOW is "reject"
+    """
+    if not text:
+        return text
+
+    # Text made only of lines that look like boilerplate is kept as it is
+    compacted = compact_text(text) or " ".join(text.split())
+    metrics.incr("preflight_chars_removed", len(text) - len(compacted))
+
+    tokens = estimate_tokens(compacted)
+    limit = settings.TEXT_MAX_INPUT_TOKENS
+    if tokens <= limit:
+        return compacted
+
+    if settings.TEXT_OVERFLOW != "trim":
+        metrics.incr("preflight_rejected")
+        raise InputTooLargeError(
+            f"Text input is about {tokens} tokens after compaction, the limit is {limit}"
+        )
+
+    metrics.incr("preflight_trimmed")
+    print(f"Trimming text input from about {tokens} to {limit} tokens")
+    return _trim(compacted, limit * CHARS_PER_TOKEN)
+
+
+def _is_boilerplate(line: str) -> bool:
+    # Long lines are content even when they start like a banner
+    if len(line) > 300:
+        return False
+    return bool(_BOILERPLATE_LINE.match(line) or _NAVIGATION_LINE.match(line))
+
+
+def _drop_boilerplate(lines: list) -> list:
+    """Drop chrome lines, and navigation words next to other chrome lines"""
+    stripped = [line.strip() for line in lines]
+    chrome = [_is_boilerplate(line) or bool(_NAVIGATION_WORD.match(line)) for line in stripped]
+
+    kept = []
+    for index, line in enumerate(lines):
+        if _is_boilerplate(stripped[index]):
+            continue
+        if _NAVIGATION_WORD.match(stripped[index]):
+            in_run = (index > 0 and chrome[index - 1]) or (index + 1 < len(lines) and chrome[index + 1])
+            if in_run:
+                continue
+        kept.append(line)
+    return kept
+
+
+def _trim(text: str, max_chars: int) -> str:
+    """Cut text to max_chars, at a paragraph or sentence end when there is one"""
+    text = text[:max_chars]
+    for boundary in ("\n\n", ". ", "\n", " "):
+        cut = text.rfind(boundary)
+        if cut > max_chars // 2:
+            return text[:cut + (1 if boundary == ". " else 0)].rstrip()
+    return text
@@ -1,6 +1,7 @@
 """
 Prompts for the FlashForge AI flashcards generation system.
 """
+import json
 
 # System message to guide the Gemini AI model
 system_message = """
@@ -59,3 +60,126 @@ def prompt_flashforge(input_type: str, number: int, content: str = None) -> str:
     else:
         # Default prompt if input type is not recognized
         return f"{base_instructions} covering fundamental concepts in this area."
+
+def prompt_outline(input_type: str, count: int, content: str = None) -> str:
+    """
+    Generate a prompt asking for distinct subtopics of the input.
+    
+    Used to split a large flashcard request into sub-requests that cover
+    different parts of the material.
+    
+    Args:
+        input_type: Type of input (topic, text, image, document)
+        count: Number of subtopics to list
+        content: Text content or topic name
+        
+    Returns:
+        str: Prompt for Gemini AI
+    """
+    base_instructions = f"List {count} distinct, non-overlapping subtopics"
+    
+    if input_type == "topic":
+        return f"{base_instructions} of the topic: {content}. Together they should cover the topic broadly. Respond with a JSON list of short subtopic names."
+    
+    elif input_type == "text":
+        return f"{base_instructions} covered by the following text:\n\n{content}\n\nRespond with a JSON list of short subtopic names."
+    
+    elif input_type == "image":
+        return f"{base_instructions} covered by the content of the provided image. Respond with a JSON list of short subtopic names."
+    
+    elif input_type == "document":
+        return f"{base_instructions} covered by the content of the provided document. Respond with a JSON list of short subtopic names."
+    
+    else:
+        return f"{base_instructions} of this area. Respond with a JSON list of short subtopic names."
+
+def prompt_subtopic(input_type: str, number: int, content: str, subtopic: str, other_subtopics: list) -> str:
+    """
+    Generate a prompt for the flashcards of one subtopic of a larger request.
+    
+    Args:
+        input_type: Type of input (topic, text, image, document)
+        number: Number of flashcards to generate for this subtopic
+        content: Text content or topic name
+        subtopic: Subtopic these flashcards should cover
+        other_subtopics: Subtopics covered by the other sub-requests
+        
+    Returns:
+        str: Prompt for Gemini AI
+    """
+    prompt = f"{prompt_flashforge(input_type, number, content)}\n\nFocus only on this subtopic: {subtopic}."
+    if other_subtopics:
+        prompt += f" Other flashcard sets cover {'; '.join(other_subtopics)}, so do not write cards about those."
+    return prompt
+
+def prompt_exclusions(questions: list) -> str:
+    """
+    Generate an instruction not to repeat flashcards that already exist.
+    
+    Args:
+        questions: Questions of the flashcards generated so far
+        
+    Returns:
+        str: Text to append to a flashcard prompt
+    """
+    listed = "\n".join(f"- {question}" for question in questions)
+    return f"\n\nThese flashcards already exist. Do not repeat them or ask the same thing in other words:\n{listed}"
+
+def prompt_image_batch(number: int, images: list) -> str:
+    """
+    Generate a prompt for flashcards from several labelled images at once.
+    
+    Each image in the prompt is preceded by an `Image "<name>":` label.
+    
+    Args:
+        number: Total number of flashcards to generate
+        images: (names, count) pairs giving the flashcards to base on each image,
+            or on a run of images sharing them
+        
+    Returns:
+        str: Prompt for Gemini AI
+    """
+    lines = []
+    for names, count in images:
+        if len(names) == 1:
+            lines.append(f'- Image "{names[0]}": {count} flashcards')
+        else:
+            quoted = ", ".join(f'"{name}"' for name in names)
+            lines.append(f"- Images {quoted} together: {count} flashcards, each based on one of them")
+    shares = "\n".join(lines)
+    return (
+        f"Generate {number} high-quality flashcards based on the content of the provided images. "
+        f"Each image follows a line with its name. Base each flashcard on a single image, "
+        f"with this many flashcards per image:\n{shares}\n\n"
+        f'Set the "source" field of every flashcard to the exact name of the image it is based on.'
+    )
+
+def image_label(name: str) -> str:
+    """Label placed before an image in a multi-image prompt"""
+    return f'Image "{name}":'
+
+# Instructions of the deck transforms, {language} is the translation target
+transform_instructions = {
+    "translate": "Translate the question and answer of every flashcard into {language}. Keep the meaning, the technical terms and any formatting.",
+    "simplify": "Rewrite every flashcard in simpler, plainer language that a beginner can follow. Each card must still test the same fact.",
+    "expand_answers": "Expand the answer of every flashcard into a fuller explanation of 2-4 sentences, with a short example where it helps. Keep the questions unchanged.",
+}
+
+def prompt_transform(transform: str, cards: list, language: str = None) -> str:
+    """
+    Generate a prompt rewriting a batch of existing flashcards.
+    
+    Args:
+        transform: Name of the transform (translate, simplify, expand_answers)
+        cards: Flashcard dicts with "id", "question" and "answer" keys
+        language: Target language of a translation
+        
+    Returns:
+        str: Prompt for Gemini AI
+    """
+    instructions = transform_instructions[transform].format(language=language)
+    return (
+        f"{instructions}\n\n"
+        f'Return every flashcard with its original "id", as a JSON list of objects with "id", "question" and "answer" keys.\n\n'
+        f"Flashcards:\n{json.dumps(cards, ensure_ascii=False)}"
+    )
@@ -0,0 +1,258 @@
+"""
+LLM provider backends for the FlashForge AI services.
+
+All model calls and document uploads in the AI package go through the
+provider returned by get_provider(). GeminiProvider talks to the Gemini API;
+FakeProvider is a deterministic local stand-in with configurable latency,
+jitter, errors and streaming so the AI path can be load-tested offline.
+"""
+import asyncio
+import datetime
+import hashlib
+import json
+import random
+import re
+from dataclasses import dataclass, field
+from typing import IO, Any, AsyncIterator, Optional
+
+from google import genai
+from google.genai import types
+
+from app.config import settings
+from app.AI.tracing import record_usage
+
+
+@dataclass
+class ModelResponse:
+    """Text and token usage of one model call"""
+    text: str
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+    cached_tokens: int = 0
+    finish_reason: Optional[str] = None
+    raw: Any = field(default=None, repr=False)
+
+
+class ProviderError(Exception):
+    """Error returned by a provider, code follows HTTP status semantics"""
+
+    def __init__(self, message: str, code: int = 500):
+        super().__init__(message)
+        self.code = code
+
+
+class LLMProvider:
+    """Interface every model backend implements"""
+
+    async def generate(self, model: str, contents: list, config: types.GenerateContentConfig) -> ModelResponse:
+        """Run one model call and return its full response"""
+        raise NotImplementedError
+
+    def generate_stream(self, model: str, contents: list, config: types.GenerateContentConfig) -> AsyncIterator[str]:
+        """Run one model call, yielding the output text as it is produced.
+
+        Token usage of the call is reported with record_usage once the stream ends.
+        """
+        raise NotImplementedError
+
+    async def upload_file(self, file: IO[bytes], mime_type: str) -> types.File:
+        """Upload a document and return its remote file handle"""
+        raise NotImplementedError
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini API through the async genai client"""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+        self._client: Optional[genai.Client] = None
+
+    @property
+    def client(self) -> genai.Client:
+        # Created on first use so importing the app needs no key or network
+        if self._client is None:
+            self._client = genai.Client(api_key=self.api_key)
+        return self._client
+
+    async def generate(self, model: str, contents: list, config: types.GenerateContentConfig) -> ModelResponse:
+        response = await self.client.aio.models.generate_content(
+            model=model,
+            contents=contents,
+            config=config
+        )
+        usage = response.usage_metadata
+        finish_reason = None
+        if response.candidates and response.candidates[0].finish_reason:
+            finish_reason = str(response.candidates[0].finish_reason.value)
+        return ModelResponse(
+            text=response.text or "",
+            prompt_tokens=(usage.prompt_token_count or 0) if usage else 0,
+            output_tokens=(usage.candidates_token_count or 0) if usage else 0,
+            cached_tokens=(usage.cached_content_token_count or 0) if usage else 0,
+            finish_reason=finish_reason,
+            raw=response,
+        )
+
+    async def generate_stream(self, model: str, contents: list, config: types.GenerateContentConfig) -> AsyncIterator[str]:
+        stream = await self.client.aio.models.generate_content_stream(
+            model=model,
+            contents=contents,
+            config=config
+        )
+        usage = None
+        async for chunk in stream:
+            # Every chunk carries the running totals, the last one is final
+            if chunk.usage_metadata:
+                usage = chunk.usage_metadata
+            if chunk.text:
+                yield chunk.text
+        if usage:
+            record_usage(
+                usage.prompt_token_count or 0,
+                usage.candidates_token_count or 0,
+                usage.cached_content_token_count or 0
+            )
+
+    async def upload_file(self, file: IO[bytes], mime_type: str) -> types.File:
+        return await self.client.aio.files.upload(
+            file=file,
+            config=dict(mime_type=mime_type)
+        )
+
+
+# Vocabulary for fake flashcards
+_FAKE_WORDS = [
+    "acid", "algebra", "atom", "battery", "biome", "canal", "carbon", "cell", "climate", "comet",
+    "crystal", "delta", "dialect", "dynasty", "economy", "electron", "empire", "enzyme", "erosion", "fossil",
+    "fraction", "friction", "galaxy", "genome", "glacier", "gravity", "harbor", "habitat", "hormone", "isotope",
+    "kernel", "lattice", "lens", "magnet", "mantle", "matrix", "membrane", "meteor", "molecule", "monsoon",
+    "neuron", "nucleus", "orbit", "parliament", "photon", "plasma", "plateau", "polymer", "prism", "protein",
+    "pulley", "quartz", "reactor", "republic", "ribosome", "river", "satellite", "sediment", "sonnet", "spectrum",
+    "telescope", "tectonics", "theorem", "tide", "treaty", "tundra", "turbine", "vaccine", "valley", "vector",
+    "velocity", "virus", "voltage", "volcano", "wavelength", "wetland",
+]
+
+
+class FakeProvider(LLMProvider):
+    """
+    Deterministic offline backend returning schema-valid flashcards.
+
+    The number of cards is read from the "Generate N" prompt. Output for a
+    given prompt is always the same; latency jitter and injected errors come
+    from a seeded random generator. Output longer than max_output_tokens is
+    cut off like a real truncated response.
+    """
+
+    def __init__(self, latency_ms: float = 500, jitter_ms: float = 100, error_rate: float = 0.0,
+                 stream_chunk_chars: int = 80, stream_delay_ms: float = 20, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.stream_chunk_chars = stream_chunk_chars
+        self.stream_delay_ms = stream_delay_ms
+        self._random = random.Random(seed)
+
+    async def generate(self, model: str, contents: list, config: types.GenerateContentConfig) -> ModelResponse:
+        await self._delay()
+        self._maybe_fail()
+        text, finish_reason = self._output(contents, config)
+        return ModelResponse(
+            text=text,
+            prompt_tokens=self._prompt_tokens(contents),
+            output_tokens=len(text) // 4,
+            finish_reason=finish_reason,
+        )
+
+    async def generate_stream(self, model: str, contents: list, config: types.GenerateContentConfig) -> AsyncIterator[str]:
+        await self._delay()
+        self._maybe_fail()
+        text, _ = self._output(contents, config)
+        for start in range(0, len(text), self.stream_chunk_chars):
+            await asyncio.sleep(self.stream_delay_ms / 1000)
+            yield text[start:start + self.stream_chunk_chars]
+        record_usage(self._prompt_tokens(contents), len(text) // 4)
+
+    async def upload_file(self, file: IO[bytes], mime_type: str) -> types.File:
+        await self._delay()
+        self._maybe_fail()
+        digest = hashlib.sha256(file.read()).hexdigest()[:16]
+        return types.File(
+            name=f"files/fake-{digest}",
+            uri=f"https://fake.local/files/fake-{digest}",
+            mime_type=mime_type,
+            expiration_time=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=48),
+        )
+
+    async def _delay(self) -> None:
+        jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        await asyncio.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+    def _maybe_fail(self) -> None:
+        if self._random.random() < self.error_rate:
+            raise ProviderError("Injected fake provider error", code=503)
+
+    def _prompt_tokens(self, contents: list) -> int:
+        return sum(len(part) for part in contents if isinstance(part, str)) // 4
+
+    def _output(self, contents: list, config: types.GenerateContentConfig) -> tuple:
+        prompt = "\n".join(part for part in contents if isinstance(part, str))
+        # Seeded by the prompt so equal prompts give equal output, with distinct
+        # words per card so they survive near-duplicate filtering
+        words = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+
+        transform = re.search(r"\nFlashcards:\n(\[.*\])\s*$", prompt, re.DOTALL)
+        if transform:
+            # Deck transform, the cards come back marked as rewritten
+            cards = json.loads(transform.group(1))
+            text = json.dumps([
+                {"id": card["id"], "question": f"{card['question']} (rewritten)", "answer": f"{card['answer']} (rewritten)"}
+                for card in cards
+            ])
+        elif config is not None and config.response_schema == list[str]:
+            # Subtopic outline
+            match = re.search(r"List (\d+)", prompt)
+            count = int(match.group(1)) if match else 5
+            text = json.dumps([" ".join(words.sample(_FAKE_WORDS, 2)) for _ in range(count)])
+        else:
+            match = re.search(r"Generate (\d+)", prompt)
+            number = int(match.group(1)) if match else 10
+            # Multi-image prompts label each image, cards name them in turn
+            sources = re.findall(r'^Image "(.+)":$', prompt, re.MULTILINE)
+            cards = []
+            for i in range(number):
+                terms = words.sample(_FAKE_WORDS, 6)
+                cards.append({
+                    "question": f"What links {terms[0]} and {terms[1]} in {terms[2]} (card {i + 1})?",
+                    "answer": f"The {terms[3]} of {terms[4]} shapes {terms[5]}.",
+                })
+                if sources:
+                    cards[-1]["source"] = sources[i % len(sources)]
+            text = json.dumps(cards)
+
+        max_chars = (config.max_output_tokens or 8192) * 4 if config else 8192 * 4
+        if len(text) > max_chars:
+            return text[:max_chars], "MAX_TOKENS"
+        return text, "STOP"
+
+
+_provider: Optional[LLMProvider] = None
+
+
+def get_provider() -> LLMProvider:
+    """Return the provider configured by LLM_PROVIDER, creating it on first use"""
+    global _provider
+    if _provider is None:
+        if settings.LLM_PROVIDER == "fake":
+            _provider = FakeProvider(
+                latency_ms=settings.FAKE_LLM_LATENCY_MS,
+                jitter_ms=settings.FAKE_LLM_JITTER_MS,
+                error_rate=settings.FAKE_LLM_ERROR_RATE,
+                stream_chunk_chars=settings.FAKE_LLM_STREAM_CHUNK_CHARS,
+                stream_delay_ms=settings.FAKE_LLM_STREAM_DELAY_MS,
+                seed=settings.FAKE_LLM_SEED,
+            )
+        elif settings.LLM_PROVIDER == "gemini":
+            _provider = GeminiProvider(api_key=settings.LLM_API_KEY)
+        else:
+            raise ValueError(f"Unknown LLM provider: {settings.LLM_PROVIDER}")
+    return _provider
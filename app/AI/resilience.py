@@ -0,0 +1,171 @@
+"""
+Retries and hedging for upstream model calls and document uploads.
+
+resilient_call runs one attempt of a call and retries it with exponential
+backoff and full jitter when it fails with a retryable error. Each attempt
+applies its own deadline. When hedging is enabled, an attempt that is
+still running after the LLM_HEDGE_PERCENTILE latency of earlier calls gets a
+duplicate, and whichever finishes first wins. Attempts that first wait for
+a scheduler slot call attempt_started once it is granted, so latencies and
+the hedge clock only cover the upstream call, and no duplicate is added
+while the scheduler is saturated. Cancelling the caller, e.g. when a client
+disconnects, cancels every outstanding attempt.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+from app.config import settings
+from app.AI.metrics import metrics
+from app.AI.scheduler import scheduler
+
+T = TypeVar("T")
+
+# Status codes worth another attempt: timeouts, rate limits and server errors
+RETRYABLE_CODES = {408, 429, 500, 502, 503, 504}
+
+# Recent attempt latencies kept per call name for the hedging threshold
+LATENCY_WINDOW = 200
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether a failed attempt may succeed if it is repeated"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # ProviderError and the genai API errors carry an HTTP status code
+    return getattr(error, "code", None) in RETRYABLE_CODES
+
+
+class LatencyTracker:
+    """Sliding window of attempt latencies per call name"""
+
+    def __init__(self, window: int):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, name: str, pct: float, min_samples: int) -> Optional[float]:
+        """The pct-th percentile latency, or None until min_samples were seen"""
+        samples = self._samples.get(name)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+latencies = LatencyTracker(LATENCY_WINDOW)
+
+# Marks the start of the upstream call of the attempt running in this context
+_attempt_started: ContextVar[Optional[Callable[[], None]]] = ContextVar("attempt_started", default=None)
+
+
+def attempt_started() -> None:
+    """Mark that the running attempt has left the scheduler queue and calls upstream"""
+    mark = _attempt_started.get()
+    if mark is not None:
+        mark()
+
+
+async def resilient_call(
+    name: str, attempt: Callable[[], Awaitable[T]], hedge: bool = True, queued: bool = False
+) -> T:
+    """
+    Run attempt with retries and optional hedging.
+
+    Args:
+        name: Call name used for latency tracking and metrics labels
+        attempt: Starts one attempt; it must apply its own deadline
+        hedge: Whether a slow attempt may get a duplicate
+        queued: Whether attempt waits for a scheduler slot and calls
+            attempt_started once it has one
+
+    Returns:
+        The result of the first successful attempt
+
+    Raises:
+        Exception: The error of the last attempt, or the first non-retryable one
+    """
+    attempts = max(1, settings.LLM_RETRY_ATTEMPTS)
+    for number in range(1, attempts + 1):
+        metrics.incr("llm_attempts", call=name)
+        try:
+            return await _hedged(name, attempt, hedge, queued)
+        except Exception as e:
+            if number == attempts or not is_retryable(e):
+                metrics.incr("llm_call_failures", call=name)
+                raise
+
+            delay = random.uniform(
+                0, min(settings.LLM_RETRY_BACKOFF_MAX_SECONDS, settings.LLM_RETRY_BACKOFF_SECONDS * 2 ** (number - 1))
+            )
+            print(f"Retrying {name} call in {delay:.2f}s after attempt {number} failed: {e!r}")
+            metrics.incr("llm_retries", call=name, reason=type(e).__name__)
+            await asyncio.sleep(delay)
+
+
+async def _hedged(name: str, attempt: Callable[[], Awaitable[T]], hedge: bool, queued: bool) -> T:
+    """Run one attempt, adding a duplicate if its upstream call is slower than usual"""
+    started = asyncio.Event()
+
+    async def timed() -> T:
+        start = time.perf_counter()
+
+        def mark() -> None:
+            # Time the upstream call only, not the wait for a scheduler slot
+            nonlocal start
+            start = time.perf_counter()
+            started.set()
+
+        if queued:
+            _attempt_started.set(mark)
+        else:
+            started.set()
+        result = await attempt()
+        latencies.add(name, time.perf_counter() - start)
+        return result
+
+    threshold = None
+    if hedge and settings.LLM_HEDGE_PERCENTILE > 0:
+        threshold = latencies.percentile(name, settings.LLM_HEDGE_PERCENTILE, settings.LLM_HEDGE_MIN_SAMPLES)
+
+    primary = asyncio.ensure_future(timed())
+    tasks = [primary]
+    try:
+        if threshold is not None:
+            # The hedge clock starts when the primary's upstream call does
+            waiter = asyncio.ensure_future(started.wait())
+            try:
+                await asyncio.wait([primary, waiter], return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                waiter.cancel()
+            done = {primary} if primary.done() else set()
+            if not done:
+                done, _ = await asyncio.wait(tasks, timeout=threshold)
+            # A duplicate would only queue behind the backlog it is meant to beat
+            if not done and scheduler.pressure() <= 1:
+                metrics.incr("llm_hedges", call=name)
+                tasks.append(asyncio.ensure_future(timed()))
+
+        # First success wins; fail only once every copy has failed
+        error = None
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is not primary:
+                        metrics.incr("llm_hedge_wins", call=name)
+                    return task.result()
+                error = error or task.exception()
+        raise error
+
+    finally:
+        # Also reached when the caller is cancelled
+        for task in tasks:
+            if not task.done():
+                task.cancel()
@@ -1,18 +1,34 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Body
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Body, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.params import Query
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional, Union
 from enum import Enum
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+import asyncio
 import json
 
-from app.db.database import get_db
+from app.db.database import get_db, AsyncSessionLocal
 from app.auth.auth import get_current_active_user
 from app.auth.models import User
 from app.decks.service import DeckService 
 from app.flashcards.service import FlashcardService
 
-from app.AI.generator import generate_flashcards
+from app.AI.generator import (
+    Flashcard, FlashcardList, generate_flashcards, generate_flashcards_stream, generate_more_flashcards
+)
+from app.AI.cache import generation_cache, upload_cache
+from app.AI.preflight import preflight_text
+from app.AI.uploads import InputTooLargeError, InputUnreadableError, check_upload_sizes
+from app.AI.scheduler import SchedulerOverloaded, scheduler
+from app.AI.sources import DeckSourceService, SourceUnavailableError, load_parts
+from app.AI.jobs import job_queue
+from app.AI.cancellation import (
+    CLIENT_CLOSED_REQUEST, ClientDisconnected, cancel_on_disconnect, ensure_connected, iterate_until_disconnected
+)
+from app.AI.metrics import metrics
+from app.AI.tracing import generation_trace, span
+from app.config import settings
 
 # Define the input types as an Enum for validation
 class InputType(str, Enum):
@@ -24,27 +40,143 @@ class InputType(str, Enum):
 # Request model for generating flashcards
 class FlashcardGenerationRequest(BaseModel):
     input_type: InputType
-    number: int = 10
+    number: int = Field(10, ge=1, le=settings.GENERATION_MAX_CARDS)
     content: Optional[str] = None
     save_to_deck: Optional[bool] = False
     deck_name: Optional[str] = None
 
-# Response model for generated flashcards
-class FlashcardItem(BaseModel):
-    question: str
-    answer: str
+# Response model for generated flashcards, the generator's own card model so
+# generated cards are returned without conversion
+FlashcardItem = Flashcard
 
 class FlashcardsResponse(BaseModel):
     flashcards: List[FlashcardItem]
+    # Cards asked for, and how many of them could not be generated
+    requested: Optional[int] = None
+    shortfall: Optional[int] = None
+
+def _flashcards_response(flashcards: List[Flashcard], requested: int) -> FlashcardsResponse:
+    """Response for a generation, reporting any cards it fell short by"""
+    return FlashcardsResponse(
+        flashcards=flashcards,
+        requested=requested,
+        shortfall=max(0, requested - len(flashcards))
+    )
+
+# Request model for adding generated cards to an existing deck
+class GenerateMoreRequest(BaseModel):
+    number: int = Field(10, ge=1, le=settings.GENERATION_MAX_CARDS)
+
+# Rewrites that can be applied to every card of a deck
+class TransformType(str, Enum):
+    translate = "translate"
+    simplify = "simplify"
+    expand_answers = "expand_answers"
+
+# Request model for transforming an existing deck
+class DeckTransformRequest(BaseModel):
+    transform: TransformType
+    language: Optional[str] = None
+
+# Response models for background generation jobs
+class JobSubmittedResponse(BaseModel):
+    job_id: str
+    status: str
+
+class JobProgress(BaseModel):
+    chunks_total: int
+    chunks_done: int
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str
+    kind: str = "generate"
+    input_type: str
+    number: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    flashcards: Optional[List[FlashcardItem]] = None
+    shortfall: Optional[int] = None
+    deck_id: Optional[int] = None
+    progress: Optional[JobProgress] = None
+    error: Optional[str] = None
 
 # Create AI router
 ai_router = APIRouter(prefix="/ai", tags=["ai"])
 
+def _validate_text_request(request: FlashcardGenerationRequest) -> None:
+    """Reject topic/text requests without content and file input types"""
+    if request.input_type in [InputType.topic, InputType.text] and not request.content:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Content is required for input type '{request.input_type}'"
+        )
+    
+    if request.input_type in [InputType.image, InputType.document]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"For file uploads, use the /ai/generate-with-files endpoint"
+        )
+
+def _preflight_text_request(request: FlashcardGenerationRequest) -> None:
+    """Compact text content and reject oversized text before any work is queued"""
+    if request.input_type != InputType.text:
+        return
+    try:
+        request.content = preflight_text(request.content)
+    except InputTooLargeError as e:
+        raise HTTPException(
+            status_code=413,
+            detail=str(e)
+        )
+
+def _file_input_type(input_type: str) -> InputType:
+    """Parse the input type of a file upload request"""
+    try:
+        input_type_enum = InputType(input_type)
+    except ValueError:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Invalid input type: {input_type}"
+        )
+    
+    if input_type_enum not in [InputType.image, InputType.document]:
+        raise HTTPException(
+            status_code=400,
+            detail=f"This endpoint is only for image or document uploads"
+        )
+    return input_type_enum
+
+def _generation_http_error(error: Exception) -> HTTPException:
+    """Map an error raised by a generation to the HTTP error returned for it"""
+    if isinstance(error, HTTPException):
+        return error
+    if isinstance(error, ClientDisconnected):
+        return HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(error))
+    if isinstance(error, SchedulerOverloaded):
+        return HTTPException(
+            status_code=429,
+            detail=str(error),
+            headers={"Retry-After": str(error.retry_after)}
+        )
+    if isinstance(error, InputTooLargeError):
+        return HTTPException(status_code=413, detail=str(error))
+    if isinstance(error, InputUnreadableError):
+        return HTTPException(status_code=422, detail=str(error))
+    if isinstance(error, TimeoutError):
+        return HTTPException(status_code=504, detail=str(error))
+    return HTTPException(
+        status_code=500,
+        detail=f"Failed to generate flashcards: {str(error)}"
+    )
+
 # Create a separate endpoint for file uploads
-@ai_router.post("/generate-with-files", response_model=FlashcardsResponse)
+@ai_router.post("/generate-with-files", response_model=FlashcardsResponse, response_model_exclude_none=True)
 async def generate_flashcards_with_files(
+    http_request: Request,
     input_type: str = Form(...),
-    number: int = Form(10),
+    number: int = Form(10, ge=1, le=settings.GENERATION_MAX_CARDS),
     content: Optional[str] = Form(None),
     save_to_deck: bool = Form(False),
     deck_name: Optional[str] = Form(None),
@@ -54,129 +186,461 @@ async def generate_flashcards_with_files(
 ):
     """
     Generate flashcards using AI based on image or document files.
+    
+    If the client disconnects, the uploads and model calls are cancelled
+    and no deck is created.
     """
+    input_type_enum = _file_input_type(input_type)
+    
     try:
-        # Validate input type
-        try:
-            input_type_enum = InputType(input_type)
-        except ValueError:
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid input type: {input_type}"
-            )
-        
-        if input_type_enum not in [InputType.image, InputType.document]:
-            raise HTTPException(
-                status_code=400,
-                detail=f"This endpoint is only for image or document uploads"
-            )
+        # Reject oversized files before any of them is read
+        check_upload_sizes(files, settings.UPLOAD_MAX_FILE_BYTES)
             
-        # Generate flashcards using the AI service
-        result = await generate_flashcards(
-            input_types=input_type_enum,
-            number=number, 
-            input_content=content,
-            files=files
-        )
+        with generation_trace(input_type_enum):
+            # Generate flashcards using the AI service, already validated and typed
+            flashcards_list = await cancel_on_disconnect(http_request, generate_flashcards(
+                input_types=input_type_enum,
+                number=number, 
+                input_content=content,
+                files=files,
+                user_id=current_user.id
+            ), "generate-with-files")
         
-        # Parse the result into FlashcardItem objects
-        try:
-            import json
-            flashcards_data = json.loads(result)
-            flashcards_list = [FlashcardItem(question=card["question"], answer=card["answer"]) 
-                               for card in flashcards_data]
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to parse AI response: {str(e)}"
-            )
-        
-        # Save to deck if requested
-        if save_to_deck and deck_name:
-            # Create a new deck
-            new_deck = await DeckService.create_deck(db, deck_name, current_user.id)
+            # Save to deck if requested
+            if save_to_deck and deck_name:
+                # Skip the save if the client has left, the cards stay in the generation cache
+                await ensure_connected(http_request, "generate-with-files")
+                with span("save"):
+                    # Create a new deck
+                    new_deck = await DeckService.create_deck(db, deck_name, current_user.id)
             
-            # Add flashcards to the deck
-            flashcards_to_add = [{"question": card.question, "answer": card.answer} 
-                                for card in flashcards_list]
+                    # Add flashcards to the deck
+                    flashcards_to_add = [{"question": card.question, "answer": card.answer} 
+                                        for card in flashcards_list]
             
-            await FlashcardService.create_flashcards_bulk(
-                db=db,
-                flashcards_data=flashcards_to_add, 
-                deck_id=new_deck.id
-            )
+                    await FlashcardService.create_flashcards_bulk(
+                        db=db,
+                        flashcards_data=flashcards_to_add, 
+                        deck_id=new_deck.id
+                    )
+                    
+                    # Keep the source so more cards can be generated for the deck
+                    await DeckSourceService.save_source(db, new_deck.id, current_user.id, input_type_enum, content, files)
         
-        return FlashcardsResponse(flashcards=flashcards_list)
+        return _flashcards_response(flashcards_list, number)
     
     except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"Failed to generate flashcards: {str(e)}"
-        )
+        raise _generation_http_error(e)
 
 # Keep the original endpoint for text/topic inputs
-@ai_router.post("/generate", response_model=FlashcardsResponse)
+@ai_router.post("/generate", response_model=FlashcardsResponse, response_model_exclude_none=True)
 async def generate_flashcards_endpoint(
     request: FlashcardGenerationRequest,
+    http_request: Request,
     current_user: User = Depends(get_current_active_user),
     db: AsyncSession = Depends(get_db)
 ):
     """
     Generate flashcards using AI based on topic or text input.
+    
+    If the client disconnects, the model calls are cancelled and no deck is
+    created.
     """
+    _validate_text_request(request)
+    
     try:
-        # Validate input based on input type
-        if request.input_type in [InputType.topic, InputType.text] and not request.content:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Content is required for input type '{request.input_type}'"
-            )
+        with generation_trace(request.input_type):
+            # Generate flashcards using the AI service, already validated and typed
+            flashcards_list = await cancel_on_disconnect(http_request, generate_flashcards(
+                input_types=request.input_type,
+                number=request.number, 
+                input_content=request.content,
+                files=None,
+                user_id=current_user.id
+            ), "generate")
         
-        if request.input_type in [InputType.image, InputType.document]:
-            raise HTTPException(
-                status_code=400,
-                detail=f"For file uploads, use the /ai/generate-with-files endpoint"
-            )
+            # Save to deck if requested
+            if request.save_to_deck and request.deck_name:
+                # Skip the save if the client has left, the cards stay in the generation cache
+                await ensure_connected(http_request, "generate")
+                with span("save"):
+                    # Create a new deck
+                    new_deck = await DeckService.create_deck(db, request.deck_name, current_user.id)
             
-        # Generate flashcards using the AI service
-        result = await generate_flashcards(
-            input_types=request.input_type,
-            number=request.number, 
-            input_content=request.content,
-            files=None
-        )
+                    # Add flashcards to the deck
+                    flashcards_to_add = [{"question": card.question, "answer": card.answer} 
+                                        for card in flashcards_list]
+            
+                    await FlashcardService.create_flashcards_bulk(
+                        db=db,
+                        flashcards_data=flashcards_to_add, 
+                        deck_id=new_deck.id
+                    )
+                    
+                    # Keep the source so more cards can be generated for the deck
+                    await DeckSourceService.save_source(db, new_deck.id, current_user.id, request.input_type, request.content)
         
-        # Parse the result into FlashcardItem objects
-        try:
-            import json
-            flashcards_data = json.loads(result)
-            flashcards_list = [FlashcardItem(question=card["question"], answer=card["answer"]) 
-                              for card in flashcards_data]
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Failed to parse AI response: {str(e)}"
-            )
+        return _flashcards_response(flashcards_list, request.number)
+    
+    except Exception as e:
+        raise _generation_http_error(e)
+
+def _stream_event(event: str, data: dict, sse: bool) -> str:
+    """Format one streamed event as an SSE message or an NDJSON line"""
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+@ai_router.post("/generate-stream")
+async def generate_flashcards_stream_endpoint(
+    request: FlashcardGenerationRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Stream flashcards generated from topic or text input as they are produced.
+    
+    Responds with NDJSON by default, or Server-Sent Events when the client
+    sends `Accept: text/event-stream`. Each card is sent as a `card` event,
+    followed by a final `done` event with the card count and saved deck id.
+    """
+    _validate_text_request(request)
+    
+    # Reject before the stream starts, a 429 or 413 cannot be sent mid-stream
+    _preflight_text_request(request)
+    try:
+        scheduler.ensure_capacity()
+    except SchedulerOverloaded as e:
+        raise _generation_http_error(e)
+    
+    sse = "text/event-stream" in http_request.headers.get("accept", "")
+    save = bool(request.save_to_deck and request.deck_name)
+    
+    async def event_stream():
+        count = 0
+        deck_id = None
+        unsaved = []
         
-        # Save to deck if requested
-        if request.save_to_deck and request.deck_name:
-            # Create a new deck
-            new_deck = await DeckService.create_deck(db, request.deck_name, current_user.id)
+        # The stream outlives the request dependencies, so it uses its own session
+        async with AsyncSessionLocal() as db:
+            
+            async def save_batch(cards: List[dict]):
+                # Create the deck lazily so a failed generation leaves no empty deck
+                nonlocal deck_id
+                with span("save"):
+                    if deck_id is None:
+                        deck = await DeckService.create_deck(db, request.deck_name, current_user.id)
+                        deck_id = deck.id
+                        await DeckSourceService.save_source(db, deck_id, current_user.id, request.input_type, request.content)
+                    await FlashcardService.create_flashcards_bulk(
+                        db=db,
+                        flashcards_data=cards,
+                        deck_id=deck_id
+                    )
             
-            # Add flashcards to the deck
-            flashcards_to_add = [{"question": card.question, "answer": card.answer} 
-                                for card in flashcards_list]
+            try:
+                with generation_trace(request.input_type):
+                    cards = generate_flashcards_stream(
+                        input_types=request.input_type,
+                        number=request.number,
+                        input_content=request.content,
+                        files=None,
+                        user_id=current_user.id
+                    )
+                    async for card in iterate_until_disconnected(http_request, cards, "generate-stream"):
+                        count += 1
+                        yield _stream_event("card", card, sse)
+                        
+                        # Persist cards in small batches as they arrive
+                        if save:
+                            unsaved.append(card)
+                            if len(unsaved) >= settings.STREAM_SAVE_BATCH_SIZE:
+                                await save_batch(unsaved)
+                                unsaved = []
+                    
+                    if save and unsaved:
+                        await save_batch(unsaved)
+                
+                # A stream is one model call, large requests can come back short
+                yield _stream_event("done", {
+                    "count": count,
+                    "requested": request.number,
+                    "shortfall": max(0, request.number - count),
+                    "deck_id": deck_id
+                }, sse)
+            
+            except ClientDisconnected:
+                # The generation was cancelled, cards saved so far stay in the deck
+                print(f"Client disconnected from the flashcard stream after {count} cards")
+            except (asyncio.CancelledError, GeneratorExit):
+                # The server stopped the response on a disconnect before the watcher noticed
+                metrics.incr("ai_requests_cancelled", endpoint="generate-stream")
+                print(f"Flashcard stream closed after {count} cards")
+                raise
+            except Exception as e:
+                print(f"Error streaming flashcards: {e}")
+                yield _stream_event("error", {"detail": f"Failed to generate flashcards: {str(e)}", "deck_id": deck_id}, sse)
+    
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(event_stream(), media_type=media_type)
+
+@ai_router.post("/decks/{deck_id}/generate-more", response_model=FlashcardsResponse, response_model_exclude_none=True)
+async def generate_more_flashcards_endpoint(
+    deck_id: int,
+    request: GenerateMoreRequest,
+    http_request: Request,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Generate more flashcards for a deck created by an AI generation.
+    
+    The stored source of the deck is reused, including uploaded documents
+    while their remote copies are valid, and cards already in the deck are
+    excluded. The new cards are added to the deck.
+    """
+    deck = await DeckService.get_deck(db, deck_id, current_user.id)
+    if not deck:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Deck with ID {deck_id} not found"
+        )
+    
+    source = await DeckSourceService.get_source(db, deck_id, current_user.id)
+    if source is None:
+        raise HTTPException(
+            status_code=409,
+            detail="This deck was not generated from a stored topic, text or document"
+        )
+    
+    try:
+        parts = load_parts(source.parts)
+        
+        with generation_trace(source.input_type):
+            existing_cards = await FlashcardService.get_flashcards(db, deck_id)
+            existing = await FlashcardService.get_duplicate_index(db, deck_id)
+            flashcards_list = await cancel_on_disconnect(http_request, generate_more_flashcards(
+                input_types=source.input_type,
+                number=request.number,
+                input_content=source.content,
+                parts=parts,
+                existing_questions=[card.question for card in sorted(existing_cards, key=lambda card: card.id or 0)],
+                existing=existing,
+                user_id=current_user.id
+            ), "generate-more")
             
-            await FlashcardService.create_flashcards_bulk(
-                db=db,
-                flashcards_data=flashcards_to_add, 
-                deck_id=new_deck.id
-            )
+            await ensure_connected(http_request, "generate-more")
+            with span("save"):
+                await FlashcardService.create_flashcards_bulk(
+                    db=db,
+                    flashcards_data=[{"question": card.question, "answer": card.answer} for card in flashcards_list],
+                    deck_id=deck_id
+                )
         
-        return FlashcardsResponse(flashcards=flashcards_list)
+        return _flashcards_response(flashcards_list, request.number)
     
+    except SourceUnavailableError as e:
+        raise HTTPException(
+            status_code=410,
+            detail=str(e)
+        )
     except Exception as e:
+        raise _generation_http_error(e)
+
+@ai_router.post("/decks/{deck_id}/transform", response_model=JobSubmittedResponse, status_code=202)
+async def transform_deck(
+    deck_id: int,
+    request: DeckTransformRequest,
+    current_user: User = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Queue a job rewriting every card of a deck in place.
+    
+    Cards can be translated into `language`, simplified, or given expanded
+    answers. The deck is processed in chunks that are saved as they finish;
+    poll GET /ai/jobs/{job_id} for the progress.
+    """
+    deck = await DeckService.get_deck(db, deck_id, current_user.id)
+    if not deck:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Deck with ID {deck_id} not found"
+        )
+    
+    language = (request.language or "").strip() or None
+    if request.transform == TransformType.translate and not language:
+        raise HTTPException(
+            status_code=400,
+            detail="Language is required to translate a deck"
+        )
+    
+    job_id = await job_queue.submit_transform(
+        user_id=current_user.id,
+        deck_id=deck_id,
+        transform=request.transform.value,
+        language=language
+    )
+    return JobSubmittedResponse(job_id=job_id, status="queued")
+
+@ai_router.post("/jobs", response_model=JobSubmittedResponse, status_code=202)
+async def submit_generation_job(
+    request: FlashcardGenerationRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Queue a topic or text generation to run in the background.
+    
+    Returns a job id immediately; poll GET /ai/jobs/{job_id} for the result.
+    """
+    _validate_text_request(request)
+    _preflight_text_request(request)
+    
+    job_id = await job_queue.submit(
+        user_id=current_user.id,
+        input_type=request.input_type,
+        number=request.number,
+        content=request.content,
+        save_to_deck=request.save_to_deck,
+        deck_name=request.deck_name
+    )
+    return JobSubmittedResponse(job_id=job_id, status="queued")
+
+@ai_router.post("/jobs/with-files", response_model=JobSubmittedResponse, status_code=202)
+async def submit_generation_job_with_files(
+    input_type: str = Form(...),
+    number: int = Form(10, ge=1, le=settings.GENERATION_MAX_CARDS),
+    content: Optional[str] = Form(None),
+    save_to_deck: bool = Form(False),
+    deck_name: Optional[str] = Form(None),
+    files: List[UploadFile] = File(...),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Queue an image or document generation to run in the background.
+    
+    The files are stored with the job, so the request returns as soon as
+    they have been received.
+    """
+    input_type_enum = _file_input_type(input_type)
+    
+    try:
+        check_upload_sizes(files, settings.UPLOAD_MAX_FILE_BYTES)
+    except InputTooLargeError as e:
         raise HTTPException(
-            status_code=500,
-            detail=f"Failed to generate flashcards: {str(e)}"
-        )
\ No newline at end of file
+            status_code=413,
+            detail=str(e)
+        )
+    
+    job_id = await job_queue.submit(
+        user_id=current_user.id,
+        input_type=input_type_enum,
+        number=number,
+        content=content,
+        save_to_deck=save_to_deck,
+        deck_name=deck_name,
+        files=files
+    )
+    return JobSubmittedResponse(job_id=job_id, status="queued")
+
+@ai_router.get("/jobs/{job_id}", response_model=JobStatusResponse)
+async def get_generation_job(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get the status of a generation job, with its flashcards once completed.
+    """
+    job = await job_queue.store.get(job_id, current_user.id)
+    if not job:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Job with ID {job_id} not found"
+        )
+    
+    flashcards = None
+    shortfall = None
+    if job["result"]:
+        flashcards = FlashcardList.validate_json(job["result"])
+        shortfall = max(0, job["number"] - len(flashcards))
+    
+    progress = None
+    if job["progress"]:
+        chunks = json.loads(job["progress"])
+        progress = JobProgress(chunks_total=len(chunks["chunks"]), chunks_done=len(chunks["done"]))
+    
+    return JobStatusResponse(
+        job_id=job["id"],
+        status=job["status"],
+        kind=job["kind"],
+        input_type=job["input_type"],
+        number=job["number"],
+        created_at=job["created_at"],
+        started_at=job["started_at"],
+        finished_at=job["finished_at"],
+        flashcards=flashcards,
+        shortfall=shortfall,
+        deck_id=job["deck_id"],
+        progress=progress,
+        error=job["error"]
+    )
+
+@ai_router.post("/jobs/{job_id}/resume", response_model=JobSubmittedResponse, status_code=202)
+async def resume_generation_job(
+    job_id: str,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Requeue a failed deck transform job.
+    
+    Chunks that were already saved are skipped, the job continues with the
+    remaining ones.
+    """
+    job = await job_queue.store.get(job_id, current_user.id)
+    if not job:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Job with ID {job_id} not found"
+        )
+    
+    if job["kind"] != "transform" or job["status"] != "failed":
+        raise HTTPException(
+            status_code=409,
+            detail="Only failed deck transform jobs can be resumed"
+        )
+    
+    if not await job_queue.resume(job_id, current_user.id):
+        raise HTTPException(
+            status_code=409,
+            detail="The job is no longer failed"
+        )
+    return JobSubmittedResponse(job_id=job_id, status="queued")
+
+@ai_router.get("/metrics")
+async def get_ai_metrics(
+    format: str = Query("json", pattern="^(json|prometheus)$"),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Return AI service counters, gauges, summaries, histograms and generation
+    cache statistics.
+    
+    Pass `format=prometheus` for the Prometheus text exposition format.
+    """
+    if format == "prometheus":
+        return PlainTextResponse(metrics.prometheus(), media_type="text/plain; version=0.0.4")
+    
+    snapshot = metrics.snapshot()
+    snapshot["generation_cache"] = generation_cache.stats()
+    return snapshot
+
+@ai_router.get("/uploads")
+async def get_cached_uploads(
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    List the documents you uploaded that are in the upload cache, with their
+    remote names and expiry times. Superusers see every cached document.
+    """
+    owner = None if getattr(current_user, "is_superuser", False) else current_user.id
+    return {"uploads": upload_cache.entries(owner)}
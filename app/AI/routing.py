@@ -0,0 +1,87 @@
+"""
+Model and output budget routing for generation calls.
+
+Each model call is routed from its input type, estimated input tokens,
+requested number of cards and the current scheduler pressure. Documents and
+long inputs go to LLM_LARGE_MODEL, small requests and calls made while the
+queue is backed up go to LLM_SMALL_MODEL, everything else to LLM_MODEL. The
+output budget is sized to the requested cards instead of always reserving
+LLM_MAX_OUTPUT_TOKENS. Every routed call is logged with its latency and
+recorded in the llm_route_seconds histogram, so the thresholds can be tuned.
+"""
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+from app.config import settings
+from app.AI.metrics import LATENCY_BUCKETS, metrics
+from app.AI.scheduler import scheduler
+from app.AI.tokens import OUTPUT_BUDGET_FRACTION, estimate_output_tokens
+
+
+@dataclass(frozen=True)
+class Route:
+    """Model and output budget chosen for one call"""
+    model: str
+    max_output_tokens: int
+    reason: str
+    input_type: str
+    input_tokens: int
+    number: int
+    pressure: float
+
+
+def choose_route(input_type: str, input_tokens: int, number: int, pressure: Optional[float] = None) -> Route:
+    """
+    Pick the model and output budget for a model call.
+
+    Args:
+        input_type: Input type of the request (topic, text, image, document)
+        input_tokens: Estimated input tokens of the prompt
+        number: Number of cards the call asks for
+        pressure: Scheduler pressure, read from the shared scheduler if None
+
+    Returns:
+        Route: The chosen model, output budget and the reason for the choice
+    """
+    input_type = str(getattr(input_type, "value", input_type))
+    if pressure is None:
+        pressure = scheduler.pressure()
+
+    if input_type == "document" or input_tokens >= settings.ROUTING_LARGE_MIN_INPUT_TOKENS:
+        model, reason = settings.LLM_LARGE_MODEL, "large_input"
+    elif pressure >= settings.ROUTING_PRESSURE_THRESHOLD:
+        model, reason = settings.LLM_SMALL_MODEL, "pressure"
+    elif number <= settings.ROUTING_SMALL_MAX_CARDS and input_tokens <= settings.ROUTING_SMALL_MAX_INPUT_TOKENS:
+        model, reason = settings.LLM_SMALL_MODEL, "small"
+    else:
+        model, reason = settings.LLM_MODEL, "default"
+
+    return Route(
+        model=model or settings.LLM_MODEL,
+        max_output_tokens=output_budget(number),
+        reason=reason,
+        input_type=input_type,
+        input_tokens=input_tokens,
+        number=number,
+        pressure=pressure,
+    )
+
+
+def output_budget(number: int) -> int:
+    """Output tokens to allow for number cards, within the configured bounds"""
+    needed = math.ceil(estimate_output_tokens(number) / OUTPUT_BUDGET_FRACTION)
+    return min(settings.LLM_MAX_OUTPUT_TOKENS, max(settings.ROUTING_MIN_OUTPUT_TOKENS, needed))
+
+
+def record_route(call: str, route: Route, seconds: float, status: str) -> None:
+    """Log a routed call with its observed latency and add it to the metrics"""
+    metrics.histogram(
+        "llm_route_seconds", seconds, LATENCY_BUCKETS,
+        call=call, model=route.model, reason=route.reason, status=status
+    )
+    print(
+        f"Routed {call} call: model={route.model} reason={route.reason} input_type={route.input_type} "
+        f"input_tokens={route.input_tokens} number={route.number} pressure={route.pressure:.2f} "
+        f"max_output_tokens={route.max_output_tokens} latency={seconds:.3f}s status={status}"
+    )
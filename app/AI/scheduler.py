@@ -0,0 +1,216 @@
+"""
+Rate limiting and scheduling of model calls.
+
+Every model call waits for a slot from the shared LLMScheduler. A slot is
+granted when a concurrency slot is free and the request and token buckets,
+sized to the requests-per-minute and tokens-per-minute quota, can cover the
+call. Waiting callers are served by priority class first and round-robin
+between users within a class, so one user's burst cannot starve the rest.
+"""
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Deque, Dict, Optional
+
+from app.config import settings
+from app.AI.metrics import metrics
+
+
+class Priority(IntEnum):
+    """Priority classes, lower values are served first"""
+    INTERACTIVE = 0
+    BULK = 1
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when the interactive queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"AI generation is busy, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount tokens are available (0 if they are now)"""
+        self._refill()
+        # Requests larger than the bucket only need a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class _Waiter:
+    def __init__(self, user_id: str, priority: Priority, tokens: int):
+        self.user_id = user_id
+        self.priority = priority
+        self.tokens = tokens
+        self.enqueued = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class LLMScheduler:
+    """Global gate in front of all model calls"""
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 max_concurrency: int, max_queue: int):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._running = 0
+        # priority -> user_id -> waiters of that user, users in round-robin order
+        self._queues: Dict[Priority, "OrderedDict[str, Deque[_Waiter]]"] = {
+            priority: OrderedDict() for priority in Priority
+        }
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str] = None,
+                   priority: Priority = Priority.INTERACTIVE, tokens: int = 0):
+        """
+        Wait for permission to make one model call.
+
+        Args:
+            user_id: Caller the call is made for, used for fair queuing
+            priority: Priority class of the call
+            tokens: Estimated input plus output tokens of the call
+
+        Raises:
+            SchedulerOverloaded: If the interactive queue is full
+        """
+        await self._acquire(user_id or "anonymous", priority, tokens)
+        try:
+            yield
+        finally:
+            self._running -= 1
+            metrics.set_gauge("llm_inflight", self._running)
+            self._dispatch()
+
+    def queue_depth(self, priority: Optional[Priority] = None) -> int:
+        """Number of callers waiting, optionally for one priority class"""
+        priorities = [priority] if priority is not None else list(Priority)
+        return sum(
+            len(waiters)
+            for p in priorities
+            for waiters in self._queues[p].values()
+        )
+
+    def pressure(self) -> float:
+        """Queued and running calls relative to the concurrency limit"""
+        return (self._running + self.queue_depth()) / self.max_concurrency
+
+    def ensure_capacity(self, priority: Priority = Priority.INTERACTIVE) -> None:
+        """Raise SchedulerOverloaded if a new call of this priority would be rejected"""
+        # Bulk work is already bounded by its own worker pools
+        if priority == Priority.INTERACTIVE and self.queue_depth(priority) >= self.max_queue:
+            metrics.incr("llm_rejected")
+            raise SchedulerOverloaded(self._retry_after())
+
+    async def _acquire(self, user_id: str, priority: Priority, tokens: int) -> None:
+        self.ensure_capacity(priority)
+
+        waiter = _Waiter(user_id, priority, tokens)
+        self._queues[priority].setdefault(user_id, deque()).append(waiter)
+        metrics.set_gauge("llm_queue_depth", self.queue_depth())
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just before the cancellation, hand the slot back
+                self._running -= 1
+                metrics.set_gauge("llm_inflight", self._running)
+            else:
+                self._remove(waiter)
+            self._dispatch()
+            raise
+
+        metrics.observe("llm_queue_wait_seconds", time.monotonic() - waiter.enqueued, priority=priority.name.lower())
+
+    def _dispatch(self) -> None:
+        """Grant slots to waiting callers while concurrency and quota allow"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._running < self.max_concurrency:
+            waiter = self._peek()
+            if waiter is None:
+                break
+
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(waiter.tokens))
+            if wait > 0:
+                # Out of quota, try again once the buckets have refilled
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                break
+
+            self._pop(waiter)
+            self.requests.consume(1)
+            self.tokens.consume(waiter.tokens)
+            self._running += 1
+            waiter.future.set_result(None)
+
+        metrics.set_gauge("llm_queue_depth", self.queue_depth())
+        metrics.set_gauge("llm_inflight", self._running)
+
+    def _peek(self) -> Optional[_Waiter]:
+        """Next waiter: highest priority class, then the next user in turn"""
+        for priority in Priority:
+            users = self._queues[priority]
+            if users:
+                first_user = next(iter(users))
+                return users[first_user][0]
+        return None
+
+    def _pop(self, waiter: _Waiter) -> None:
+        """Remove the head waiter and move its user to the back of the rotation"""
+        users = self._queues[waiter.priority]
+        waiters = users.pop(waiter.user_id)
+        waiters.popleft()
+        if waiters:
+            users[waiter.user_id] = waiters
+
+    def _remove(self, waiter: _Waiter) -> None:
+        users = self._queues[waiter.priority]
+        waiters = users.get(waiter.user_id)
+        if waiters is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del users[waiter.user_id]
+        metrics.set_gauge("llm_queue_depth", self.queue_depth())
+
+    def _retry_after(self) -> int:
+        """Rough time for the current queue to drain at the request rate"""
+        return max(1, math.ceil(self.queue_depth() / self.requests.rate))
+
+
+# Shared scheduler for every model call made by this worker
+scheduler = LLMScheduler(
+    requests_per_minute=settings.LLM_REQUESTS_PER_MINUTE,
+    tokens_per_minute=settings.LLM_TOKENS_PER_MINUTE,
+    max_concurrency=settings.LLM_MAX_CONCURRENCY,
+    max_queue=settings.LLM_MAX_QUEUE,
+)
@@ -0,0 +1,160 @@
+"""
+Stored sources of AI-generated decks.
+
+When a generation is saved to a new deck, its input is kept with the deck:
+the topic or text, and for documents the remote file handles of the uploads
+and the text of inlined documents. Generating more cards for the deck later
+reuses them, so the documents are neither uploaded nor processed again
+while their remote copies are valid.
+
+Like decks, sources are written to Supabase first and fall back to the
+local database. They are keyed by deck id and user, since a Supabase deck
+and a local fallback deck can share an id.
+"""
+import datetime
+import json
+from typing import List, Optional, Union
+
+from fastapi import UploadFile
+from google.genai import types
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db.database import supabase
+from app.decks.models import DeckSource
+from app.AI.utils import upload_documents
+
+# Input types whose source can be stored; images are sent inline and not kept
+STORED_INPUT_TYPES = ("topic", "text", "document")
+
+# Remote files this close to expiry are treated as expired
+EXPIRY_MARGIN = datetime.timedelta(minutes=5)
+
+
+class SourceUnavailableError(ValueError):
+    """Raised when a deck has no stored source, or its uploaded files expired"""
+
+
+class DeckSourceService:
+    """Service for stored deck sources"""
+
+    @staticmethod
+    async def save_source(
+        db: AsyncSession,
+        deck_id: int,
+        user_id: str,
+        input_type: str,
+        content: Optional[str] = None,
+        files: Optional[Union[UploadFile, List[UploadFile]]] = None
+    ) -> None:
+        """
+        Store the input of a generation with the deck it was saved to.
+
+        Documents are taken from the upload cache, or uploaded if the
+        generation itself was served from the generation cache. Failures are
+        logged and do not affect the saved deck.
+        """
+        input_type = str(getattr(input_type, "value", input_type))
+        if input_type not in STORED_INPUT_TYPES:
+            return
+
+        try:
+            parts = None
+            if input_type == "document" and files:
+                parts = dump_parts(await upload_documents(files, user_id=user_id))
+        except Exception as e:
+            print(f"⚠️ Could not store the source of deck {deck_id}: {e}")
+            return
+
+        source = DeckSource(deck_id=deck_id, user_id=user_id, input_type=input_type, content=content, parts=parts)
+
+        # Try to upsert into Supabase first
+        supabase_success = False
+        if supabase:
+            try:
+                source_data = source.to_dict()
+                del source_data['id']
+                response = supabase.table('deck_sources').upsert(source_data, on_conflict='deck_id,user_id').execute()
+                if response and response.data:
+                    print(f"✅ Deck source stored in Supabase: {deck_id}")
+                    supabase_success = True
+                else:
+                    print(f"⚠️ Empty response when storing deck source in Supabase")
+            except Exception as e:
+                print(f"❌ Error storing deck source in Supabase: {e}")
+
+        # Fall back to SQLite if Supabase fails
+        if not supabase_success:
+            print(f"⚠️ Falling back to SQLite for deck source")
+            try:
+                result = await db.execute(
+                    select(DeckSource).where(DeckSource.deck_id == deck_id, DeckSource.user_id == user_id)
+                )
+                existing = result.scalar_one_or_none()
+                if existing is None:
+                    db.add(source)
+                else:
+                    existing.input_type = input_type
+                    existing.content = content
+                    existing.parts = parts
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                print(f"⚠️ Could not store the source of deck {deck_id}: {e}")
+
+    @staticmethod
+    async def get_source(db: AsyncSession, deck_id: int, user_id: str) -> Optional[DeckSource]:
+        """Get the stored source of a user's deck"""
+        # First try Supabase
+        if supabase:
+            try:
+                response = supabase.table('deck_sources').select('*').eq('deck_id', deck_id).eq('user_id', user_id).execute()
+                if response and response.data:
+                    return DeckSource(**response.data[0])
+            except Exception as e:
+                print(f"❌ Error fetching deck source from Supabase: {e}")
+
+        # Fall back to SQLite
+        result = await db.execute(
+            select(DeckSource).where(DeckSource.deck_id == deck_id, DeckSource.user_id == user_id)
+        )
+        return result.scalar_one_or_none()
+
+
+def dump_parts(parts: list) -> str:
+    """Serialize uploaded file handles and inline text Parts to JSON"""
+    items = []
+    for part in parts:
+        if isinstance(part, types.File):
+            items.append({
+                "name": part.name,
+                "uri": part.uri,
+                "mime_type": part.mime_type,
+                "expiration_time": part.expiration_time.isoformat() if part.expiration_time else None,
+            })
+        elif isinstance(part, types.Part) and part.text is not None:
+            items.append({"text": part.text})
+    return json.dumps(items)
+
+
+def load_parts(data: Optional[str]) -> list:
+    """
+    Rebuild prompt parts from their stored JSON.
+
+    Raises:
+        SourceUnavailableError: If an uploaded file has expired
+    """
+    parts = []
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for item in json.loads(data or "[]"):
+        if "text" in item:
+            parts.append(types.Part.from_text(text=item["text"]))
+            continue
+
+        expires = item.get("expiration_time")
+        if expires and datetime.datetime.fromisoformat(expires) - EXPIRY_MARGIN <= now:
+            raise SourceUnavailableError(
+                "The uploaded documents of this deck have expired, generate from the files again"
+            )
+        parts.append(types.File(name=item["name"], uri=item["uri"], mime_type=item["mime_type"]))
+    return parts
@@ -0,0 +1,65 @@
+"""
+Local token estimates for prompts and model output.
+"""
+import math
+from typing import Iterable
+
+from google.genai import types
+
+from app.AI.images import image_dimensions
+
+# Rough averages for Gemini models
+CHARS_PER_TOKEN = 4
+IMAGE_TOKENS = 258  # Per 768x768 tile of an inline image
+DOCUMENT_TOKENS = 2000  # Per uploaded document whose content we do not see
+CARD_OUTPUT_TOKENS = 60  # Per generated question/answer pair
+OUTPUT_BUDGET_FRACTION = 0.6  # Share of max_output_tokens planned for, leaves room for long cards
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a piece of text"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_prompt_tokens(prompt: Iterable) -> int:
+    """
+    Estimate the input tokens of a prompt made of text, Parts and Files.
+
+    Args:
+        prompt: Prompt contents as passed to the model
+
+    Returns:
+        int: Estimated number of input tokens
+    """
+    total = 0
+    for part in prompt:
+        if isinstance(part, str):
+            total += estimate_tokens(part)
+        elif isinstance(part, types.Part) and part.text is not None:
+            total += estimate_tokens(part.text)
+        elif isinstance(part, types.Part) and part.inline_data is not None:
+            total += IMAGE_TOKENS * _image_tiles(part.inline_data.data)
+        else:
+            total += DOCUMENT_TOKENS
+    return total
+
+
+def estimate_output_tokens(number: int) -> int:
+    """Estimate the output tokens needed for number flashcards"""
+    return number * CARD_OUTPUT_TOKENS
+
+
+def max_cards_per_call(max_output_tokens: int) -> int:
+    """Largest number of flashcards one response can safely hold"""
+    return max(1, int(max_output_tokens * OUTPUT_BUDGET_FRACTION) // CARD_OUTPUT_TOKENS)
+
+
+def _image_tiles(data: bytes) -> int:
+    """Number of 768x768 tiles an image is billed as, from its header"""
+    try:
+        width, height = image_dimensions(data)
+    except Exception:
+        return 1
+    if width <= 384 and height <= 384:
+        return 1
+    return math.ceil(width / 768) * math.ceil(height / 768)
@@ -0,0 +1,126 @@
+"""
+Per-generation timing spans and token usage.
+
+A GenerationTrace is opened around each generation request and stored in a
+context variable, so the generator, the scheduler slot and the provider can
+add spans and token usage without passing it around. Tasks started during
+the trace, e.g. the parallel chunks of a long text, copy the context and
+report into the same trace. When the trace ends its spans and tokens are
+recorded as histograms per input_type in the shared metrics registry.
+"""
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from app.AI.cancellation import ClientDisconnected
+from app.AI.metrics import LATENCY_BUCKETS, TOKEN_BUCKETS, metrics
+
+_current_trace: ContextVar[Optional["GenerationTrace"]] = ContextVar("generation_trace", default=None)
+
+
+class GenerationTrace:
+    """Timing spans and token usage of one generation request"""
+
+    def __init__(self, input_type: str):
+        self.input_type = input_type
+        self.started = time.perf_counter()
+        # Span name -> total seconds, spans of parallel calls are summed
+        self.spans: Dict[str, float] = {}
+        self.tokens = {"prompt": 0, "output": 0, "cached": 0}
+        self.model_calls = 0
+        self.cache_hit = False
+
+    def add_span(self, name: str, seconds: float) -> None:
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def add_usage(self, prompt_tokens: int, output_tokens: int, cached_tokens: int = 0) -> None:
+        self.model_calls += 1
+        self.tokens["prompt"] += prompt_tokens
+        self.tokens["output"] += output_tokens
+        self.tokens["cached"] += cached_tokens
+
+    def finish(self, status: str) -> None:
+        """Record the trace in the metrics registry and log a one-line summary"""
+        total = time.perf_counter() - self.started
+        if status == "ok" and self.cache_hit:
+            status = "cached"
+
+        metrics.histogram("generation_seconds", total, LATENCY_BUCKETS, input_type=self.input_type, status=status)
+        for name, seconds in self.spans.items():
+            metrics.histogram("generation_span_seconds", seconds, LATENCY_BUCKETS, input_type=self.input_type, span=name)
+
+        if self.model_calls:
+            metrics.incr("generation_model_calls", self.model_calls, input_type=self.input_type)
+            for kind, count in self.tokens.items():
+                metrics.histogram("generation_tokens", count, TOKEN_BUCKETS, input_type=self.input_type, kind=kind)
+                metrics.incr("generation_tokens_total", count, input_type=self.input_type, kind=kind)
+
+        spans = " ".join(f"{name}={seconds:.3f}s" for name, seconds in self.spans.items())
+        print(
+            f"Generation trace: input_type={self.input_type} status={status} total={total:.3f}s {spans} "
+            f"calls={self.model_calls} tokens={self.tokens['prompt']}/{self.tokens['output']}/{self.tokens['cached']}"
+        )
+
+
+@contextmanager
+def generation_trace(input_type: str):
+    """
+    Trace one generation request from the endpoint down to the model calls.
+
+    Args:
+        input_type: Input type of the request, used as the metrics label
+    """
+    trace = GenerationTrace(str(getattr(input_type, "value", input_type)))
+    token = _current_trace.set(trace)
+    status = "error"
+    try:
+        yield trace
+        status = "ok"
+    except (asyncio.CancelledError, ClientDisconnected):
+        status = "cancelled"
+        raise
+    finally:
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # A streamed response closed from another context, e.g. on disconnect
+            _current_trace.set(None)
+        trace.finish(status)
+
+
+def current_trace() -> Optional[GenerationTrace]:
+    """Return the trace of the running generation, if any"""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str):
+    """Time a block and add it to the current trace under name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start)
+
+
+def record_span(name: str, seconds: float) -> None:
+    """Add a measured duration to the current trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, seconds)
+
+
+def record_cache_hit() -> None:
+    """Mark the current trace as served from the generation cache"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.cache_hit = True
+
+
+def record_usage(prompt_tokens: int, output_tokens: int, cached_tokens: int = 0) -> None:
+    """Add the token usage of one model call to the current trace"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_usage(prompt_tokens, output_tokens, cached_tokens)
@@ -0,0 +1,149 @@
+"""
+Size limits and chunked access to uploaded files.
+
+Starlette spools multipart uploads to temporary files while the request body
+arrives, in memory up to 1 MB and on disk beyond that. UploadLimitMiddleware
+caps the body as it is received. The helpers here check file sizes and
+hash or copy the spooled files in chunks, so a large upload is never held in
+memory as a whole.
+"""
+import asyncio
+import hashlib
+import os
+import shutil
+import weakref
+from typing import List
+
+from fastapi import HTTPException, UploadFile
+
+# Read size used when hashing and copying uploads
+CHUNK_SIZE = 1024 * 1024
+
+# Digests of uploads already hashed during this request
+_digests: "weakref.WeakKeyDictionary[UploadFile, str]" = weakref.WeakKeyDictionary()
+
+
+class InputTooLargeError(ValueError):
+    """Raised when uploaded input exceeds a configured size limit"""
+
+
+class InputUnreadableError(ValueError):
+    """Raised when an uploaded file could not be read, decoded or uploaded"""
+
+
+class UploadLimitMiddleware:
+    """
+    Reject multipart request bodies larger than max_bytes with a 413.
+
+    The declared Content-Length is checked before the body is read, and the
+    bytes actually received are counted so a chunked or understated body is
+    cut off as soon as it passes the limit.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._is_multipart(scope):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            await self._reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised inside form parsing, FastAPI turns it into the response
+                    raise HTTPException(status_code=413, detail=self._detail())
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    def _is_multipart(scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"content-type":
+                return value.startswith(b"multipart/form-data")
+        return False
+
+    def _detail(self) -> str:
+        return f"Upload exceeds the limit of {self.max_bytes} bytes per request"
+
+    async def _reject(self, send) -> None:
+        body = ('{"detail": "' + self._detail() + '"}').encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def upload_size(file: UploadFile) -> int:
+    """Size of an upload in bytes, without reading it"""
+    if file.size is not None:
+        return file.size
+    position = file.file.tell()
+    size = file.file.seek(0, os.SEEK_END)
+    file.file.seek(position)
+    return size
+
+
+def check_upload_sizes(files: List[UploadFile], max_file_bytes: int) -> None:
+    """
+    Reject uploads larger than max_file_bytes before any of them is read.
+
+    Raises:
+        InputTooLargeError: If a file is over the limit
+    """
+    for file in files:
+        size = upload_size(file)
+        if size > max_file_bytes:
+            raise InputTooLargeError(
+                f"File {file.filename} is {size} bytes, the limit per file is {max_file_bytes}"
+            )
+
+
+async def upload_digest(file: UploadFile) -> str:
+    """
+    SHA-256 hex digest of an upload, hashed in chunks off the event loop.
+
+    The digest is remembered for the lifetime of the UploadFile, so the
+    generation cache and the upload cache hash each file only once.
+    """
+    digest = _digests.get(file)
+    if digest is None:
+        digest = await asyncio.to_thread(_hash_file, file.file)
+        _digests[file] = digest
+    return digest
+
+
+async def copy_upload(file: UploadFile, path: str) -> None:
+    """Copy an upload to path in chunks, off the event loop"""
+    await asyncio.to_thread(_copy_file, file.file, path)
+
+
+def _hash_file(fileobj) -> str:
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def _copy_file(fileobj, path: str) -> None:
+    fileobj.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(fileobj, out, CHUNK_SIZE)
+    fileobj.seek(0)
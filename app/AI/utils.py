@@ -1,67 +1,283 @@
-from google import genai
-from PIL import Image
-import io
-from typing import List, Union, Dict, Optional
+from google.genai import types
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+import multiprocessing
+import time
+from typing import List, Union, Dict, Optional, Tuple
 from fastapi import UploadFile
+import asyncio
 import os
 from dotenv import load_dotenv
 
 # Import settings from app config
 from app.config import settings
+from app.AI.images import image_dimensions, preprocess_image
+from app.AI.metrics import metrics
+from app.AI.cache import upload_cache, upload_cache_key, upload_inflight
+from app.AI.providers import get_provider
+from app.AI.resilience import resilient_call
+from app.AI.preflight import compact_text
+from app.AI.scheduler import SchedulerOverloaded
+from app.AI.uploads import InputTooLargeError, InputUnreadableError, upload_digest, upload_size
 
 load_dotenv()
 
-# Use the key from settings
-client = genai.Client(api_key=settings.LLM_API_KEY)
+# Process pool for CPU-heavy image preprocessing, created on first use
+_image_pool: Optional[ProcessPoolExecutor] = None
 
-async def load_images(files: Union[UploadFile, List[UploadFile]]) -> List[Image.Image]:
+def _raise_load_failures(kind: str, total: int, failures: List[Tuple[UploadFile, BaseException]]) -> None:
     """
-    Loads images from FastAPI's UploadFile objects and opens each with PIL.
+    Fail a request if any of its files could not be loaded.
+    
+    A prompt missing some of its files would produce cards that are not
+    based on them, cached under a key that hashes every file.
+    
+    Raises:
+        InputUnreadableError: If a file could not be read, decoded or uploaded
+    """
+    if not failures:
+        return
+    # Overload, timeouts and cancellation keep their own meaning for the caller
+    for _, error in failures:
+        if isinstance(error, (SchedulerOverloaded, TimeoutError, asyncio.CancelledError)):
+            raise error
+    file, error = failures[0]
+    raise InputUnreadableError(
+        f"Could not load {len(failures)} of {total} {kind}s, {file.filename}: {error}"
+    ) from error
+
+def _get_image_pool() -> ProcessPoolExecutor:
+    global _image_pool
+    if _image_pool is None:
+        # Spawn keeps the workers independent of the server's threads and event loop
+        _image_pool = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _image_pool
+
+async def load_images(files: Union[UploadFile, List[UploadFile]]) -> List[types.Part]:
+    """
+    Loads images from FastAPI's UploadFile objects and prepares them for the prompt.
+    
+    See load_named_images.
     
     Args:
         files: Either a single UploadFile or a list of UploadFile objects
     
     Returns:
-        list: A list of opened PIL Image objects
+        list: A list of image Parts ready to add to the prompt
     """
-    images = []
+    return [part for _, part in await load_named_images(files)]
+
+async def load_named_images(files: Union[UploadFile, List[UploadFile]]) -> List[Tuple[str, types.Part]]:
+    """
+    Loads images and pairs each prepared image with a unique name for its file.
     
+    Each image is auto-oriented, downscaled to IMAGE_MAX_EDGE, stripped of
+    metadata and re-encoded in a worker process so the event loop is not
+    blocked by decoding. Only IMAGE_WORKERS images are read into memory at
+    a time.
+    
+    Args:
+        files: Either a single UploadFile or a list of UploadFile objects
+    
+    Returns:
+        list: (name, Part) pairs in upload order, named after the file
+        
+    Raises:
+        InputTooLargeError: If the images exceed IMAGE_MAX_TOTAL_PIXELS together
+        InputUnreadableError: If any image could not be read or decoded
+    """
     # Convert to list if single file
     if not isinstance(files, list):
         files = [files]
     
-    # Process each file
+    # Check each image's dimensions from its header only
+    uploads = []
+    failures = []
+    total_pixels = 0
     for file in files:
         try:
-            # Read file content asynchronously
-            contents = await file.read()
-            
-            # Open image with PIL
-            img = Image.open(io.BytesIO(contents))
-            images.append(img)
+            width, height = await asyncio.to_thread(_header_dimensions, file)
+            total_pixels += width * height
+            uploads.append(file)
             
+        except Exception as e:
+            print(f"Error loading image {file.filename}: {e}")
+            failures.append((file, e))
+    _raise_load_failures("image", len(files), failures)
+    
+    if total_pixels > settings.IMAGE_MAX_TOTAL_PIXELS:
+        raise InputTooLargeError(
+            f"Images contain {total_pixels} pixels, "
+            f"the limit per request is {settings.IMAGE_MAX_TOTAL_PIXELS}"
+        )
+    
+    # Preprocess the images in parallel in the process pool, reading each
+    # one only when a worker is ready for it
+    loop = asyncio.get_running_loop()
+    pool = _get_image_pool()
+    read_semaphore = asyncio.Semaphore(settings.IMAGE_WORKERS)
+    
+    async def preprocess(file: UploadFile):
+        async with read_semaphore:
+            contents = await file.read()
             # Reset file pointer for potential reuse
             await file.seek(0)
-            
-        except Exception as e:
-            print(f"Error loading image: {e}")
-            # Continue with other images
+            return await loop.run_in_executor(
+                pool,
+                preprocess_image,
+                contents,
+                settings.IMAGE_MAX_EDGE,
+                settings.IMAGE_FORMAT,
+                settings.IMAGE_QUALITY
+            )
+    
+    results = await asyncio.gather(
+        *(preprocess(file) for file in uploads),
+        return_exceptions=True
+    )
+    
+    for file, result in zip(uploads, results):
+        if isinstance(result, BaseException):
+            print(f"Error preprocessing image {file.filename}: {result}")
+            failures.append((file, result))
+    _raise_load_failures("image", len(files), failures)
+    
+    images = []
+    names = set()
+    mime_type = f"image/{settings.IMAGE_FORMAT.lower()}"
+    for index, (file, result) in enumerate(zip(uploads, results), start=1):
+        encoded, stats = result
+        print(
+            f"Preprocessed image {file.filename}: "
+            f"{stats['original_size'][0]}x{stats['original_size'][1]} {stats['bytes_before']} bytes -> "
+            f"{stats['size'][0]}x{stats['size'][1]} {stats['bytes_after']} bytes "
+            f"in {stats['seconds'] * 1000:.0f}ms"
+        )
+        metrics.incr("images_preprocessed")
+        metrics.incr("image_bytes_before", stats["bytes_before"])
+        metrics.incr("image_bytes_after", stats["bytes_after"])
+        metrics.incr("image_preprocess_seconds", stats["seconds"])
+        
+        # Names label the images in multi-image prompts, so they must be unique
+        name = file.filename or f"image {index}"
+        if name in names:
+            name = f"{name} ({index})"
+        names.add(name)
+        images.append((name, types.Part.from_bytes(data=encoded, mime_type=mime_type)))
     
     return images
 
-async def upload_documents(files: Union[UploadFile, List[UploadFile]], mime_types: Optional[Dict[str, str]] = None) -> List:
+def _header_dimensions(file: UploadFile) -> tuple:
+    """Read an upload's image dimensions from its header, leaving it rewound"""
+    file.file.seek(0)
+    try:
+        return image_dimensions(file.file)
+    finally:
+        file.file.seek(0)
+
+# Supported mime types mapping
+SUPPORTED_DOCUMENT_TYPES = {
+    'application/pdf': 'application/pdf',
+    'text/javascript': 'text/javascript',
+    'application/x-javascript': 'application/x-javascript',
+    'application/x-python': 'application/x-python',
+    'text/x-python': 'text/x-python',
+    'text/plain': 'text/plain',
+    'text/html': 'text/html',
+    'text/css': 'text/css',
+    'text/markdown': 'text/md',
+    'text/csv': 'text/csv',
+    'text/xml': 'text/xml',
+    'text/rtf': 'text/rtf'
+}
+
+# Text-like documents that can be decoded locally and inlined into the prompt
+INLINE_DOCUMENT_TYPES = {
+    'text/plain',
+    'text/markdown',
+    'text/csv',
+    'text/html',
+    'text/xml',
+    'text/css',
+    'text/javascript',
+    'application/x-javascript',
+    'text/x-python',
+    'application/x-python',
+}
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collects the visible text of an HTML document"""
+    
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in ("p", "br", "div", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6"):
+            self.parts.append("\n")
+    
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+    
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+def extract_document_text(contents: bytes, mime_type: str) -> str:
+    """
+    Decode and normalize a text-like document for inlining into the prompt.
+    
+    Args:
+        contents: Raw bytes of the document
+        mime_type: Mime type of the document
+    
+    Returns:
+        str: Normalized document text
+    """
+    text = contents.decode("utf-8-sig", errors="replace")
+    
+    if mime_type == "text/html":
+        extractor = _HTMLTextExtractor()
+        extractor.feed(text)
+        extractor.close()
+        text = "".join(extractor.parts)
+    
+    # Page chrome is dropped from HTML, code and data keep their lines and indentation
+    return compact_text(text, prose=mime_type == "text/html")
+
+async def upload_documents(
+    files: Union[UploadFile, List[UploadFile]], 
+    mime_types: Optional[Dict[str, str]] = None, 
+    user_id: Optional[str] = None
+) -> List:
     """
     Uploads documents from FastAPI's UploadFile objects to Google Generative AI.
     
+    Small text-like documents (INLINE_DOCUMENT_TYPES up to
+    INLINE_DOCUMENT_MAX_BYTES) are decoded locally and inlined as text parts
+    instead of being uploaded. Documents already uploaded with the same
+    content and mime type are reused from the upload cache until their remote
+    copy expires. The remaining uploads run concurrently, at most
+    UPLOAD_CONCURRENCY at a time.
+    
     Args:
         files: Either a single UploadFile or a list of UploadFile objects
         mime_types: Optional dictionary mapping filename to mime_type override
+        user_id: User the documents are uploaded for, recorded in the upload cache
     
     Returns:
-        list: A list of uploaded file objects from Google Generative AI client
+        list: Inline text Parts and uploaded file objects, in input order
+        
+    Raises:
+        InputUnreadableError: If any document could not be read or uploaded
     """
-    uploaded_files = []
-    
     # Convert to list if single file
     if not isinstance(files, list):
         files = [files]
@@ -70,51 +286,65 @@ async def upload_documents(files: Union[UploadFile, List[UploadFile]], mime_type
     if mime_types is None:
         mime_types = {}
     
-    # Process each file
-    for file in files:
+    upload_semaphore = asyncio.Semaphore(settings.UPLOAD_CONCURRENCY)
+    
+    async def upload_document(file: UploadFile):
+        start = time.perf_counter()
         try:
-            # Read file content asynchronously
-            contents = await file.read()
-            
             # Determine mime type (use provided or infer from content_type)
             mime_type = mime_types.get(file.filename, file.content_type)
             
-            # Supported mime types mapping
-            supported_types = {
-                'application/pdf': 'application/pdf',
-                'text/javascript': 'text/javascript',
-                'application/x-javascript': 'application/x-javascript',
-                'application/x-python': 'application/x-python',
-                'text/x-python': 'text/x-python',
-                'text/plain': 'text/plain',
-                'text/html': 'text/html',
-                'text/css': 'text/css',
-                'text/markdown': 'text/md',
-                'text/csv': 'text/csv',
-                'text/xml': 'text/xml',
-                'text/rtf': 'text/rtf'
-            }
-            
             # Check if mime type is supported
-            if mime_type not in supported_types:
+            if mime_type not in SUPPORTED_DOCUMENT_TYPES:
                 print(f"Warning: Mime type {mime_type} may not be supported. Proceeding anyway.")
             
-            # Convert to BytesIO for upload
-            file_data = io.BytesIO(contents)
+            # Text documents skip the upload round trip entirely
+            if mime_type in INLINE_DOCUMENT_TYPES and upload_size(file) <= settings.INLINE_DOCUMENT_MAX_BYTES:
+                contents = await file.read()
+                await file.seek(0)
+                text = extract_document_text(contents, mime_type)
+                metrics.observe("document_prepare_seconds", time.perf_counter() - start, path="inline", mime_type=mime_type)
+                return types.Part.from_text(text=f"Document: {file.filename}\n\n{text}")
             
-            # Upload to Google Generative AI client
-            uploaded_file = client.files.upload(
-                file=file_data,
-                config=dict(mime_type=mime_type)
-            )
+            # Larger documents are hashed and uploaded from the spooled file
+            # in chunks, never read into memory as a whole
+            key = upload_cache_key(await upload_digest(file), mime_type)
+            cached = upload_cache.get(key)
+            if cached is not None:
+                upload_cache.add_owner(key, user_id)
+                metrics.observe("document_prepare_seconds", time.perf_counter() - start, path="cached", mime_type=mime_type)
+                return cached
             
-            uploaded_files.append(uploaded_file)
+            async def attempt() -> types.File:
+                await file.seek(0)
+                # Upload through the configured provider without blocking the event loop
+                return await asyncio.wait_for(
+                    get_provider().upload_file(file.file, mime_type),
+                    timeout=settings.LLM_TIMEOUT_SECONDS
+                )
             
-            # Reset file pointer for potential reuse
-            await file.seek(0)
+            async def upload() -> types.File:
+                async with upload_semaphore:
+                    # Uploads are retried but never hedged, a duplicate would resend the file
+                    uploaded_file = await resilient_call("upload", attempt, hedge=False)
+                upload_cache.put(key, uploaded_file)
+                return uploaded_file
+            
+            # Identical documents uploaded at the same time share one upload
+            # An upload reads its starter's file, the others upload their own if it leaves
+            uploaded_file = await upload_inflight.do(key, upload, caller_inputs=True)
+            upload_cache.add_owner(key, user_id)
+            metrics.observe("document_prepare_seconds", time.perf_counter() - start, path="upload", mime_type=mime_type)
+            return uploaded_file
             
         except Exception as e:
             print(f"Error uploading document {file.filename}: {e}")
-            # Continue with other documents
+            raise
     
-    return uploaded_files
\ No newline at end of file
+    # Let every upload finish or fail before reporting, none is left running
+    results = await asyncio.gather(*(upload_document(file) for file in files), return_exceptions=True)
+    _raise_load_failures(
+        "document", len(files),
+        [(file, result) for file, result in zip(files, results) if isinstance(result, BaseException)]
+    )
+    return results
@@ -17,5 +17,93 @@ class Settings(BaseSettings):
     
     # AI Configuration
     LLM_API_KEY: str = os.getenv("GEMINI_API_KEY", "")
+    LLM_PROVIDER: str = "gemini"  # "gemini" or "fake" for offline load tests
+    LLM_MODEL: str = "gemini-2.0-flash-lite"
+    LLM_MAX_OUTPUT_TOKENS: int = 8192  # Output budget of one model call
+    LLM_MAX_CONCURRENCY: int = 8  # Max concurrent model calls per worker
+    LLM_TIMEOUT_SECONDS: float = 60.0  # Deadline of one attempt of a model call or upload
+    LLM_REQUESTS_PER_MINUTE: int = 30  # Model request quota
+    LLM_TOKENS_PER_MINUTE: int = 1_000_000  # Model token quota, input plus output
+    LLM_MAX_QUEUE: int = 100  # Interactive calls allowed to wait before returning 429
+    
+    # Retries and hedging of model calls and uploads
+    LLM_RETRY_ATTEMPTS: int = 3  # Attempts per call, including the first
+    LLM_RETRY_BACKOFF_SECONDS: float = 0.5  # Backoff before the first retry, doubled per retry, with full jitter
+    LLM_RETRY_BACKOFF_MAX_SECONDS: float = 8.0  # Upper bound of one backoff
+    LLM_HEDGE_PERCENTILE: float = 0  # Duplicate calls slower than this latency percentile, 0 disables hedging
+    LLM_HEDGE_MIN_SAMPLES: int = 20  # Calls observed before hedging starts
+    
+    # Model routing, an empty model name falls back to LLM_MODEL
+    LLM_SMALL_MODEL: str = ""  # Cheaper model for small requests and calls under queue pressure
+    LLM_LARGE_MODEL: str = ""  # Model for documents and long inputs
+    ROUTING_SMALL_MAX_CARDS: int = 10  # Requests up to this many cards may use the small model
+    ROUTING_SMALL_MAX_INPUT_TOKENS: int = 2_000  # and up to this many estimated input tokens
+    ROUTING_LARGE_MIN_INPUT_TOKENS: int = 30_000  # Inputs from this many estimated tokens use the large model
+    ROUTING_PRESSURE_THRESHOLD: float = 2.0  # Queued plus running calls per slot above which calls use the small model
+    ROUTING_MIN_OUTPUT_TOKENS: int = 1024  # Smallest output budget given to a call
+    
+    # Fake provider behaviour (LLM_PROVIDER=fake)
+    FAKE_LLM_LATENCY_MS: float = 500  # Mean latency of a model call or upload
+    FAKE_LLM_JITTER_MS: float = 100  # Latency varies uniformly by up to this much
+    FAKE_LLM_ERROR_RATE: float = 0.0  # Fraction of calls failing with a 503
+    FAKE_LLM_STREAM_CHUNK_CHARS: int = 80  # Characters per streamed chunk
+    FAKE_LLM_STREAM_DELAY_MS: float = 20  # Delay between streamed chunks
+    FAKE_LLM_SEED: int = 0  # Seed for jitter and injected errors
+    
+    # Generation result cache
+    GENERATION_CACHE_MAX_ENTRIES: int = 512
+    GENERATION_CACHE_TTL_SECONDS: int = 24 * 60 * 60  # 1 day
+    GENERATION_CACHE_DB_PATH: str = ""  # SQLite file for the persistent tier, empty to disable
+    
+    # Map-reduce generation for long text inputs
+    TEXT_CHUNK_MAX_CHARS: int = 12000  # Texts longer than this are split into chunks
+    TEXT_CHUNK_CONCURRENCY: int = 4  # Chunks of one request generated at once
+    TEXT_MAX_INPUT_TOKENS: int = 1_000_000  # Estimated tokens a text input may have after compaction
+    TEXT_OVERFLOW: str = "reject"  # Longer texts are rejected with a 413, or cut to the limit with "trim"
+    
+    # Fan-out for requests with more cards than one response can hold
+    GENERATION_MAX_CARDS: int = 500  # Most cards one generation request may ask for
+    FANOUT_CONCURRENCY: int = 4  # Sub-requests of one request generated at once
+    FANOUT_TOPUP_ROUNDS: int = 2  # Extra calls for cards lost to failures, truncation or duplicates
+    GENERATE_MORE_MAX_EXCLUSIONS: int = 200  # Existing questions listed in the prompt when adding cards to a deck
+    
+    # Near-duplicate detection for flashcards
+    DEDUP_SIMILARITY_THRESHOLD: float = 0.7  # Estimated Jaccard similarity treated as a duplicate
+    DEDUP_INDEX_MAX_DECKS: int = 128  # Deck indexes kept in memory
+    DEDUP_INDEX_TTL_SECONDS: int = 10 * 60  # Rebuild deck indexes after this long
+    
+    # Document uploads
+    UPLOAD_MAX_FILE_BYTES: int = 50 * 1024 * 1024  # Largest accepted uploaded file
+    UPLOAD_MAX_REQUEST_BYTES: int = 100 * 1024 * 1024  # Largest accepted multipart request body
+    UPLOAD_CONCURRENCY: int = 4  # Documents of one request uploaded at once
+    UPLOAD_CACHE_MAX_ENTRIES: int = 1024  # Remote file handles kept for reuse
+    UPLOAD_CACHE_EXPIRY_MARGIN_SECONDS: int = 10 * 60  # Re-upload this long before remote expiry
+    INLINE_DOCUMENT_MAX_BYTES: int = 512 * 1024  # Text documents up to this size are inlined, not uploaded
+    
+    # Image preprocessing
+    IMAGE_MAX_EDGE: int = 1536  # Longest side of images sent to the model, in pixels
+    IMAGE_FORMAT: str = "WEBP"  # Format images are re-encoded to
+    IMAGE_QUALITY: int = 80  # Encoder quality for re-encoded images
+    IMAGE_MAX_TOTAL_PIXELS: int = 200_000_000  # Decoded pixels allowed per request
+    IMAGE_WORKERS: int = 2  # Processes used for image preprocessing
+    IMAGE_BATCH_MAX_TOKENS: int = 4_000  # Estimated image tokens per model call, 0 sends all images in one call
+    IMAGE_BATCH_CONCURRENCY: int = 4  # Image batches of one request generated at once
+    
+    # Background generation jobs
+    JOB_WORKERS: int = 2  # Background workers processing generation jobs
+    JOB_DB_PATH: str = "jobs.db"  # SQLite file holding the job queue
+    JOB_SPOOL_DIR: str = "job_uploads"  # Directory for files of queued jobs
+    JOB_POLL_INTERVAL_SECONDS: float = 5.0  # How often idle workers check for new jobs
+    JOB_HEARTBEAT_SECONDS: float = 15.0  # How often a process renews the leases of the jobs it runs
+    JOB_LEASE_SECONDS: float = 60.0  # Running jobs without a heartbeat for this long are requeued
+    JOB_RETENTION_SECONDS: int = 7 * 24 * 3600  # Finished jobs are deleted after this long, 0 keeps them forever
+    JOB_CLEANUP_INTERVAL_SECONDS: int = 3600  # How often finished jobs past their retention are deleted
+    TRANSFORM_CHUNK_CARDS: int = 200  # Cards loaded, transformed and written back together in a deck transform job
+    TRANSFORM_WORKERS: int = 4  # Chunks of one deck transform job processed in parallel
+    DISCONNECT_POLL_SECONDS: float = 0.5  # How often a running AI request checks whether its client is still connected
+    DISCONNECT_KEEP_RESULTS: bool = False  # Finish generations abandoned by every client into the cache instead of cancelling them
+    
+    # Streaming generation
+    STREAM_SAVE_BATCH_SIZE: int = 5  # Cards written to the deck per insert while streaming
 
 settings = Settings()
\ No newline at end of file
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, UniqueConstraint
 from sqlalchemy.orm import relationship
 
 from app.db.database import Base
@@ -20,4 +20,29 @@ class Deck(Base):
             "id": self.id,
             "name": self.name,
             "user_id": self.user_id
-        }
\ No newline at end of file
+        }
+
+class DeckSource(Base):
+    """Input of the AI generation that created a deck, kept to generate more cards from it"""
+    __tablename__ = "deck_sources"
+    # The deck may live in Supabase, so ids are only unique together with the user
+    __table_args__ = (UniqueConstraint("deck_id", "user_id"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    deck_id = Column(Integer, nullable=False, index=True)
+    user_id = Column(String(36), nullable=False)
+    input_type = Column(String, nullable=False)
+    content = Column(Text, nullable=True)
+    # JSON list of uploaded file handles and inlined document texts
+    parts = Column(Text, nullable=True)
+    
+    # Convert to dict for Supabase API
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "deck_id": self.deck_id,
+            "user_id": self.user_id,
+            "input_type": self.input_type,
+            "content": self.content,
+            "parts": self.parts
+        }
@@ -1,10 +1,11 @@
 from typing import List, Optional
-from sqlalchemy import select
+from sqlalchemy import delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
 
-from app.decks.models import Deck
+from app.decks.models import Deck, DeckSource
 from app.db.database import supabase
+from app.flashcards.service import FlashcardService
 
 class DeckService:
     """Service for deck operations"""
@@ -44,6 +45,19 @@ class DeckService:
         
         return deck
     
+    @staticmethod
+    async def create_deck_with_flashcards(
+        db: AsyncSession, name: str, user_id: str, flashcards_data: List[dict]
+    ) -> Deck:
+        """Create a new deck for a user and bulk insert flashcards into it"""
+        deck = await DeckService.create_deck(db, name, user_id)
+        await FlashcardService.create_flashcards_bulk(
+            db=db,
+            flashcards_data=flashcards_data,
+            deck_id=deck.id
+        )
+        return deck
+    
     @staticmethod
     async def get_decks(db: AsyncSession, user_id: str) -> List[Deck]:
         """Get all decks for a user"""
@@ -152,4 +166,9 @@ class DeckService:
             await db.delete(deck)
             await db.commit()
         
+        # Supabase cascades to the deck's generation source, the local copy
+        # has no foreign key since its deck may live in Supabase
+        await db.execute(delete(DeckSource).where(DeckSource.deck_id == deck_id, DeckSource.user_id == user_id))
+        await db.commit()
+        
         return True
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""
+Near-duplicate detection for flashcards using MinHash sketches and LSH.
+
+Each card is reduced to a fixed-size MinHash signature over character
+shingles of its normalized question and answer. Signatures are split into
+bands and stored in hash buckets, so looking up a card only compares it
+against the few cards that share a bucket instead of the whole deck.
+"""
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+from app.config import settings
+
+# Signature layout: BANDS * ROWS slots, one-permutation MinHash
+NUM_SLOTS = 64
+BANDS = 16
+ROWS = NUM_SLOTS // BANDS
+SHINGLE_SIZE = 4
+
+_NON_WORD = re.compile(r"[^\w\s]")
+
+
+def card_signature(question: str, answer: str) -> Tuple[int, ...]:
+    """
+    Compute the MinHash signature of a flashcard.
+
+    Uses one-permutation hashing: each shingle hash is assigned to one of
+    NUM_SLOTS bins and every bin keeps its minimum, which costs a single
+    hash per shingle. Empty bins borrow the value of the next filled bin.
+
+    Args:
+        question: Flashcard question
+        answer: Flashcard answer
+
+    Returns:
+        tuple: Signature of NUM_SLOTS integers
+    """
+    text = " ".join(_NON_WORD.sub(" ", f"{question} {answer}".casefold()).split())
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+    slots: List[Optional[int]] = [None] * NUM_SLOTS
+    for shingle in shingles:
+        value = hash(shingle) & 0xFFFFFFFFFFFFFFFF
+        slot = value % NUM_SLOTS
+        value //= NUM_SLOTS
+        current = slots[slot]
+        if current is None or value < current:
+            slots[slot] = value
+
+    # Densify: fill empty bins from the next non-empty one, with an offset so
+    # borrowed values do not collide with genuine ones
+    minimums = list(slots)
+    for i, value in enumerate(minimums):
+        if value is None:
+            distance = 1
+            while minimums[(i + distance) % NUM_SLOTS] is None:
+                distance += 1
+            slots[i] = minimums[(i + distance) % NUM_SLOTS] + distance * (1 << 58)
+
+    return tuple(slots)
+
+
+def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return sum(1 for a, b in zip(first, second) if a == b) / NUM_SLOTS
+
+
+class NearDuplicateIndex:
+    """LSH index of card signatures supporting near-duplicate lookups"""
+
+    def __init__(self, threshold: Optional[float] = None):
+        self.threshold = settings.DEDUP_SIMILARITY_THRESHOLD if threshold is None else threshold
+        self._signatures: Dict[Hashable, Tuple[int, ...]] = {}
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def add(self, key: Hashable, signature: Tuple[int, ...]) -> None:
+        """Index a signature under key"""
+        self._signatures[key] = signature
+        for band in range(BANDS):
+            bucket = (band, signature[band * ROWS:(band + 1) * ROWS])
+            self._buckets.setdefault(bucket, []).append(key)
+
+    def find(self, signature: Tuple[int, ...]) -> Optional[Tuple[Hashable, float]]:
+        """
+        Find the most similar indexed card above the threshold.
+
+        Args:
+            signature: Signature of the card to look up
+
+        Returns:
+            tuple: (key, similarity) of the best match, or None
+        """
+        candidates = set()
+        for band in range(BANDS):
+            candidates.update(self._buckets.get((band, signature[band * ROWS:(band + 1) * ROWS]), ()))
+
+        best = None
+        for key in candidates:
+            score = similarity(signature, self._signatures[key])
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (key, score)
+        return best
+
+
+def filter_near_duplicates(
+    cards: Iterable[dict],
+    existing: Optional[NearDuplicateIndex] = None
+) -> Tuple[List[dict], List[dict]]:
+    """
+    Split cards into unique cards and near-duplicates.
+
+    A card is a duplicate if it is similar to an earlier card in the same
+    batch or to a card already in the existing index.
+
+    Args:
+        cards: Flashcard dicts with "question" and "answer" keys
+        existing: Optional index of cards already stored in the deck
+
+    Returns:
+        tuple: (kept, dropped) lists of flashcard dicts
+    """
+    batch = NearDuplicateIndex(threshold=existing.threshold if existing else None)
+    kept, dropped = [], []
+
+    for card in cards:
+        signature = card_signature(card["question"], card["answer"])
+        if batch.find(signature) or (existing is not None and existing.find(signature)):
+            dropped.append(card)
+            continue
+        batch.add(len(kept), signature)
+        kept.append(card)
+
+    return kept, dropped
+
+
+class DeckIndexCache:
+    """Bounded cache of per-deck indexes so each deck is only scanned once"""
+
+    def __init__(self, max_decks: int, ttl_seconds: float):
+        self.max_decks = max_decks
+        self.ttl_seconds = ttl_seconds
+        self._indexes: "OrderedDict[int, Tuple[float, NearDuplicateIndex]]" = OrderedDict()
+
+    def get(self, deck_id: int) -> Optional[NearDuplicateIndex]:
+        """Return the cached index for a deck if it is still fresh"""
+        entry = self._indexes.get(deck_id)
+        if entry is None:
+            return None
+        built_at, index = entry
+        if time.time() - built_at > self.ttl_seconds:
+            del self._indexes[deck_id]
+            return None
+        self._indexes.move_to_end(deck_id)
+        return index
+
+    def put(self, deck_id: int, index: NearDuplicateIndex) -> None:
+        """Store a freshly built index, evicting the least recently used deck"""
+        self._indexes[deck_id] = (time.time(), index)
+        self._indexes.move_to_end(deck_id)
+        while len(self._indexes) > self.max_decks:
+            self._indexes.popitem(last=False)
+
+    def invalidate(self, deck_id: int) -> None:
+        """Forget a deck's index after cards were changed or removed"""
+        self._indexes.pop(deck_id, None)
+
+
+# Shared per-process cache of deck indexes
+deck_indexes = DeckIndexCache(
+    max_decks=settings.DEDUP_INDEX_MAX_DECKS,
+    ttl_seconds=settings.DEDUP_INDEX_TTL_SECONDS,
+)
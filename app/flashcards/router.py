@@ -61,10 +61,15 @@ async def create_flashcard(
 async def create_flashcards_bulk(
     deck_id: int,
     flashcards_data: FlashcardBulkCreate,
+    skip_duplicates: bool = False,
     db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Create multiple flashcards at once in the deck"""
+    """Create multiple flashcards at once in the deck.
+    
+    With skip_duplicates, cards that are near-duplicates of each other or of
+    cards already in the deck are not created.
+    """
     # First check if deck exists and belongs to user
     deck = await DeckService.get_deck(db, deck_id, current_user.id)
     if not deck:
@@ -83,7 +88,8 @@ async def create_flashcards_bulk(
     flashcards = await FlashcardService.create_flashcards_bulk(
         db, 
         cards_data, 
-        deck_id
+        deck_id,
+        skip_duplicates=skip_duplicates
     )
     
     return [FlashcardResponse.model_validate(card) for card in flashcards]
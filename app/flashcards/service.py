@@ -1,10 +1,12 @@
+import asyncio
 from typing import List, Optional
-from sqlalchemy import select
+from sqlalchemy import bindparam, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.flashcards.models import Flashcard
 from app.decks.models import Deck
 from app.db.database import supabase
+from app.flashcards.dedup import NearDuplicateIndex, card_signature, deck_indexes, filter_near_duplicates
 
 class FlashcardService:
     """Service for flashcard operations"""
@@ -42,15 +44,23 @@ class FlashcardService:
             await db.commit()
             await db.refresh(flashcard)
         
+        FlashcardService._index_new_cards(deck_id, [flashcard])
         return flashcard
         
     @staticmethod
     async def create_flashcards_bulk(
-        db: AsyncSession, flashcards_data: List[dict], deck_id: int
+        db: AsyncSession, flashcards_data: List[dict], deck_id: int, skip_duplicates: bool = False
     ) -> List[Flashcard]:
-        """Create multiple flashcards at once"""
+        """Create multiple flashcards at once, optionally skipping near-duplicates"""
         created_flashcards = []
         
+        # Drop cards similar to each other or to cards already in the deck
+        if skip_duplicates and flashcards_data:
+            existing = await FlashcardService.get_duplicate_index(db, deck_id)
+            flashcards_data, dropped = filter_near_duplicates(flashcards_data, existing)
+            if dropped:
+                print(f"⚠️ Skipped {len(dropped)} near-duplicate flashcards for deck {deck_id}")
+        
         # Try to insert into Supabase first (bulk insert)
         supabase_success = False
         if supabase and flashcards_data:
@@ -100,8 +110,39 @@ class FlashcardService:
             for flashcard in created_flashcards:
                 await db.refresh(flashcard)
         
+        FlashcardService._index_new_cards(deck_id, created_flashcards)
         return created_flashcards
     
+    @staticmethod
+    async def get_duplicate_index(db: AsyncSession, deck_id: int) -> NearDuplicateIndex:
+        """Get the near-duplicate index for a deck, building it on first use"""
+        index = deck_indexes.get(deck_id)
+        if index is None:
+            cards = [
+                (card.id, card.question, card.answer)
+                for card in await FlashcardService.get_flashcards(db, deck_id)
+            ]
+            # Hashing a large deck takes a while, keep it off the event loop
+            index = await asyncio.to_thread(FlashcardService._build_duplicate_index, cards)
+            deck_indexes.put(deck_id, index)
+        return index
+    
+    @staticmethod
+    def _build_duplicate_index(cards: List[tuple]) -> NearDuplicateIndex:
+        """Build a near-duplicate index from (id, question, answer) tuples"""
+        index = NearDuplicateIndex()
+        for card_id, question, answer in cards:
+            index.add(card_id, card_signature(question, answer))
+        return index
+    
+    @staticmethod
+    def _index_new_cards(deck_id: int, flashcards: List[Flashcard]) -> None:
+        """Keep an already built deck index in sync with newly created cards"""
+        index = deck_indexes.get(deck_id)
+        if index is not None:
+            for card in flashcards:
+                index.add(card.id, card_signature(card.question, card.answer))
+    
     @staticmethod
     async def get_flashcards(db: AsyncSession, deck_id: int) -> List[Flashcard]:
         """Get all flashcards for a deck"""
@@ -136,6 +177,78 @@ class FlashcardService:
             
         return flashcards
     
+    @staticmethod
+    async def get_flashcards_page(
+        db: AsyncSession, deck_id: int, after_id: Optional[int] = None, limit: int = 100
+    ) -> List[Flashcard]:
+        """Get up to limit flashcards of a deck in id order, starting after after_id"""
+        # First try Supabase
+        if supabase:
+            try:
+                query = supabase.table('flashcards').select('*').eq('deck_id', deck_id)
+                if after_id is not None:
+                    query = query.gt('id', after_id)
+                response = query.order('id').limit(limit).execute()
+                if response and response.data:
+                    return [Flashcard(**card_data) for card_data in response.data]
+            except Exception as e:
+                print(f"❌ Error fetching flashcards page from Supabase: {e}")
+        
+        # Fall back to SQLite, paging by id so each page is an index range scan
+        query = select(Flashcard).where(Flashcard.deck_id == deck_id)
+        if after_id is not None:
+            query = query.where(Flashcard.id > after_id)
+        result = await db.execute(query.order_by(Flashcard.id).limit(limit))
+        return list(result.scalars().all())
+    
+    @staticmethod
+    async def update_flashcards_bulk(db: AsyncSession, deck_id: int, flashcards_data: List[dict]) -> int:
+        """Update the question and answer of many flashcards of a deck at once
+        
+        flashcards_data holds dicts with "id", "question" and "answer" keys.
+        Returns the number of flashcards sent for update.
+        """
+        if not flashcards_data:
+            return 0
+        deck_indexes.invalidate(deck_id)
+        
+        # Try to update in Supabase first (bulk upsert by id)
+        supabase_success = False
+        if supabase:
+            try:
+                supabase_data = [
+                    {
+                        "id": card_data["id"],
+                        "question": card_data["question"],
+                        "answer": card_data["answer"],
+                        "deck_id": deck_id
+                    }
+                    for card_data in flashcards_data
+                ]
+                response = supabase.table('flashcards').upsert(supabase_data).execute()
+                if response:
+                    supabase_success = True
+                    print(f"✅ {len(supabase_data)} flashcards updated in Supabase")
+            except Exception as e:
+                print(f"❌ Error bulk updating flashcards in Supabase: {e}")
+        
+        # Fall back to SQLite if Supabase fails, one executemany statement
+        if not supabase_success:
+            print(f"⚠️ Falling back to SQLite for flashcard bulk update")
+            table = Flashcard.__table__
+            statement = (
+                update(table)
+                .where(table.c.id == bindparam("card_id"), table.c.deck_id == deck_id)
+                .values(question=bindparam("new_question"), answer=bindparam("new_answer"))
+            )
+            await db.execute(statement, [
+                {"card_id": card_data["id"], "new_question": card_data["question"], "new_answer": card_data["answer"]}
+                for card_data in flashcards_data
+            ])
+            await db.commit()
+        
+        return len(flashcards_data)
+    
     @staticmethod
     async def get_flashcard(db: AsyncSession, card_id: int, deck_id: int) -> Optional[Flashcard]:
         """Get a specific flashcard by ID"""
@@ -166,6 +279,7 @@ class FlashcardService:
         # Update the content
         card.question = question
         card.answer = answer
+        deck_indexes.invalidate(deck_id)
         
         # Try to update in Supabase first
         supabase_success = False
@@ -198,6 +312,8 @@ class FlashcardService:
         if not card:
             return False
         
+        deck_indexes.invalidate(deck_id)
+        
         # Try to delete from Supabase first
         supabase_success = False
         if supabase:
@@ -0,0 +1,106 @@
+"""
+Benchmark script for event loop responsiveness during AI generation.
+
+Usage:
+    python benchmark_ai.py [concurrent_ai_requests] [deck_requests]
+
+Measures /decks latency on its own, then again while N concurrent
+/ai/generate calls are in flight. With non-blocking model calls the
+p99 of both runs should stay roughly the same.
+"""
+import asyncio
+import sys
+import time
+import aiohttp
+
+# Base URL for API - make sure this matches your FastAPI server
+API_BASE = "http://localhost:8000/api/v1"
+
+# Test user credentials
+TEST_EMAIL = "test email"
+TEST_PASSWORD = "test password"
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+async def measure_decks(session, headers, count):
+    """Issue sequential GET /decks requests and return their latencies in ms"""
+    latencies = []
+    for _ in range(count):
+        start = time.perf_counter()
+        async with session.get(f"{API_BASE}/decks", headers=headers) as response:
+            await response.read()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+async def generate(session, headers, index):
+    """Fire a single /ai/generate request and return (status, seconds)"""
+    topic_data = {
+        "input_type": "topic",
+        "number": 5,
+        "content": f"Benchmark topic {index}: the history of computing"
+    }
+    start = time.perf_counter()
+    async with session.post(f"{API_BASE}/ai/generate", json=topic_data, headers=headers) as response:
+        await response.read()
+        return response.status, time.perf_counter() - start
+
+def report(label, latencies):
+    print(f"   {label}: n={len(latencies)} "
+          f"p50={percentile(latencies, 50):.1f}ms "
+          f"p95={percentile(latencies, 95):.1f}ms "
+          f"p99={percentile(latencies, 99):.1f}ms "
+          f"max={max(latencies):.1f}ms")
+
+async def run_benchmark(concurrency: int, deck_requests: int):
+    """Compare /decks latency with and without concurrent AI generations"""
+    print("\n⏱️ Benchmarking /decks latency under AI generation load...\n")
+
+    timeout = aiohttp.ClientTimeout(total=300)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        # Step 1: Login to get access token
+        print("🔐 Logging in...")
+        async with session.post(
+            f"{API_BASE}/auth/token",
+            data={"username": TEST_EMAIL, "password": TEST_PASSWORD}
+        ) as response:
+            if response.status != 200:
+                print(f"❌ Login failed with status {response.status}")
+                print(await response.text())
+                return
+            token = (await response.json())["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+            print("✅ Successfully logged in")
+
+        # Step 2: Baseline /decks latency with an idle AI path
+        print("\n📊 Baseline (no AI load)...")
+        baseline = await measure_decks(session, headers, deck_requests)
+        report("baseline", baseline)
+
+        # Step 3: Same measurement while N generations are running
+        print(f"\n🧠 Under load ({concurrency} concurrent /ai/generate calls)...")
+        ai_tasks = [asyncio.create_task(generate(session, headers, i)) for i in range(concurrency)]
+        # Give the generations a moment to reach the model call
+        await asyncio.sleep(0.5)
+        loaded = await measure_decks(session, headers, deck_requests)
+        ai_results = await asyncio.gather(*ai_tasks, return_exceptions=True)
+        report("under load", loaded)
+
+        succeeded = [r for r in ai_results if not isinstance(r, Exception) and r[0] == 200]
+        print(f"   AI calls: {len(succeeded)}/{concurrency} succeeded")
+        if succeeded:
+            durations = [seconds for _, seconds in succeeded]
+            print(f"   AI call duration: avg={sum(durations) / len(durations):.2f}s max={max(durations):.2f}s")
+
+        ratio = percentile(loaded, 99) / max(percentile(baseline, 99), 0.001)
+        print(f"\n🎯 p99 ratio (load / baseline): {ratio:.2f}x")
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    deck_requests = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    asyncio.run(run_benchmark(concurrency, deck_requests))
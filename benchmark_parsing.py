@@ -0,0 +1,81 @@
+"""
+Micro-benchmark for the generation result pipeline.
+
+Usage:
+    python benchmark_parsing.py [repeats]
+
+Compares the old path, where a model response was parsed, dumped back to a
+JSON string and parsed again in the router before being turned into
+response items and bulk-insert dicts, with the current single-parse path.
+Runs offline; no server or API key is needed.
+"""
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from pydantic import BaseModel
+
+from app.AI.generator import FlashcardList
+from app.AI.parsing import parse_cards
+
+CARD_COUNTS = [10, 100, 1000, 10000]
+
+class FlashcardItem(BaseModel):
+    question: str
+    answer: str
+
+def make_response(count):
+    """Build a model response with count flashcards"""
+    return json.dumps([
+        {
+            "question": f"What is the significance of concept number {i} in this subject area?",
+            "answer": f"Concept {i} explains how the related parts interact, with an example of its use.",
+        }
+        for i in range(count)
+    ])
+
+def old_pipeline(raw_text):
+    """Generator json.loads + json.dumps, router json.loads + per-card items"""
+    parsed = json.loads(raw_text)
+    for item in parsed:
+        if not isinstance(item, dict) or "question" not in item or "answer" not in item:
+            raise ValueError("Response items must have 'question' and 'answer' fields")
+    result = json.dumps(parsed)
+
+    flashcards_data = json.loads(result)
+    items = [FlashcardItem(question=card["question"], answer=card["answer"]) for card in flashcards_data]
+    to_add = [{"question": card.question, "answer": card.answer} for card in items]
+    return items, to_add, result
+
+def new_pipeline(raw_text):
+    """Single validated parse, typed cards, cache dump and bulk-insert dicts"""
+    cards = parse_cards(raw_text)
+    items = FlashcardList.validate_python(cards)
+    to_add = [{"question": card.question, "answer": card.answer} for card in items]
+    result = FlashcardList.dump_json(items)
+    return items, to_add, result
+
+def best_time(fn, arg, repeats):
+    """Return the fastest of repeats runs in milliseconds"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    print(f"{'cards':>8} {'old ms':>10} {'new ms':>10} {'speedup':>8}")
+    for count in CARD_COUNTS:
+        raw_text = make_response(count)
+        old = best_time(old_pipeline, raw_text, repeats)
+        new = best_time(new_pipeline, raw_text, repeats)
+        print(f"{count:>8} {old:>10.3f} {new:>10.3f} {old / new:>7.2f}x")
+
+if __name__ == "__main__":
+    main()
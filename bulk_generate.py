@@ -0,0 +1,183 @@
+"""
+Offline bulk flashcard generation from a JSONL manifest.
+
+Usage:
+    python bulk_generate.py manifest.jsonl results.jsonl [--concurrency N]
+                            [--save-decks --user-id USER_ID]
+
+Each manifest line is one generation:
+    {"id": "bio-101", "input_type": "topic", "number": 20, "content": "Cell biology",
+     "deck_name": "Biology 101"}
+    {"id": "notes", "input_type": "document", "number": 30, "files": ["notes/week1.pdf"]}
+
+"id" defaults to the line number and "files" paths are relative to the
+manifest. Generations run through generate_flashcards in-process, at most
+--concurrency at a time, as bulk work under the shared model rate limits.
+Every finished line is appended to the results file right away, so an
+interrupted run skips the lines already completed when it is restarted;
+failed lines are retried. With --save-decks every result is also saved as
+a deck of --user-id, named after "deck_name" or the line id.
+"""
+import argparse
+import asyncio
+import json
+import mimetypes
+import os
+import time
+
+from fastapi import UploadFile
+from starlette.datastructures import Headers
+
+from app.AI.generator import FlashcardList, generate_flashcards
+from app.AI.scheduler import Priority
+from app.AI.sources import DeckSourceService
+from app.AI.tracing import generation_trace
+from app.config import settings
+from app.db.database import AsyncSessionLocal
+from app.db.init_db import create_tables
+from app.decks.service import DeckService
+
+INPUT_TYPES = ("topic", "text", "image", "document")
+
+def read_manifest(path):
+    """Return (id, entry) pairs of a JSONL manifest, skipping blank lines"""
+    entries = []
+    with open(path, encoding="utf-8") as manifest:
+        for line_number, line in enumerate(manifest, start=1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("input_type") not in INPUT_TYPES:
+                raise ValueError(f"Line {line_number}: input_type must be one of {', '.join(INPUT_TYPES)}")
+            number = entry.get("number", 10)
+            if not isinstance(number, int) or not 1 <= number <= settings.GENERATION_MAX_CARDS:
+                raise ValueError(f"Line {line_number}: number must be between 1 and {settings.GENERATION_MAX_CARDS}")
+            entries.append((str(entry.get("id", line_number)), entry))
+    return entries
+
+def completed_ids(path):
+    """Return the ids already completed in an existing results file"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as results:
+        for line in results:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut off by an interrupted write
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+def open_files(paths, base_dir):
+    """Open manifest files as UploadFiles like the API receives them"""
+    uploads = []
+    for path in paths:
+        full_path = os.path.join(base_dir, path)
+        content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        uploads.append(UploadFile(
+            file=open(full_path, "rb"),
+            size=os.path.getsize(full_path),
+            filename=os.path.basename(full_path),
+            headers=Headers({"content-type": content_type})
+        ))
+    return uploads
+
+async def run_entry(entry_id, entry, args, base_dir):
+    """Generate one manifest entry and return its result record"""
+    uploads = []
+    start = time.perf_counter()
+    try:
+        uploads = open_files(entry.get("files", []), base_dir)
+        number = entry.get("number", 10)
+        with generation_trace(entry["input_type"]):
+            cards = await generate_flashcards(
+                input_types=entry["input_type"],
+                number=number,
+                input_content=entry.get("content"),
+                files=uploads or None,
+                user_id=args.user_id or "bulk",
+                priority=Priority.BULK
+            )
+
+        deck_id = None
+        if args.save_decks:
+            async with AsyncSessionLocal() as db:
+                deck = await DeckService.create_deck_with_flashcards(
+                    db, entry.get("deck_name") or entry_id, args.user_id,
+                    [{"question": card.question, "answer": card.answer} for card in cards]
+                )
+                deck_id = deck.id
+                await DeckSourceService.save_source(
+                    db, deck_id, args.user_id, entry["input_type"], entry.get("content"), uploads or None
+                )
+
+        return {
+            "id": entry_id,
+            "status": "ok",
+            "seconds": round(time.perf_counter() - start, 3),
+            "deck_id": deck_id,
+            "shortfall": max(0, number - len(cards)),
+            "flashcards": FlashcardList.dump_python(cards, exclude_none=True),
+        }
+    except Exception as e:
+        return {"id": entry_id, "status": "error", "seconds": round(time.perf_counter() - start, 3), "error": str(e)}
+    finally:
+        for upload in uploads:
+            upload.file.close()
+
+async def run(args):
+    entries = read_manifest(args.manifest)
+    done = completed_ids(args.output)
+    pending = [(entry_id, entry) for entry_id, entry in entries if entry_id not in done]
+    print(f"{len(entries)} manifest lines, {len(entries) - len(pending)} already completed, {len(pending)} to run")
+
+    if args.save_decks:
+        await create_tables()
+
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    counts = {"ok": 0, "error": 0}
+    started = time.perf_counter()
+
+    with open(args.output, "a", encoding="utf-8") as results:
+
+        async def worker(entry_id, entry):
+            async with semaphore:
+                record = await run_entry(entry_id, entry, args, base_dir)
+
+            # Checkpoint each line as soon as it finishes
+            results.write(json.dumps(record) + "\n")
+            results.flush()
+            os.fsync(results.fileno())
+
+            counts[record["status"]] += 1
+            finished = counts["ok"] + counts["error"]
+            detail = f"{len(record['flashcards'])} cards" if record["status"] == "ok" else record["error"]
+            print(f"[{finished}/{len(pending)}] {record['status']} {entry_id} in {record['seconds']:.1f}s: {detail}")
+
+        await asyncio.gather(*(worker(entry_id, entry) for entry_id, entry in pending))
+
+    print(f"Finished {counts['ok']} ok, {counts['error']} failed in {time.perf_counter() - started:.1f}s")
+    if counts["error"]:
+        print("Run again with the same arguments to retry the failed lines")
+    return 1 if counts["error"] else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate flashcards for every line of a JSONL manifest")
+    parser.add_argument("manifest", help="JSONL manifest of topics, texts and files")
+    parser.add_argument("output", help="JSONL results file, also the checkpoint of the run")
+    parser.add_argument("--concurrency", type=int, default=4, help="Generations in flight at once (default 4)")
+    parser.add_argument("--save-decks", action="store_true", help="Save every result as a deck")
+    parser.add_argument("--user-id", help="Owner of the saved decks")
+    args = parser.parse_args()
+
+    if args.save_decks and not args.user_id:
+        parser.error("--save-decks requires --user-id")
+
+    raise SystemExit(asyncio.run(run(args)))
+
+if __name__ == "__main__":
+    main()
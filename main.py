@@ -5,6 +5,8 @@ import asyncio
 from app.api.api import api_router
 from app.config import settings
 from app.db.init_db import create_tables
+from app.AI.jobs import job_queue
+from app.AI.uploads import UploadLimitMiddleware
 
 # Create FastAPI application
 app = FastAPI(
@@ -13,6 +15,10 @@ app = FastAPI(
     version="0.1.0",
 )
 
+# Cap multipart upload bodies while they are received. Added before CORS so
+# CORS wraps it and its 413 responses carry the CORS headers
+app.add_middleware(UploadLimitMiddleware, max_bytes=settings.UPLOAD_MAX_REQUEST_BYTES)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -39,6 +45,13 @@ async def root():
 async def on_startup():
     # Create database tables if they don't exist
     await create_tables()
+    # Start background workers for queued AI generation jobs
+    await job_queue.start()
+
+# Shutdown event to stop background workers
+@app.on_event("shutdown")
+async def on_shutdown():
+    await job_queue.stop()
 
 if __name__ == "__main__":
     import uvicorn
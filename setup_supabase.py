@@ -28,6 +28,17 @@ CREATE TABLE IF NOT EXISTS flashcards (
     answer TEXT NOT NULL,
     deck_id INTEGER REFERENCES decks(id) ON DELETE CASCADE
 );
+
+-- Create deck_sources table, the input an AI-generated deck was made from
+CREATE TABLE IF NOT EXISTS deck_sources (
+    id SERIAL PRIMARY KEY,
+    deck_id INTEGER REFERENCES decks(id) ON DELETE CASCADE,
+    user_id UUID REFERENCES users(id) ON DELETE CASCADE,
+    input_type TEXT NOT NULL,
+    content TEXT,
+    parts TEXT,
+    UNIQUE (deck_id, user_id)
+);
 """
 
 async def setup_supabase_tables():
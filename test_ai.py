@@ -11,6 +11,21 @@ API_BASE = "http://localhost:8000/api/v1/ai"  # Updated with correct path
 TEST_EMAIL = "test email"
 TEST_PASSWORD = "test password"
 
+async def wait_for_job(session, job_id, headers, attempts=60):
+    """Poll a background job until it completes or fails"""
+    for _ in range(attempts):
+        async with session.get(f"{API_BASE}/jobs/{job_id}", headers=headers) as response:
+            if response.status != 200:
+                print(f"❌ Job status failed with status {response.status}")
+                print(await response.text())
+                return None
+            job = await response.json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        await asyncio.sleep(1)
+    print(f"⚠️ Job {job_id} still {job['status']} after {attempts} polls")
+    return job
+
 async def run_ai_tests():
     """Run tests for the AI flashcard generation API"""
     print("\n🧠 Testing FlashForge AI Flashcard Generation API...\n")
@@ -130,6 +145,131 @@ async def run_ai_tests():
                         print(f"⚠️ Request failed, retrying ({retry_count}/{max_retries}): {str(e)}")
                         await asyncio.sleep(2)  # Wait before retrying
             
+            # Streamed generation, saved to a new deck for the deck tests below
+            print("\n📡 Testing streamed flashcard generation...")
+            stream_data = {
+                "input_type": "topic",
+                "number": 3,
+                "content": "Inner planets",
+                "save_to_deck": True,
+                "deck_name": "AI Streamed Planets"
+            }
+            deck_id = None
+            
+            retry_count = 0
+            while retry_count <= max_retries:
+                try:
+                    async with session.post(
+                        f"{API_BASE}/generate-stream",
+                        json=stream_data,
+                        headers=headers,
+                        timeout=aiohttp.ClientTimeout(total=120)
+                    ) as response:
+                        if response.status != 200:
+                            print(f"❌ Streamed generation failed with status {response.status}")
+                            print(await response.text())
+                            break
+                        
+                        events = []
+                        async for line in response.content:
+                            if line.strip():
+                                events.append(json.loads(line))
+                        
+                        cards = [event["data"] for event in events if event["event"] == "card"]
+                        done = events[-1] if events else {}
+                        if done.get("event") != "done":
+                            print(f"❌ Stream did not end with a done event: {done}")
+                        elif done["data"]["count"] != len(cards) or len(cards) > stream_data["number"]:
+                            print(f"❌ Stream sent {len(cards)} cards but reported {done['data']['count']}")
+                        else:
+                            deck_id = done["data"]["deck_id"]
+                            print(f"✅ Streamed {len(cards)} flashcards into deck {deck_id} (shortfall {done['data']['shortfall']})")
+                        break
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retry_count += 1
+                    if retry_count > max_retries:
+                        print(f"❌ Failed after {max_retries} attempts: {str(e)}")
+                    else:
+                        print(f"⚠️ Request failed, retrying ({retry_count}/{max_retries}): {str(e)}")
+                        await asyncio.sleep(2)  # Wait before retrying
+            
+            # Background generation job
+            print("\n⏳ Testing background generation job...")
+            try:
+                async with session.post(
+                    f"{API_BASE}/jobs",
+                    json={"input_type": "topic", "number": 3, "content": "Moons of Jupiter"},
+                    headers=headers
+                ) as response:
+                    if response.status != 202:
+                        print(f"❌ Job submission failed with status {response.status}")
+                        print(await response.text())
+                    else:
+                        job_id = (await response.json())["job_id"]
+                        job = await wait_for_job(session, job_id, headers)
+                        if job and job["status"] == "completed" and len(job["flashcards"]) + job["shortfall"] == 3:
+                            print(f"✅ Job {job_id} completed with {len(job['flashcards'])} flashcards")
+                        else:
+                            print(f"❌ Job {job_id} did not complete: {job}")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"❌ Job test error: {str(e)}")
+            
+            if deck_id:
+                # More cards for the streamed deck, generated from its stored source
+                print("\n➕ Testing generating more cards for a deck...")
+                try:
+                    async with session.post(
+                        f"{API_BASE}/decks/{deck_id}/generate-more",
+                        json={"number": 2},
+                        headers=headers,
+                        timeout=aiohttp.ClientTimeout(total=120)
+                    ) as response:
+                        if response.status != 200:
+                            print(f"❌ Generate more failed with status {response.status}")
+                            print(await response.text())
+                        else:
+                            result = await response.json()
+                            if len(result["flashcards"]) + result["shortfall"] != 2:
+                                print(f"❌ Generate more returned an inconsistent count: {result}")
+                            else:
+                                print(f"✅ Added {len(result['flashcards'])} flashcards to deck {deck_id}")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"❌ Generate more error: {str(e)}")
+                
+                # Rewriting the whole deck as a resumable job
+                print("\n✏️ Testing deck transform...")
+                try:
+                    async with session.post(
+                        f"{API_BASE}/decks/{deck_id}/transform",
+                        json={"transform": "simplify"},
+                        headers=headers
+                    ) as response:
+                        if response.status != 202:
+                            print(f"❌ Deck transform failed with status {response.status}")
+                            print(await response.text())
+                        else:
+                            job_id = (await response.json())["job_id"]
+                            job = await wait_for_job(session, job_id, headers)
+                            if job and job["status"] == "completed":
+                                progress = job["progress"]
+                                print(f"✅ Transformed deck {deck_id} in {progress['chunks_done']}/{progress['chunks_total']} chunks")
+                            else:
+                                print(f"❌ Transform job {job_id} did not complete: {job}")
+                    
+                    async with session.post(
+                        f"{API_BASE}/decks/{deck_id}/transform",
+                        json={"transform": "translate"},
+                        headers=headers
+                    ) as response:
+                        if response.status == 400:
+                            print("✅ Translate without a language was rejected")
+                        else:
+                            print(f"❌ Translate without a language returned {response.status}")
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print(f"❌ Deck transform error: {str(e)}")
+            else:
+                print("\n⚠️ Skipping deck tests, the streamed deck was not created")
+            
             # Optional: Test image-based flashcard generation
             image_file_path = "test_image.jpg"
             if os.path.exists(image_file_path):
@@ -0,0 +1,153 @@
+"""
+Offline checks of the AI helpers that need no server, database or model.
+
+Run directly with `python test_ai_helpers.py`, or collect with pytest.
+"""
+import json
+import traceback
+
+from app.AI.chunking import allocate_counts, split_text
+from app.AI.parsing import IncrementalCardParser, parse_cards, salvage_cards
+from app.AI.preflight import compact_text
+from app.flashcards.dedup import NearDuplicateIndex, card_signature, filter_near_duplicates
+
+CARDS = [
+    {"question": "What is the largest planet?", "answer": "Jupiter"},
+    {"question": "Which planet has {rings}?", "answer": "Saturn, the \"ringed\" planet"},
+    {"question": "What is the closest planet to the Sun?", "answer": "Mercury"},
+]
+
+
+# Parsing of model output
+
+def test_parse_cards_accepts_wrapper():
+    assert parse_cards(json.dumps(CARDS)) == CARDS
+    assert parse_cards(json.dumps({"flashcards": CARDS})) == CARDS
+
+def test_salvage_cards_from_truncated_output():
+    text = json.dumps(CARDS)
+    # Cut inside the last card: only the complete ones are recovered
+    truncated = text[:text.rindex("Mercury")]
+    assert salvage_cards(truncated) == CARDS[:2]
+    assert salvage_cards(json.dumps({"flashcards": CARDS})[:-2]) == CARDS
+
+def test_salvage_cards_skips_invalid_items():
+    text = '[{"question": "Q1", "answer": "A1"}, {"question": 3}, {"answer": "no question"}, {"question": "Q2", "answer": "A2"}'
+    assert salvage_cards(text) == [
+        {"question": "Q1", "answer": "A1"},
+        {"question": "Q2", "answer": "A2"},
+    ]
+
+def test_incremental_parser_in_chunks():
+    text = json.dumps(CARDS)
+    for size in (1, 7, 64):
+        parser = IncrementalCardParser()
+        cards = []
+        for start in range(0, len(text), size):
+            cards.extend(parser.feed(text[start:start + size]))
+        assert cards == CARDS, f"chunk size {size}"
+        assert parser.pending == ""
+
+def test_incremental_parser_returns_cards_as_they_close():
+    parser = IncrementalCardParser()
+    text = json.dumps(CARDS)
+    first_end = text.index("}") + 1
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.pending
+    assert parser.feed(text[first_end - 1:first_end]) == CARDS[:1]
+
+
+# Splitting of long text inputs
+
+def test_split_text_respects_limit_and_order():
+    paragraphs = [f"Paragraph {i} explains topic number {i} in a few words." for i in range(40)]
+    text = "\n\n".join(paragraphs)
+    chunks = split_text(text, 300)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 300 for chunk in chunks)
+    # Nothing is lost or reordered, paragraphs are never cut
+    assert "\n\n".join(chunks).split("\n\n") == paragraphs
+
+def test_split_text_splits_overlong_sentences():
+    sentence = " ".join(["word"] * 200) + "."
+    chunks = split_text(sentence, 50)
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert " ".join(chunks).split() == sentence.split()
+
+def test_allocate_counts_adds_up():
+    for number, weights in [(10, [1, 1, 1]), (7, [500, 300, 200]), (2, [1, 1, 1, 1]), (300, [13, 0, 987])]:
+        counts = allocate_counts(number, weights)
+        assert sum(counts) == number, (number, weights, counts)
+        assert len(counts) == len(weights)
+    assert allocate_counts(10, [3, 1]) == [8, 2]
+    assert allocate_counts(5, [0, 0]) == [0, 0]
+
+
+# Near-duplicate elimination
+
+def test_filter_near_duplicates_within_batch():
+    cards = [
+        {"question": "What is the largest planet in the solar system?", "answer": "Jupiter"},
+        {"question": "What is the largest planet in the Solar System?", "answer": "Jupiter."},
+        {"question": "Which planet is closest to the Sun?", "answer": "Mercury"},
+    ]
+    kept, dropped = filter_near_duplicates(cards)
+    assert kept == [cards[0], cards[2]]
+    assert dropped == [cards[1]]
+
+def test_filter_near_duplicates_against_deck():
+    existing = NearDuplicateIndex()
+    existing.add(1, card_signature("Which planet is closest to the Sun?", "Mercury"))
+    cards = [
+        {"question": "Which planet is the closest to the Sun?", "answer": "Mercury"},
+        {"question": "What gas do plants absorb?", "answer": "Carbon dioxide"},
+    ]
+    kept, dropped = filter_near_duplicates(cards, existing)
+    assert kept == [cards[1]]
+    assert dropped == [cards[0]]
+
+
+# Compaction of text inputs
+
+def test_compact_text_keeps_content():
+    text = (
+        "Home\nAbout\nMenu\n\n"
+        "(c) Mitochondria produce most of the cell ATP.\n\n"
+        "Copyright law protects original works of authorship.\n\n"
+        "The nucleus   stores the genetic material.\n\n"
+        "The nucleus stores the genetic material.\n\n"
+        "© 2024 Acme Inc. All rights reserved."
+    )
+    assert compact_text(text, prose=True) == (
+        "(c) Mitochondria produce most of the cell ATP.\n\n"
+        "Copyright law protects original works of authorship.\n\n"
+        "The nucleus stores the genetic material."
+    )
+
+def test_compact_text_keeps_single_navigation_words():
+    text = "Search\n\nBinary search halves the interval on every step."
+    assert compact_text(text, prose=True) == text
+
+def test_compact_text_keeps_code_lines():
+    code = "def area(r):\n    return   3.14 * r * r\n\n\n\nprint(area(2))\nprint(area(2))"
+    assert compact_text(code) == "def area(r):\n    return   3.14 * r * r\n\nprint(area(2))\nprint(area(2))"
+
+
+def run_checks():
+    """Run every check in this module and print a summary"""
+    print("\n🧪 Checking AI helpers offline...\n")
+    checks = [(name, check) for name, check in globals().items() if name.startswith("test_") and callable(check)]
+    failed = 0
+    for name, check in checks:
+        try:
+            check()
+            print(f"✅ {name}")
+        except Exception:
+            failed += 1
+            print(f"❌ {name}")
+            print(traceback.format_exc())
+    print(f"\n🎯 {len(checks) - failed}/{len(checks)} AI helper checks passed")
+    return failed == 0
+
+if __name__ == "__main__":
+    raise SystemExit(0 if run_checks() else 1)